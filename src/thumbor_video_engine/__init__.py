@@ -1,3 +1,6 @@
+import os
+from tempfile import gettempdir
+
 from thumbor.config import Config
 
 
@@ -46,6 +49,31 @@ Config.define(
     "frame delays) or when the gifski binary is not available.",
     'Video')
 
+Config.define(
+    'FFMPEG_GIF_PALETTE_SINGLE_PASS',
+    True,
+    'If True, the legacy gif pipeline generates and applies its palette in a '
+    'single ffmpeg run (split, palettegen, paletteuse), decoding the source '
+    'once instead of twice. ffmpeg then holds the scaled frames in memory '
+    'until the palette is complete, so the bounded-memory fallback for gifski '
+    'outputs above GIFSKI_MAX_TARGET_PIXELS always uses two runs.',
+    'Video')
+
+Config.define(
+    'FFMPEG_GIF_PALETTE_STATS_MODE',
+    None,
+    "The palettegen stats_mode for the legacy gif pipeline: 'full', 'diff' "
+    "or 'single' (a palette per frame). None uses ffmpeg's default ('full').",
+    'Video')
+
+Config.define(
+    'FFMPEG_GIF_DITHER',
+    None,
+    "The paletteuse dither option for the legacy gif pipeline, e.g. 'bayer', "
+    "'floyd_steinberg' or 'none'. None uses ffmpeg's default "
+    "('sierra2_4a').",
+    'Video')
+
 Config.define(
     'GIFSKI_PATH',
     None,
@@ -110,6 +138,217 @@ Config.define(
     'Path for the ffprobe binary',
     'Video')
 
+Config.define(
+    'FFMPEG_PIPE_INPUT',
+    True,
+    'If True, stream the source to ffmpeg on stdin instead of writing it to a '
+    'temp file, for containers that can be read without seeking (webm, gif '
+    'with ffmpeg 7.0+, and mp4/mov files whose moov box precedes the media '
+    'data). Other sources still go through a temp file.',
+    'Video')
+
+Config.define(
+    'FFMPEG_PIPE_OUTPUT',
+    True,
+    "If True, read ffmpeg's output from its stdout instead of a temp file for "
+    'formats that can be muxed without seeking back (gif, animated webp and '
+    'fragmented mp4). Faststart mp4 and webm output still use a temp file.',
+    'Video')
+
+Config.define(
+    'FFPROBE_CACHE',
+    'thumbor_video_engine.probe_caches.memory',
+    'The cache for source metadata (size, duration, frame rate) read with '
+    'ffprobe, keyed by a digest of the source. '
+    "'thumbor_video_engine.probe_caches.memory' is an in-process LRU cache, "
+    "and 'thumbor_video_engine.probe_caches.file' is stored on disk and shared "
+    'by all thumbor processes on a host. None disables the cache.',
+    'Video')
+
+Config.define(
+    'FFPROBE_CACHE_MAX_ENTRIES',
+    1024,
+    'The maximum number of sources kept in FFPROBE_CACHE before the least '
+    'recently used entries are evicted',
+    'Video')
+
+Config.define(
+    'FFPROBE_CACHE_FILE_STORAGE_ROOT_PATH',
+    os.path.join(gettempdir(), 'thumbor_video_engine', 'ffprobe_cache'),
+    'The directory used by thumbor_video_engine.probe_caches.file',
+    'Video')
+
+Config.define(
+    'FFMPEG_STILL_DIRECT',
+    True,
+    'If True, the still() frame of a video is encoded in the requested jpg, '
+    'webp or png format by ffmpeg, with the crop and resize of the request, '
+    'rather than handed to the image engine as a png. Requests with filters '
+    'that need the decoded image still go through the image engine.',
+    'Video')
+
+Config.define(
+    'FFMPEG_LOWRES_DECODE',
+    True,
+    'If True, downscaled transcodes of mjpeg, mpeg-4 part 2, h.263 and mpeg-1/2 '
+    'video sources are decoded at 1/2, 1/4 or 1/8 of the source size (with '
+    "ffmpeg's -lowres), whichever is the smallest that is still at least as "
+    'large as the output.',
+    'Video')
+
+Config.define(
+    'FFMPEG_FAST_DECODE_RATIO',
+    3,
+    'Transcodes of video sources that scale the crop down by at least this '
+    'ratio along both sides decode it with -skip_loop_filter all and -flags2 '
+    'fast, as the artifacts that this lets through are too small to see at '
+    'the output size. 0 disables it.',
+    'Video')
+
+Config.define(
+    'FFMPEG_GIF_KEYFRAMES_ONLY',
+    True,
+    'If True, gifs made from a video source at a frame rate that it has a '
+    'keyframe for every frame of are made from its keyframes alone (with '
+    '-skip_frame nokey), without decoding the frames between them.',
+    'Video')
+
+Config.define(
+    'FFMPEG_INTERMEDIATE_CACHE',
+    False,
+    'If True, resized derivatives of a video source are transcoded from a '
+    'downscaled intermediate of it, at the smallest of '
+    'FFMPEG_INTERMEDIATE_SIZES that is still at least as large as the output, '
+    'rather than from the original. Intermediates are made on first use and '
+    'stored in FFMPEG_INTERMEDIATE_CACHE_PATH.',
+    'Video')
+
+Config.define(
+    'FFMPEG_INTERMEDIATE_SIZES',
+    [1080, 720, 480],
+    'The sizes, in pixels along the shorter side, of the intermediates kept '
+    'by FFMPEG_INTERMEDIATE_CACHE',
+    'Video')
+
+Config.define(
+    'FFMPEG_INTERMEDIATE_CRF',
+    14,
+    'The libx264 -crf of the intermediates kept by FFMPEG_INTERMEDIATE_CACHE',
+    'Video')
+
+Config.define(
+    'FFMPEG_INTERMEDIATE_PRESET',
+    'veryfast',
+    'The libx264 -preset of the intermediates kept by FFMPEG_INTERMEDIATE_CACHE',
+    'Video')
+
+Config.define(
+    'FFMPEG_INTERMEDIATE_CACHE_PATH',
+    os.path.join(gettempdir(), 'thumbor_video_engine', 'intermediates'),
+    'The directory of the intermediates kept by FFMPEG_INTERMEDIATE_CACHE. It '
+    'may be shared by all thumbor processes on the host.',
+    'Video')
+
+Config.define(
+    'FFMPEG_INTERMEDIATE_CACHE_MAX_SIZE',
+    10 * 1024 ** 3,
+    'The maximum total size in bytes of FFMPEG_INTERMEDIATE_CACHE_PATH before '
+    'the least recently used intermediates are evicted. 0 disables eviction.',
+    'Video')
+
+Config.define(
+    'FFMPEG_RENDITIONS',
+    [],
+    'A ladder of (width, height, format) renditions of video sources, e.g. '
+    '[(640, 0, "mp4"), (640, 0, "webm"), (1280, 0, "mp4")]. A request for one '
+    'of them transcodes them all in a single ffmpeg run, decoding the source '
+    'once, and writes the others to result storage under their urls. Formats '
+    'are mp4, webm or hevc (and their aliases); codecs set to two-pass are '
+    'left out.',
+    'Video')
+
+Config.define(
+    'FFMPEG_TRANSCODE_CACHE',
+    False,
+    'If True, transcoded results are also kept in FFMPEG_TRANSCODE_CACHE_PATH '
+    'under a digest of the source, the ffmpeg filters, the output format and '
+    'the encoder settings, and a transcode that has been done before, for any '
+    'url, is read from there instead of being run again.',
+    'Video')
+
+Config.define(
+    'FFMPEG_TRANSCODE_CACHE_PATH',
+    os.path.join(gettempdir(), 'thumbor_video_engine', 'transcodes'),
+    'The directory of the results kept by FFMPEG_TRANSCODE_CACHE. It may be '
+    'shared by all thumbor processes on the host.',
+    'Video')
+
+Config.define(
+    'FFMPEG_TRANSCODE_CACHE_MAX_SIZE',
+    10 * 1024 ** 3,
+    'The maximum total size in bytes of FFMPEG_TRANSCODE_CACHE_PATH before '
+    'the least recently used results are evicted. 0 disables eviction.',
+    'Video')
+
+Config.define(
+    'FFMPEG_MAX_CONCURRENT_JOBS',
+    0,
+    'The maximum total weight (see FFMPEG_JOB_WEIGHTS) of the transcodes that '
+    'a thumbor process runs at once. Transcodes beyond it wait, in the order '
+    'they arrived, for running ones to finish. 0 disables the limit.',
+    'Video')
+
+Config.define(
+    'FFMPEG_JOB_WEIGHTS',
+    {
+        'gif-legacy': 1,
+        'gifski': 2,
+        'h264': 2,
+        'h265': 4,
+        'vp9': 4,
+        'webp': 1,
+    },
+    'The relative cost of a transcode to each output, counted against '
+    "FFMPEG_MAX_CONCURRENT_JOBS. Keys are 'gif-legacy', 'gifski', 'h264', "
+    "'h265', 'vp9' and 'webp'; missing keys weigh 1.",
+    'Video')
+
+Config.define(
+    'FFMPEG_THREADS',
+    None,
+    'The -threads and -filter_threads values passed to ffmpeg. None leaves '
+    "them to ffmpeg (which uses every core) and an int fixes them. 'auto' "
+    'picks them for each transcode from the output size and the number of '
+    'transcodes running in the process, and also sets x265 pools and vp9 '
+    '-tile-columns to match.',
+    'Video')
+
+Config.define(
+    'FFMPEG_HOST_SLOTS',
+    0,
+    'The number of ffmpeg, gifski and gifsicle processes (or pipelines) that '
+    'may run at once across all thumbor processes on the host sharing '
+    'FFMPEG_HOST_SLOTS_PATH. Processes beyond it wait for a free slot. '
+    '0 disables the limit.',
+    'Video')
+
+Config.define(
+    'FFMPEG_HOST_SLOTS_PATH',
+    os.path.join(gettempdir(), 'thumbor_video_engine', 'slots'),
+    'The directory of the lock files that implement FFMPEG_HOST_SLOTS. It must '
+    'be on a local filesystem shared by all thumbor processes on the host.',
+    'Video')
+
+Config.define(
+    'FFMPEG_QUEUE_TIMEOUT',
+    30,
+    'How many seconds a transcode waits for capacity under '
+    'FFMPEG_MAX_CONCURRENT_JOBS (or a process for one of the FFMPEG_HOST_SLOTS) '
+    'before the request fails with a 503 '
+    '(a 500 without the APP_CLASS from thumbor_video_engine.app). None waits '
+    'indefinitely.',
+    'Video')
+
 Config.define(
     'FFMPEG_H264_TWO_PASS',
     False,
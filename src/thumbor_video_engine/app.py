@@ -1,11 +1,93 @@
+import asyncio
 import re
+from urllib.parse import quote
 
+from libthumbor.url import Url
 import thumbor.app
+from thumbor.engines import BaseEngine
+from thumbor.handlers import FetchResult
 from thumbor.handlers.imaging import ImagingHandler
+from thumbor.loaders import LoaderResult
 from thumbor.result_storages import ResultStorageResult
+from thumbor.utils import EXTENSION, logger
+from thumbor_video_engine.capabilities import get_capabilities
+from thumbor_video_engine.engines.ffmpeg import FORMATS
+from thumbor_video_engine.exceptions import FFmpegQueueTimeout
 from thumbor_video_engine.utils import is_animated, is_animated_gif
 
 
+DIMENSIONS_RE = re.compile(r'^-?(?:\d+|orig)?x-?(?:\d+|orig)?$')
+FORMAT_FILTER_RE = re.compile(r'format\([^)]*\):?')
+
+
+def rendition_url(context, width, height, out_format):
+    """
+    The url of the request in ``context`` at ``width`` x ``height`` in
+    ``out_format``: the same url with its dimensions and format filter
+    replaced, and signed with the server's security key unless it is unsafe.
+    A request without a format filter gets one only if ``out_format`` is not
+    the format that the source is output in by default, so that renditions
+    are stored under the url that would be requested for them.
+    The request must have dimensions.
+    """
+    request = context.request
+    url = request.url
+    if request.unsafe:
+        path = ImagingHandler._strip_url_signature_prefix(url, 'unsafe', 'unsafe')
+    else:
+        path = ImagingHandler._strip_url_signature_prefix(
+            url, request.hash, quote(request.hash))
+    match = re.match(Url.regex(has_unsafe_or_hash=False), path)
+    options = path[:match.start('image')].split('/')[:-1]
+    image = path[match.start('image'):]
+
+    dims_index = next(i for i, option in enumerate(options) if DIMENSIONS_RE.match(option))
+    options[dims_index] = '%s%dx%s%d' % (
+        '-' if request.horizontal_flip else '', width,
+        '-' if request.vertical_flip else '', height)
+    format_filter = 'format(%s)' % out_format
+    has_filters = options[-1].startswith('filters:')
+    if not (has_filters and FORMAT_FILTER_RE.search(options[-1])) and (
+            out_format == FORMATS.get(request.engine.extension)):
+        format_filter = None
+    if has_filters:
+        filters = FORMAT_FILTER_RE.sub('', options[-1][len('filters:'):]).rstrip(':')
+        options[-1] = 'filters:' + ':'.join([f for f in (filters, format_filter) if f])
+    elif format_filter:
+        options.append('filters:' + format_filter)
+    path = '/'.join(options + [image])
+
+    if request.unsafe:
+        return '/unsafe/%s' % path
+    signer = context.modules.url_signer(context.server.security_key)
+    signature = signer.signature(path)
+    if isinstance(signature, bytes):
+        signature = signature.decode()
+    return '/%s/%s' % (signature, path)
+
+
+class PreloadingLoader(object):
+    """Wraps a loader module, handing each source it loads to ``preload``
+    before thumbor's handler loads it into the engine"""
+
+    def __init__(self, loader, preload):
+        self.loader = loader
+        self.preload = preload
+
+    def __getattr__(self, attr):
+        return getattr(self.loader, attr)
+
+    async def load(self, context, url):
+        result = await self.loader.load(context, url)
+        if isinstance(result, LoaderResult):
+            buffer = result.buffer if result.successful else None
+        else:
+            buffer = result
+        if buffer is not None:
+            await self.preload(buffer)
+        return result
+
+
 class VideoEngineImagingHandler(ImagingHandler):
     def _override_write_results_to_client(self, results, content_type):
         is_gif = content_type == 'image/gif'
@@ -63,8 +145,100 @@ class VideoEngineImagingHandler(ImagingHandler):
         self._override_execute_image_operations()
         await super().execute_image_operations()
 
+    async def _fetch(self, url):
+        """
+        Loads the source into the engine with its ``load_async``, ahead of
+        the synchronous ``load`` calls that thumbor makes, so that probing the
+        source and extracting a still frame do not block the IOLoop. A
+        timeout waiting for one of the FFMPEG_HOST_SLOTS meanwhile is a 503.
+        """
+        engine = self.context.modules.engine
+        if not hasattr(engine, 'load_async'):
+            return await super()._fetch(url)
+        loader = self.context.modules.loader
+        self.context.modules.loader = PreloadingLoader(loader, self._preload)
+        try:
+            result = await super()._fetch(url)
+            if result.successful and result.engine is None and result.buffer is not None:
+                # Found in storage, and loaded by get_image() from here
+                if self.context.request.engine is engine:
+                    await engine.load_async(result.buffer, self.context.request.extension)
+        except FFmpegQueueTimeout as e:
+            logger.warning("Could not load `%s`: %s", url, e)
+            return FetchResult(loader_error=503)
+        finally:
+            self.context.modules.loader = loader
+        return result
+
+    async def _preload(self, buffer):
+        # the engine that thumbor's _fetch() picks, and the extension it gives
+        mime = BaseEngine.get_mimetype(buffer)
+        if mime == 'image/gif' and self.context.config.USE_GIFSICLE_ENGINE:
+            return
+        await self.context.modules.engine.load_async(buffer, EXTENSION.get(mime, '.jpg'))
+
+    async def finish_request(self, result_from_storage=None):
+        if result_from_storage is None:
+            try:
+                await self._transcode()
+            except asyncio.CancelledError:
+                logger.debug(
+                    "Client disconnected, transcode of %s cancelled",
+                    self.context.request.url)
+                return
+            except FFmpegQueueTimeout as e:
+                self._error(503, str(e))
+                return
+        await super().finish_request(result_from_storage)
+
+    async def _transcode(self):
+        """
+        Runs the ffmpeg engine's transcode without blocking the IOLoop, ahead
+        of thumbor's synchronous ``_load_results``, which then reads the
+        finished result from the engine (re-raising any error there, so that
+        thumbor's own error handling applies).
+        """
+        read_async = getattr(self.context.request.engine, 'read_async', None)
+        if read_async is None:
+            return
+        image_extension, _ = self.define_image_type(self.context, None)
+        self._transcode_task = asyncio.ensure_future(read_async(image_extension))
+        try:
+            await self._transcode_task
+        finally:
+            self._transcode_task = None
+
+    async def _store_results(self, result_storage, metrics, results):
+        await super()._store_results(result_storage, metrics, results)
+        renditions = getattr(self.context.request.engine, 'renditions', None)
+        if not renditions:
+            return
+        # The other FFMPEG_RENDITIONS transcoded along with this one
+        url = self.context.request.url
+        urls = [rendition_url(self.context, width, height, out_format)
+                for (width, height, out_format), _ in renditions]
+        try:
+            for rendition_path, (_, buf) in zip(urls, renditions):
+                self.context.request.url = rendition_path
+                logger.debug("Storing rendition %s" % rendition_path)
+                await super()._store_results(result_storage, metrics, buf)
+        finally:
+            self.context.request.url = url
+
+    def on_connection_close(self):
+        super().on_connection_close()
+        task = getattr(self, '_transcode_task', None)
+        if task is not None:
+            task.cancel()
+
 
 class ThumborServiceApp(thumbor.app.ThumborServiceApp):
+    def __init__(self, context):
+        # Resolve the binaries and probe the ffmpeg build while the server
+        # starts, rather than in the first request that needs them
+        get_capabilities(context).log()
+        super().__init__(context)
+
     def get_handlers(self):
         handlers = super().get_handlers()
         for i, handler in list(enumerate(handlers)):
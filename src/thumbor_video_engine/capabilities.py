@@ -0,0 +1,189 @@
+"""
+The binaries that the engines run, and what the ffmpeg build can do.
+
+Paths are resolved, and ffmpeg is asked for its version, encoders, muxers and
+filters, once per process rather than on every request.
+:class:`thumbor_video_engine.app.ThumborServiceApp` does this when the server
+starts, so that a missing binary or encoder is logged at boot, and the result
+is kept on ``context.server.capabilities`` for routing decisions to read.
+"""
+from collections import namedtuple
+import re
+from subprocess import Popen, PIPE, DEVNULL
+
+try:
+    from shutil import which
+except ImportError:
+    from thumbor.utils import which
+
+from thumbor.utils import logger
+
+
+# The AV1 encoders that avif stills can be encoded with, in order of preference
+AV1_ENCODERS = ('libaom-av1', 'libsvtav1')
+
+# The encoders of each output format, and whether the format is one that
+# transcodes need (rather than one only offered when it is there)
+FORMAT_ENCODERS = [
+    ('mp4', ('libx264',), True),
+    ('webm', ('libvpx-vp9',), True),
+    ('webp', ('libwebp',), True),
+    ('gif', ('gif',), True),
+    ('h265', ('libx265',), False),
+    ('avif', AV1_ENCODERS, False),
+]
+
+
+FFmpegBuild = namedtuple('FFmpegBuild', 'version encoders muxers filters')
+
+_ffmpeg_builds = {}
+
+
+def _ffmpeg_output(ffmpeg_path, flag):
+    try:
+        proc = Popen(
+            [ffmpeg_path, '-hide_banner', flag],
+            stdout=PIPE, stderr=DEVNULL, stdin=DEVNULL)
+        stdout, _ = proc.communicate()
+    except OSError:
+        return None
+    if proc.returncode != 0:
+        return None
+    return stdout.decode('utf-8', 'replace')
+
+
+def _parse_names(output, pattern):
+    if not output:
+        return frozenset()
+    names = set()
+    for match in re.finditer(pattern, output, re.M):
+        names.update(match.group(1).split(','))
+    return frozenset(names)
+
+
+def parse_encoders(output):
+    """The names in the output of ``ffmpeg -encoders``"""
+    return _parse_names(output, r'^ [VAS][.A-Z]{5} (\w[\w-]*)')
+
+
+def parse_muxers(output):
+    """The names in the output of ``ffmpeg -muxers``"""
+    return _parse_names(output, r'^ [D ]E (\w[\w,-]*)')
+
+
+def parse_filters(output):
+    """The names in the output of ``ffmpeg -filters``"""
+    return _parse_names(output, r'^ [.A-Z]{3} (\w+) +\S*->')
+
+
+def probe_ffmpeg(ffmpeg_path):
+    """
+    Returns the :class:`FFmpegBuild` of the ffmpeg binary at
+    ``ffmpeg_path``: its ``(major, minor)`` version, or ``None`` if it cannot
+    be determined (e.g. for git snapshot builds), and the names of its
+    encoders, muxers and filters, which are empty if it cannot be run. The
+    result is memoized per path.
+    """
+    if ffmpeg_path not in _ffmpeg_builds:
+        version = None
+        output = _ffmpeg_output(ffmpeg_path, '-version') or ''
+        match = re.match(r'ffmpeg version n?(\d+)\.(\d+)', output)
+        if match:
+            version = int(match.group(1)), int(match.group(2))
+        _ffmpeg_builds[ffmpeg_path] = FFmpegBuild(
+            version=version,
+            encoders=parse_encoders(_ffmpeg_output(ffmpeg_path, '-encoders')),
+            muxers=parse_muxers(_ffmpeg_output(ffmpeg_path, '-muxers')),
+            filters=parse_filters(_ffmpeg_output(ffmpeg_path, '-filters')))
+    return _ffmpeg_builds[ffmpeg_path]
+
+
+def ffmpeg_version(ffmpeg_path):
+    """
+    Returns the ``(major, minor)`` version of the ffmpeg binary at
+    ``ffmpeg_path``, or ``None`` if it cannot be determined.
+    """
+    return probe_ffmpeg(ffmpeg_path).version
+
+
+class Capabilities(object):
+    """
+    The resolved paths of ffmpeg, ffprobe and gifski for one set of
+    FFMPEG_PATH, FFPROBE_PATH and GIFSKI_PATH, and the :class:`FFmpegBuild`
+    of that ffmpeg. A path is ``None`` if its binary is not there; ffprobe
+    and gifski are looked up on PATH when they are not configured.
+    """
+
+    def __init__(self, ffmpeg_path, ffprobe_path=None, gifski_path=None):
+        self.key = (ffmpeg_path, ffprobe_path, gifski_path)
+        self.ffmpeg_path = which(ffmpeg_path) if ffmpeg_path else None
+        self.ffprobe_path = (
+            which(ffprobe_path) if ffprobe_path else None) or which('ffprobe')
+        self.gifski_path = which(gifski_path) if gifski_path else which('gifski')
+        if self.ffmpeg_path:
+            self.build = probe_ffmpeg(self.ffmpeg_path)
+        else:
+            self.build = FFmpegBuild(None, frozenset(), frozenset(), frozenset())
+
+    @classmethod
+    def key_for(cls, config):
+        return (config.FFMPEG_PATH, config.FFPROBE_PATH, config.GIFSKI_PATH)
+
+    @property
+    def version(self):
+        return self.build.version
+
+    def has_encoder(self, name):
+        return name in self.build.encoders
+
+    def has_muxer(self, name):
+        return name in self.build.muxers
+
+    def has_filter(self, name):
+        return name in self.build.filters
+
+    @property
+    def av1_encoder(self):
+        """The first of :data:`AV1_ENCODERS` that ffmpeg has, or ``None``"""
+        return next((name for name in AV1_ENCODERS if self.has_encoder(name)), None)
+
+    def missing_formats(self):
+        """The ``(format, encoders, required)`` of :data:`FORMAT_ENCODERS`
+        that ffmpeg has none of the encoders of"""
+        return [
+            (out_format, encoders, required)
+            for out_format, encoders, required in FORMAT_ENCODERS
+            if not any(self.has_encoder(name) for name in encoders)]
+
+    def log(self):
+        """Logs the ffmpeg build, and warns of what is missing from it"""
+        if self.ffmpeg_path is None or not self.build.encoders:
+            logger.error(
+                "[FFMPEG] ffmpeg at %s cannot be run; video requests will fail"
+                % self.key[0])
+            return
+        logger.info("[FFMPEG] using ffmpeg %s at %s" % (
+            '.'.join('%d' % v for v in self.version) if self.version else '(unknown version)',
+            self.ffmpeg_path))
+        for out_format, encoders, required in self.missing_formats():
+            log = logger.warning if required else logger.info
+            log("[FFMPEG] ffmpeg has no %s encoder (%s)" % (
+                out_format, ' or '.join(encoders)))
+        if self.ffprobe_path is None:
+            logger.warning("[FFMPEG] ffprobe was not found")
+
+
+def get_capabilities(context):
+    """
+    The :class:`Capabilities` for the config of ``context``, kept on
+    ``context.server.capabilities``. They are resolved again only if the
+    configured paths have changed.
+    """
+    server = context.server
+    key = Capabilities.key_for(context.config)
+    capabilities = getattr(server, 'capabilities', None)
+    if capabilities is None or capabilities.key != key:
+        capabilities = Capabilities(*key)
+        if server is not None:
+            server.capabilities = capabilities
+    return capabilities
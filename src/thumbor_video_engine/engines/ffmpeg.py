@@ -1,25 +1,39 @@
 from __future__ import unicode_literals
 
-from contextlib import contextmanager
+import asyncio
+from bisect import bisect_right
+from collections import deque, namedtuple
+from contextlib import ExitStack, contextmanager, nullcontext
 import copy
 from decimal import Decimal
 from fractions import Fraction
 from glob import glob
+import hashlib
 from io import BytesIO, open
+import json
+import math
 import os
-import re
 from shutil import which
-from subprocess import Popen, PIPE, DEVNULL
 import threading
+import time
 
 from PIL import Image, ImageSequence
+from thumbor.config import Config
 from thumbor.engines import BaseEngine
+from thumbor.transformer import Transformer
 from thumbor.utils import logger
 
-from thumbor_video_engine.exceptions import FFmpegError
-from thumbor_video_engine.ffprobe import ffprobe
+from thumbor_video_engine import process
+from thumbor_video_engine.capabilities import ffmpeg_version, get_capabilities
+from thumbor_video_engine.exceptions import FFmpegError, FFmpegQueueTimeout
+from thumbor_video_engine.ffprobe import ffprobe_command, parse_ffprobe
+from thumbor_video_engine.host_slots import HostSlots
+from thumbor_video_engine.intermediates import IntermediateCache
+from thumbor_video_engine.source_info import SourceInfo
+from thumbor_video_engine.transcode_cache import TranscodeCache
 from thumbor_video_engine.utils import (
-    named_tmp_file, make_tmp_dir, has_transparency, parse_gif, GifParseError)
+    named_tmp_file, make_tmp_dir, has_transparency, iter_rgba_mkv, probe_mp4,
+    probe_webm, KeyframeIndex, Mp4ParseError, WebmParseError)
 
 
 # Cap for constant-frame-rate conversion of video sources to gif; gif delays
@@ -28,6 +42,116 @@ MAX_VIDEO_GIF_FPS = Fraction(50)
 DEFAULT_VIDEO_GIF_FPS = Fraction(20)
 
 
+# Passed to ffmpeg as the input filename when the source buffer is streamed to
+# its stdin rather than written to a temp file
+PIPE_INPUT = 'pipe:0'
+
+# Passed to ffmpeg as the output filename when its output is read from stdout
+PIPE_OUTPUT = 'pipe:1'
+
+# Output formats whose muxers never seek back over what they have written, so
+# they can be read straight from ffmpeg's stdout. webm is not included: on a
+# non-seekable output the matroska muxer cannot go back to fill in the
+# segment duration, which browsers use for the scrubber.
+PIPE_OUTPUT_FORMATS = ('gif', 'webp', 'mjpeg', 'image2pipe')
+
+# ffmpeg's gif demuxer seeks back over its input while reading the header
+# before 7.0, so older builds can only read gifs from a (seekable) file
+MIN_GIF_PIPE_FFMPEG_VERSION = (7, 0)
+
+
+# The encoder and muxer flags of the formats that a still frame can be
+# encoded to directly (see transcode_to_still). avif stills can be too, when
+# ffmpeg has an AV1 encoder (see avif_still_flags).
+STILL_CODECS = {
+    'jpg': ['-c:v', 'mjpeg', '-pix_fmt', 'yuvj420p', '-f', 'mjpeg'],
+    'jpeg': ['-c:v', 'mjpeg', '-pix_fmt', 'yuvj420p', '-f', 'mjpeg'],
+    'webp': ['-c:v', 'libwebp', '-f', 'webp'],
+    'png': ['-c:v', 'png', '-f', 'image2pipe'],
+}
+
+
+def mjpeg_qscale(quality):
+    """The mjpeg -q:v closest to a libjpeg (and PIL) quality from 1 to 100,
+    matched on how much each scales the standard quantization tables"""
+    quality = min(max(int(quality), 1), 100)
+    scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+    return min(max(int(round(scale / 15)), 1), 31)
+
+
+def avif_crf(quality):
+    """The AV1 -crf, from 0 to 63, for a quality from 1 to 100"""
+    quality = min(max(int(quality), 1), 100)
+    return int(round(63 * (100 - quality) / 100.0))
+
+
+# Keyframe times closer than this to a still() position count as the same
+KEYFRAME_TOLERANCE = 0.000001
+
+
+def still_position_seconds(position):
+    """The time in seconds of a still() filter position, either in seconds
+    or as ``[hh:]mm:ss[.ms]``, or ``None`` if it cannot be parsed"""
+    sign = -1 if position.startswith('-') else 1
+    try:
+        parts = [Fraction(part) for part in position.lstrip('-').split(':')]
+    except ValueError:
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return sign * seconds
+
+
+# Flips and right-angle rotations compose to one of eight orientations. Each
+# is a signed permutation matrix ((a, b), (c, d)) that takes a point (x, y) of
+# the frame, from its center and with y pointing down, to (ax + by, cx + dy).
+IDENTITY = ((1, 0), (0, 1))
+ORIENTATIONS = {
+    'flip_horizontally': ((-1, 0), (0, 1)),
+    'flip_vertically': ((1, 0), (0, -1)),
+    # rotations are counterclockwise, as in thumbor's pil engine
+    90: ((0, 1), (-1, 0)),
+    180: ((-1, 0), (0, -1)),
+    270: ((0, -1), (1, 0)),
+}
+
+# The ffmpeg filters that apply each orientation
+ORIENTATION_FILTERS = {
+    IDENTITY: [],
+    ((-1, 0), (0, 1)): ['hflip'],
+    ((1, 0), (0, -1)): ['vflip'],
+    ((-1, 0), (0, -1)): ['hflip', 'vflip'],
+    ((0, 1), (-1, 0)): ['transpose=cclock'],
+    ((0, -1), (1, 0)): ['transpose=clock'],
+    ((0, 1), (1, 0)): ['transpose=cclock_flip'],
+    ((0, -1), (-1, 0)): ['transpose=clock_flip'],
+}
+
+
+def compose_orientations(second, first):
+    """The orientation of ``first`` followed by ``second``"""
+    return tuple(
+        tuple(sum(second[i][k] * first[k][j] for k in range(2)) for j in range(2))
+        for i in range(2))
+
+
+# The operations of a transcode in canonical form (see
+# Engine.video_operations): the (width, height, left, top) crop of the input,
+# or None for the whole frame; the size that the crop is scaled to, or None
+# if it is not; whether it is made grayscale; and the orientation that its
+# flips and rotations compose to.
+VideoOperations = namedtuple('VideoOperations', 'crop size grayscale orientation')
+
+
+# The decoders that can decode frames at 1/2, 1/4 or 1/8 of their size
+# (ffmpeg's -lowres 1 to 3), by the codec_name that ffprobe reports and by
+# the sample entry of mp4 and mov files (see lowres_factor)
+LOWRES_CODECS = frozenset(['mjpeg', 'mpeg4', 'h263', 'mpeg1video', 'mpeg2video'])
+LOWRES_CODEC_TAGS = frozenset(['jpeg', 'mjpa', 'mp4v', 's263', 'h263'])
+MAX_LOWRES = 3
+
+
 FORMATS = {
     '.mp4': 'mp4',
     '.webm': 'webm',
@@ -36,6 +160,226 @@ FORMATS = {
     '.webp': 'webp',
 }
 
+# Output formats that are encoded the same way as another one, which they are
+# cached as (see transcode_cache_key)
+FORMAT_ALIASES = {
+    'h264': 'mp4',
+    'vp9': 'webm',
+    'hevc': 'h265',
+    'jpeg': 'jpg',
+}
+
+# The config settings that make up the encoder settings of a transcode in
+# transcode_cache_key: those with these prefixes, and the image qualities,
+# less those that do not change what is output
+ENCODER_SETTING_PREFIXES = ('FFMPEG_', 'GIFSKI_', 'GIFSICLE_')
+QUALITY_SETTINGS = ('QUALITY', 'WEBP_QUALITY', 'AVIF_QUALITY')
+NON_ENCODER_SETTINGS = frozenset([
+    'FFMPEG_ENGINE', 'FFMPEG_GIF_AUTO_H264', 'FFMPEG_GIF_AUTO_H265',
+    'FFMPEG_GIF_AUTO_WEBP', 'FFMPEG_HANDLE_ANIMATED_GIF', 'FFMPEG_HOST_SLOTS',
+    'FFMPEG_HOST_SLOTS_PATH', 'FFMPEG_INTERMEDIATE_CACHE_MAX_SIZE',
+    'FFMPEG_INTERMEDIATE_CACHE_PATH', 'FFMPEG_JOB_WEIGHTS',
+    'FFMPEG_MAX_CONCURRENT_JOBS', 'FFMPEG_PIPE_INPUT', 'FFMPEG_PIPE_OUTPUT',
+    'FFMPEG_QUEUE_TIMEOUT', 'FFMPEG_RENDITIONS', 'FFMPEG_TRANSCODE_CACHE',
+    'FFMPEG_TRANSCODE_CACHE_MAX_SIZE', 'FFMPEG_TRANSCODE_CACHE_PATH',
+])
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+# The codec of each video format that FFMPEG_RENDITIONS can have, and the
+# muxer of each codec (see transcode_renditions)
+RENDITION_CODECS = {
+    'mp4': 'h264',
+    'h264': 'h264',
+    'webm': 'vp9',
+    'vp9': 'vp9',
+    'hevc': 'h265',
+    'h265': 'h265',
+}
+RENDITION_MUXERS = {
+    'h264': 'mp4',
+    'vp9': 'webm',
+    'h265': 'mp4',
+}
+
+# The FFMPEG_JOB_WEIGHTS key for each output format; gif depends on the
+# FFMPEG_GIF_PIPELINE in use
+JOB_WEIGHT_KEYS = {
+    'webp': 'webp',
+    'webm': 'vp9',
+    'vp9': 'vp9',
+    'mp4': 'h264',
+    'h264': 'h264',
+    'hevc': 'h265',
+    'h265': 'h265',
+}
+
+
+# FFMPEG_THREADS = 'auto' gives an output of up to the given number of pixels
+# at most the given number of threads, and larger outputs MAX_AUTO_THREADS
+AUTO_THREADS_BY_PIXELS = (
+    (320 * 240, 1),
+    (640 * 480, 2),
+    (1280 * 720, 4),
+)
+MAX_AUTO_THREADS = 8
+
+# libvpx-vp9 tiles are at least 256 pixels wide
+MIN_VP9_TILE_WIDTH = 256
+
+
+def cpu_count():
+    """The number of cores this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class _JobWaiter(object):
+    def __init__(self, weight, wake):
+        self.weight = weight
+        self.wake = wake
+        self.admitted = False
+
+
+class TranscodeScheduler(object):
+    """
+    Bounds the total weight of the transcodes running in a thumbor process
+    (or, with a ``max_weight`` of 0, only counts them). Jobs that do not fit
+    wait in arrival order, so a heavy job is not starved
+    by a stream of light ones; a job heavier than the whole budget runs once
+    nothing else is. Threads wait with :meth:`acquire` and coroutines with
+    :meth:`acquire_async`, either of which passes :attr:`queue_depth` to its
+    ``report_depth`` callback as a job joins the queue and as it leaves it.
+    """
+
+    def __init__(self, max_weight):
+        self.max_weight = max_weight
+        self.running_weight = 0
+        self.running_jobs = 0
+        self.waiters = deque()
+        self.lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        return len(self.waiters)
+
+    def _fits(self, weight):
+        return (not self.max_weight
+                or not self.running_jobs
+                or self.running_weight + weight <= self.max_weight)
+
+    def _admit(self, waiter):
+        self.running_weight += waiter.weight
+        self.running_jobs += 1
+        waiter.admitted = True
+
+    def _wake_waiters(self):
+        while self.waiters and self._fits(self.waiters[0].weight):
+            waiter = self.waiters.popleft()
+            self._admit(waiter)
+            try:
+                waiter.wake()
+            except RuntimeError:
+                # the waiting coroutine's event loop has been closed
+                self.running_weight -= waiter.weight
+                self.running_jobs -= 1
+
+    def _enqueue(self, weight, wake):
+        waiter = _JobWaiter(weight, wake)
+        with self.lock:
+            if not self.waiters and self._fits(weight):
+                self._admit(waiter)
+            else:
+                self.waiters.append(waiter)
+        return waiter
+
+    def _withdraw(self, waiter):
+        """Takes a waiter that gave up out of the queue. Returns False if it
+        was admitted in the meantime, in which case it must be released."""
+        with self.lock:
+            if waiter.admitted:
+                return False
+            self.waiters.remove(waiter)
+            self._wake_waiters()
+            return True
+
+    def release(self, waiter):
+        with self.lock:
+            self.running_weight -= waiter.weight
+            self.running_jobs -= 1
+            self._wake_waiters()
+
+    def _timeout_error(self, timeout):
+        return FFmpegQueueTimeout(
+            "Timed out after %ss waiting for transcode capacity "
+            "(%d running, %d queued)" % (
+                timeout, self.running_jobs, self.queue_depth))
+
+    def _report_depth(self, report_depth):
+        if report_depth is not None:
+            report_depth(self.queue_depth)
+
+    def acquire(self, weight, timeout=None, report_depth=None):
+        """Blocks until a job of ``weight`` can run, and returns the handle
+        to pass to :meth:`release` once it is done. Raises
+        :class:`FFmpegQueueTimeout` after ``timeout`` seconds."""
+        event = threading.Event()
+        waiter = self._enqueue(weight, event.set)
+        self._report_depth(report_depth)
+        if waiter.admitted:
+            return waiter
+        try:
+            if not event.wait(timeout) and self._withdraw(waiter):
+                raise self._timeout_error(timeout)
+        finally:
+            self._report_depth(report_depth)
+        return waiter
+
+    async def acquire_async(self, weight, timeout=None, report_depth=None):
+        """Like :meth:`acquire`, but waits without blocking the event
+        loop."""
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(
+                lambda: admitted.done() or admitted.set_result(None))
+
+        waiter = self._enqueue(weight, wake)
+        self._report_depth(report_depth)
+        if waiter.admitted:
+            return waiter
+        try:
+            await asyncio.wait_for(asyncio.shield(admitted), timeout)
+        except asyncio.TimeoutError:
+            if self._withdraw(waiter):
+                raise self._timeout_error(timeout)
+        except asyncio.CancelledError:
+            if not self._withdraw(waiter):
+                self.release(waiter)
+            raise
+        finally:
+            self._report_depth(report_depth)
+        return waiter
+
+
+_schedulers = {}
+
+
+def transcode_scheduler(max_weight):
+    """The process-wide :class:`TranscodeScheduler` for ``max_weight``"""
+    if max_weight not in _schedulers:
+        _schedulers.setdefault(max_weight, TranscodeScheduler(max_weight))
+    return _schedulers[max_weight]
+
 
 class Engine(BaseEngine):
 
@@ -44,14 +388,41 @@ class Engine(BaseEngine):
         self.duration = 0
         self.crop_info = 1, 1, 0, 0
         self.image_size = 1, 1
-        self.rotate_degrees = 0
+        self.operations = []
+        self.decode_flags = []
+        self.decoding_intermediate = False
         self.flipped_vertically = False
         self.flipped_horizontally = False
         self.resized = False
         self.cropped = False
         self.grayscale = False
         self.gif_info = None
+        self.webp_info = None
         self.source_frame_rate = None
+        self.frame_durations = None
+        # The still() position of a still frame that is encoded by
+        # transcode_to_still rather than by the image engine
+        self.still_position = None
+        # The ((width, height, format), result) of the other FFMPEG_RENDITIONS
+        # transcoded along with the requested one, for result storage
+        self.renditions = None
+        # The (start, end) byte ranges of the source streamed to ffmpeg when
+        # only part of it is needed (see still_frame)
+        self.input_ranges = None
+        # The FFMPEG_TRANSCODE_CACHE key of the transcode once it has been
+        # looked up and not found, for the result to be stored under
+        self.transcode_key = None
+        # May be set before load() by the video engine, which has already
+        # sniffed the source (see the source property)
+        self.source_info = None
+        # Set by read_async(): the loop that subprocesses are started on, and
+        # the futures for those still running
+        self.event_loop = None
+        self.pending_processes = set()
+        self.cancelled = False
+        self.transcoded = None
+        # The TranscodeScheduler slot held by the running transcode
+        self.job = None
         super(Engine, self).__init__(context)
         self.ffmpeg_path = self.context.config.FFMPEG_PATH
         self.ffprobe_path = self.context.config.FFPROBE_PATH
@@ -60,6 +431,12 @@ class Engine(BaseEngine):
     def use_gif_engine(self):
         return self.context.config.FFMPEG_USE_GIFSICLE_ENGINE
 
+    @property
+    def capabilities(self):
+        """The :class:`~thumbor_video_engine.capabilities.Capabilities` of
+        the configured binaries, probed once per process"""
+        return get_capabilities(self.context)
+
     @property
     def size(self):
         return self.image_size
@@ -129,8 +506,13 @@ class Engine(BaseEngine):
         self.crop_info = out_width, out_height, new_left, new_top
 
     def rotate(self, degrees):
+        if degrees % 90:
+            # thumbor's rotate filter only rotates by right angles
+            logger.debug('Ignoring rotation by {0} degrees'.format(degrees))
+            return
         self.operations.append(('rotate', (degrees,)))
-        self.rotate_degrees = degrees
+        if degrees % 180:
+            self.image_size = self.image_size[::-1]
 
     def flip_vertically(self):
         self.operations.append(('flip_vertically', tuple()))
@@ -153,18 +535,24 @@ class Engine(BaseEngine):
         self.buffer = buffer
         self.operations = []
         self.gif_info = None
+        self.webp_info = None
         self.source_frame_rate = None
-        mimetype = self.get_mimetype(buffer)
+        self.frame_durations = None
+        self.still_position = None
+        self.renditions = None
+        self.transcoded = None
+        self.transcode_key = None
+        self.decode_flags = []
+        self.decoding_intermediate = False
+        source = self.source
+        mimetype = source.mimetype
         if mimetype and mimetype.startswith('image/'):
             self.image = Image.open(BytesIO(buffer))
         else:
             # self.image cannot be None, or the thumbor handler returns a 400
             self.image = ''
-        if bytes(buffer[:6]) in (b'GIF87a', b'GIF89a'):
-            try:
-                self.gif_info = parse_gif(buffer)
-            except GifParseError:
-                self.gif_info = None
+        self.gif_info = source.gif_info
+        self.webp_info = source.webp_info
 
         # Only the gif->gif path is gated; converting a GIF source to
         # video/webp/avif streams through ffmpeg with bounded memory (and is
@@ -204,40 +592,447 @@ class Engine(BaseEngine):
             # need to decode every frame canvas with PIL just to sum durations
             self.original_size = self.gif_info.width, self.gif_info.height
             self.duration = self.gif_info.duration
+        elif self.webp_info is not None:
+            # Likewise read from the RIFF chunks by parse_webp
+            self.original_size = self.webp_info.width, self.webp_info.height
+            self.frame_durations = self.webp_info.delays_ms
+            self.duration = self.webp_info.duration
         elif self.image:
             # An animated image (e.g. webp) that ffmpeg cannot yet decode,
             # but pillow can.
             self.original_size = self.image.size
-            duration_ms = 0
             # Load all frames, get the sum of all frames' durations
+            self.frame_durations = []
             for frame in ImageSequence.Iterator(self.image):
                 frame.load()
-                duration_ms += frame.info['duration']
+                self.frame_durations.append(frame.info['duration'])
             self.image.seek(0)
-            self.duration = Decimal(duration_ms) / Decimal(1000)
+            self.duration = Decimal(sum(self.frame_durations)) / Decimal(1000)
         else:
-            ffprobe_data = ffprobe(self.buffer, extension=self.extension)
+            ffprobe_data = self.ffprobe()
             self.original_size = ffprobe_data['width'], ffprobe_data['height']
             self.duration = Decimal(ffprobe_data['duration'])
             self.source_frame_rate = (
                 ffprobe_data.get('avg_frame_rate')
                 or ffprobe_data.get('r_frame_rate'))
 
+    @property
+    def probe_cache(self):
+        if not self.context.config.FFPROBE_CACHE:
+            return None
+        importer = self.context.modules.importer
+        if getattr(importer, 'ffprobe_cache', None) is None:
+            importer.import_item('FFPROBE_CACHE', 'Cache')
+        return importer.ffprobe_cache(self.context)
+
+    @property
+    def source(self):
+        """The :class:`~thumbor_video_engine.source_info.SourceInfo` of the
+        loaded buffer: the one handed over by the video engine if it is for
+        this buffer, or else a new one"""
+        if self.source_info is None or self.source_info.buffer is not self.buffer:
+            self.source_info = SourceInfo(self.buffer)
+        return self.source_info
+
+    def probe_headers(self):
+        """Returns flat ffprobe-style data read directly from the container
+        headers of mp4, mov and webm sources, or ``None`` if the source
+        needs to be probed with ffprobe."""
+        mime = self.source.mimetype
+        try:
+            if mime in ('video/mp4', 'video/quicktime'):
+                return probe_mp4(self.buffer)
+            elif mime == 'video/webm':
+                return probe_webm(self.buffer)
+        except (Mp4ParseError, WebmParseError) as e:
+            logger.debug("Falling back to ffprobe: %s", e)
+        return None
+
+    def ffprobe(self):
+        """Returns the flat ffprobe data for the source. For mp4, mov and webm
+        sources this is read from the container headers when possible;
+        otherwise it comes from FFPROBE_CACHE when this source has been
+        probed before. The result is kept on :attr:`source`."""
+        source = self.source
+        if source.probe_data is None:
+            source.probe_data = self._ffprobe()
+        return source.probe_data
+
+    def _ffprobe(self):
+        ffprobe_data = self.probe_headers()
+        if ffprobe_data is not None:
+            return ffprobe_data
+        cache = self.probe_cache
+        if cache is None:
+            return self.run_ffprobe()
+        key = self.source.digest
+        ffprobe_data = cache.get(key)
+        if ffprobe_data is None:
+            ffprobe_data = self.run_ffprobe()
+            cache.put(key, ffprobe_data)
+        return ffprobe_data
+
+    def run_ffprobe(self):
+        """Runs ffprobe on the source with :meth:`run_coroutine`"""
+        with named_tmp_file(data=self.buffer, extension=self.extension) as input_file:
+            command = ffprobe_command(input_file, self.capabilities.ffprobe_path)
+            returncode, stdout, stderr = self.run_coroutine(
+                process.run_process, command)
+        return parse_ffprobe(stdout)
+
+    def keyframes(self):
+        """
+        The :class:`~thumbor_video_engine.utils.KeyframeIndex` of the source,
+        or ``None`` if it is not an mp4, mov or webm with a readable index.
+        It is read from the source once, and kept in FFPROBE_CACHE.
+        """
+        source = self.source
+        cache = self.probe_cache
+        if cache is None:
+            return source.keyframes
+        key = '%s-keyframes' % source.digest
+        index = cache.get(key)
+        if index is None:
+            index = source.keyframes._asdict() if source.keyframes else {}
+            cache.put(key, index)
+        return KeyframeIndex(**index) if index else None
+
+    def still_frame(self, buffer, extension, position):
+        """Returns the frame of a video ``buffer`` at ``position`` (as given
+        to the still() filter) as a png, for the image engine."""
+        self.buffer = buffer
+        self.extension = extension
+        return self.extract_still(position, 'png', ['-frames:v', '1'])
+
+    def extract_still(self, position, out_format, flags):
+        """
+        Runs ffmpeg with ``flags`` on the frame of the source at ``position``.
+
+        ffmpeg seeks on its input, decoding from the keyframe before the
+        position rather than from the start. With the :meth:`keyframes` of
+        a webm source, only its headers and the clusters from that keyframe
+        up to the one after the position are streamed to ffmpeg, and when
+        the position is on a keyframe it is taken as is, without decoding up
+        to the position.
+        """
+        buffer, extension = self.buffer, self.extension
+        seconds = still_position_seconds(position)
+        if (seconds is None or seconds < 0
+                or not self.can_seek_source):
+            with named_tmp_file(data=buffer, suffix=extension) as src_file:
+                return self.run_ffmpeg(src_file, out_format, ['-ss', position] + flags)
+
+        index = self.keyframes()
+        input_flags = []
+        if index is not None:
+            times = index.times
+            num_before = bisect_right(times, seconds + KEYFRAME_TOLERANCE)
+            i = max(num_before - 1, 0)
+            if abs(times[i] - seconds) <= KEYFRAME_TOLERANCE:
+                input_flags += ['-noaccurate_seek']
+
+        if (index is None or not index.offsets
+                or not self.context.config.FFMPEG_PIPE_INPUT):
+            input_flags += ['-ss', '%.6f' % seconds]
+            with named_tmp_file(data=buffer, suffix=extension) as src_file:
+                return self.run_ffmpeg(
+                    src_file, out_format, flags, input_flags=input_flags)
+
+        # The first frame at or after the position is at the latest the
+        # keyframe after it, so the range ends with that keyframe's cluster.
+        # ffmpeg offsets -ss by the start of what it is given.
+        start = index.offsets[i]
+        end = len(buffer)
+        if num_before < len(times):
+            next_offset = index.offsets[num_before]
+            end = next((offset for offset in index.offsets[num_before:]
+                        if offset > next_offset), end)
+        input_flags += ['-ss', '%.6f' % (seconds - times[i])]
+        self.input_ranges = [(0, index.header_size), (start, end)]
+        try:
+            return self.run_ffmpeg(
+                PIPE_INPUT, out_format, flags, input_flags=input_flags)
+        finally:
+            self.input_ranges = None
+
     def read(self, extension=None, quality=None):
         if quality is None:
             return self.buffer  # return the original data
+        if self.transcoded is not None:
+            result, error = self.transcoded
+            if error is not None:
+                raise error
+            return result
         return self.transcode(extension)
 
-    def transcode(self, extension):
-        if getattr(self.context.request, 'format', None):
-            out_format = self.context.request.format
-            if out_format in ('hevc', 'h264', 'h265'):
-                extension = '.mp4'
-                self.context.request.format = 'mp4'
+    async def read_async(self, extension=None):
+        """
+        Transcodes to ``extension`` without blocking the event loop: the
+        transcode runs in the loop's default executor, and every subprocess it
+        starts is run on the loop by :mod:`thumbor_video_engine.process`.
+
+        The result (or the exception raised) is kept, and returned (or
+        re-raised) by the :meth:`read` calls that thumbor's handler makes
+        afterwards. If this coroutine is cancelled, any running ffmpeg,
+        gifski or gifsicle processes are killed.
+
+        Waiting for capacity under FFMPEG_MAX_CONCURRENT_JOBS happens on the
+        loop, before the transcode takes an executor thread. If it takes
+        longer than FFMPEG_QUEUE_TIMEOUT, :class:`FFmpegQueueTimeout` is
+        raised from here rather than kept for :meth:`read`; so is a timeout
+        waiting for one of the FFMPEG_HOST_SLOTS. The FFMPEG_TRANSCODE_CACHE
+        is looked up in the executor too, before waiting.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(None, self.cached_transcode, extension)
+        except Exception as e:
+            self.transcoded = None, e
+            return
+        if result is not None:
+            self.transcoded = result, None
+            return
+        scheduler = self.scheduler
+        start = time.monotonic()
+        try:
+            self.job = await scheduler.acquire_async(
+                self.job_weight(extension), self.queue_timeout,
+                self._record_queue_depth)
+        except FFmpegQueueTimeout:
+            self._record_queue_timeout()
+            raise
+        self._record_queue_wait(start)
+        try:
+            await self._read_async(extension)
+        finally:
+            scheduler.release(self.job)
+            self.job = None
+
+    async def _read_async(self, extension):
+        loop = asyncio.get_running_loop()
+        self.event_loop = loop
+        try:
+            result = await loop.run_in_executor(None, self.transcode, extension)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        except FFmpegQueueTimeout:
+            raise
+        except Exception as e:
+            self.transcoded = None, e
         else:
-            out_format = FORMATS[extension]
+            self.transcoded = result, None
+        finally:
+            self.event_loop = None
+
+    def cancel(self):
+        """Kills the running subprocesses of a transcode started by
+        :meth:`read_async`, and stops it from starting any more."""
+        self.cancelled = True
+        for future in list(self.pending_processes):
+            future.cancel()
+
+    def run_process(self, func, *args):
+        """Runs a :mod:`thumbor_video_engine.process` coroutine function to
+        completion with :meth:`run_coroutine`, holding a host slot (see
+        FFMPEG_HOST_SLOTS)."""
+        if self.cancelled:
+            raise asyncio.CancelledError()
+        with self.host_slot():
+            return self.run_coroutine(func, *args)
+
+    def run_coroutine(self, func, *args):
+        """Runs the coroutine function ``func`` to completion. It runs on the
+        event loop set by :meth:`read_async` or ``load_async`` when called
+        from their executor thread, where :meth:`cancel` cancels it, and
+        otherwise on a private loop."""
+        if self.cancelled:
+            raise asyncio.CancelledError()
+        loop = self.event_loop
+        if loop is None or not loop.is_running() or _running_loop() is loop:
+            return process.run_sync(func(*args))
+        future = asyncio.run_coroutine_threadsafe(func(*args), loop)
+        self.pending_processes.add(future)
+        try:
+            return future.result()
+        finally:
+            self.pending_processes.discard(future)
+
+    @property
+    def host_slots(self):
+        num_slots = self.context.config.FFMPEG_HOST_SLOTS
+        if not num_slots:
+            return None
+        return HostSlots(self.context.config.FFMPEG_HOST_SLOTS_PATH, num_slots)
+
+    @contextmanager
+    def host_slot(self):
+        """Holds one of the FFMPEG_HOST_SLOTS shared by all thumbor processes
+        on the host, if enabled. Raises :class:`FFmpegQueueTimeout` if none is
+        free within FFMPEG_QUEUE_TIMEOUT."""
+        slots = self.host_slots
+        if slots is None:
+            yield
+            return
+        metrics = getattr(self.context, 'metrics', None)
+        start = time.monotonic()
+        slot = slots.acquire(self.queue_timeout, lambda: self.cancelled)
+        if slot is None:
+            if self.cancelled:
+                raise asyncio.CancelledError()
+            if metrics:
+                metrics.incr('video.host_slot.timeout')
+            raise FFmpegQueueTimeout(
+                "Timed out after %ss waiting for one of the %d host slots in %s"
+                % (self.queue_timeout, slots.num_slots, slots.path))
+        wait_time = time.monotonic() - start
+        logger.debug("Waited %.3fs for host slot %d", wait_time, slot.index)
+        if metrics:
+            metrics.timing('video.host_slot.latency', wait_time * 1000)
+        try:
+            yield
+        finally:
+            slot.release()
+
+    @property
+    def scheduler(self):
+        return transcode_scheduler(
+            self.context.config.FFMPEG_MAX_CONCURRENT_JOBS or 0)
+
+    @property
+    def queue_timeout(self):
+        return self.context.config.FFMPEG_QUEUE_TIMEOUT
+
+    def job_weight(self, extension):
+        """The FFMPEG_JOB_WEIGHTS weight of a transcode to ``extension``"""
+        out_format = self.output_format(extension)
+        if out_format == 'gif':
+            if self.context.config.FFMPEG_GIF_PIPELINE == 'gifski':
+                key = 'gifski'
+            else:
+                key = 'gif-legacy'
+        else:
+            key = JOB_WEIGHT_KEYS.get(out_format, out_format)
+        weights = self.context.config.FFMPEG_JOB_WEIGHTS or {}
+        renditions = self.ladder_renditions(out_format)
+        if renditions:
+            # all of them are encoded at once
+            return sum(weights.get(RENDITION_CODECS[f], 1) for _, _, f in renditions)
+        if self.pending_intermediate(out_format) is not None:
+            # the intermediate is an h264 encode ahead of the transcode
+            return weights.get(key, 1) + weights.get('h264', 1)
+        return weights.get(key, 1)
+
+    def _record_queue_wait(self, start):
+        metrics = getattr(self.context, 'metrics', None)
+        if metrics and self.scheduler.max_weight:
+            metrics.timing(
+                'video.transcode.queue.latency',
+                (time.monotonic() - start) * 1000)
+
+    def _record_queue_depth(self, depth):
+        metrics = getattr(self.context, 'metrics', None)
+        if metrics and self.scheduler.max_weight:
+            # thumbor's metrics have no gauges
+            metrics.timing('video.transcode.queue.depth', depth)
+
+    def _record_queue_timeout(self):
+        logger.warning(
+            "Transcode queue timeout for url `%s`",
+            getattr(self.context.request, 'url', None))
+        metrics = getattr(self.context, 'metrics', None)
+        if metrics:
+            metrics.incr('video.transcode.queue.timeout')
+
+    @contextmanager
+    def transcode_job(self, extension):
+        """Holds a :class:`TranscodeScheduler` slot for the duration of a
+        transcode, unless :meth:`read_async` already holds one."""
+        scheduler = self.scheduler
+        if self.job is not None:
+            yield
+            return
+        start = time.monotonic()
+        try:
+            self.job = scheduler.acquire(
+                self.job_weight(extension), self.queue_timeout,
+                self._record_queue_depth)
+        except FFmpegQueueTimeout:
+            self._record_queue_timeout()
+            raise
+        self._record_queue_wait(start)
+        try:
+            yield
+        finally:
+            scheduler.release(self.job)
+            self.job = None
+
+    @property
+    def ffmpeg_threads(self):
+        """
+        The ``-threads`` value for the next ffmpeg run under FFMPEG_THREADS,
+        or ``None`` to leave it to ffmpeg. With ``'auto'``, larger outputs get
+        more threads (see :data:`AUTO_THREADS_BY_PIXELS`), but never more than
+        an even share of the cores between the transcodes running in this
+        process.
+        """
+        threads = self.context.config.FFMPEG_THREADS
+        if threads != 'auto':
+            return int(threads) if threads else None
+        width, height = self.image_size
+        size_threads = next(
+            (n for max_pixels, n in AUTO_THREADS_BY_PIXELS
+             if width * height <= max_pixels),
+            MAX_AUTO_THREADS)
+        running_jobs = max(1, self.scheduler.running_jobs)
+        return max(1, min(size_threads, cpu_count() // running_jobs))
+
+    def thread_flags(self, threads):
+        if threads is None:
+            return []
+        return ['-threads', '%d' % threads, '-filter_threads', '%d' % threads]
+
+    def vp9_tile_columns(self, threads):
+        """The log2 ``-tile-columns`` value that lets libvpx-vp9 use up to
+        ``threads`` threads at the output width"""
+        width = self.image_size[0]
+        tile_columns = 0
+        while ((2 << tile_columns) <= threads
+                and (2 << tile_columns) * MIN_VP9_TILE_WIDTH <= width):
+            tile_columns += 1
+        return tile_columns
 
-        with self.make_src_file(extension) as src_file:
+    def transcode(self, extension):
+        result = self.cached_transcode(extension)
+        if result is not None:
+            return result
+        with self.transcode_job(extension):
+            result = self._transcode(extension)
+        if self.transcode_key is not None:
+            self.transcode_cache.put(self.transcode_key, result)
+        return result
+
+    def output_format(self, extension):
+        """The format of a transcode to ``extension``: the requested one, if
+        any"""
+        return getattr(self.context.request, 'format', None) or FORMATS.get(extension)
+
+    def _transcode(self, extension):
+        out_format = self.output_format(extension)
+        if out_format in ('hevc', 'h264', 'h265'):
+            extension = '.mp4'
+            self.context.request.format = 'mp4'
+
+        if self.still_position is not None:
+            return self.transcode_to_still(out_format)
+        sprite = getattr(self.context.request, 'sprite', None)
+        if sprite and self.can_encode_still(out_format):
+            return self.transcode_to_sprite(extension, out_format, *sprite)
+        renditions = self.ladder_renditions(out_format)
+        if renditions:
+            return self.transcode_ladder(out_format, renditions)
+
+        with self.transcode_src_file(extension) as src_file:
             if out_format == 'webp':
                 return self.transcode_to_webp(src_file)
             elif out_format in ('webm', 'vp9'):
@@ -251,33 +1046,451 @@ class Engine(BaseEngine):
             else:
                 raise FFmpegError("Invalid video format '%s' requested" % out_format)
 
+    @property
+    def transcode_cache(self):
+        if not self.context.config.FFMPEG_TRANSCODE_CACHE:
+            return None
+        return TranscodeCache(
+            self.context.config.FFMPEG_TRANSCODE_CACHE_PATH,
+            self.context.config.FFMPEG_TRANSCODE_CACHE_MAX_SIZE)
+
+    def cached_transcode(self, extension):
+        """
+        The result of a transcode to ``extension`` from FFMPEG_TRANSCODE_CACHE,
+        or ``None`` if it is not there (or the cache is off). After a miss,
+        :attr:`transcode_key` is set for the result to be stored under, and
+        the cache is not looked up again.
+        """
+        cache = self.transcode_cache
+        if cache is None or self.transcode_key is not None:
+            return None
+        out_format = self.output_format(extension)
+        key = self.transcode_cache_key(out_format)
+        if key is None:
+            return None
+        result = cache.get(key)
+        metrics = getattr(self.context, 'metrics', None)
+        if metrics:
+            metrics.incr(
+                'video.transcode_cache.%s' % ('miss' if result is None else 'hit'))
+        if result is None:
+            self.transcode_key = key
+        elif out_format in ('hevc', 'h264', 'h265'):
+            # served as mp4, as by _transcode
+            self.context.request.format = 'mp4'
+        return result
+
+    def transcode_cache_key(self, out_format):
+        """
+        The FFMPEG_TRANSCODE_CACHE key of a transcode to ``out_format``: a
+        digest of the source, the :attr:`ffmpeg_vfilters`, the format
+        (with :data:`FORMAT_ALIASES` merged), the still or sprite, the
+        :meth:`trim_window`, the quality, tune and lossless of the request,
+        the encoder settings of
+        the config and the version of ffmpeg. Transcodes that make
+        FFMPEG_RENDITIONS are left out, and have no key.
+        """
+        if self.ladder_renditions(out_format):
+            return None
+        request = self.context.request
+        config = self.context.config
+        still = self.still_position
+        if still is not None:
+            seconds = still_position_seconds(still)
+            still = str(still if seconds is None else seconds)
+        sprite = getattr(request, 'sprite', None)
+        if sprite and not self.can_encode_still(out_format):
+            sprite = None
+        window = self.trim_window()
+        settings = dict(
+            (name, getattr(config, name)) for name in Config.class_defaults
+            if (name.startswith(ENCODER_SETTING_PREFIXES) or name in QUALITY_SETTINGS)
+            and name not in NON_ENCODER_SETTINGS)
+        parts = {
+            'source': self.source.digest,
+            'format': FORMAT_ALIASES.get(out_format, out_format),
+            'vfilters': self.ffmpeg_vfilters,
+            'still': still,
+            'sprite': [str(value) for value in sprite] if sprite else None,
+            'trim': [str(value) for value in window] if window else None,
+            'quality': request.quality,
+            'tune': getattr(request, 'tune', None),
+            'lossless': getattr(request, 'lossless', None),
+            'settings': settings,
+            'ffmpeg': self.capabilities.version,
+        }
+        data = json.dumps(parts, sort_keys=True, default=repr)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    @property
+    def intermediate_cache(self):
+        if not self.context.config.FFMPEG_INTERMEDIATE_CACHE:
+            return None
+        return IntermediateCache(
+            self.context.config.FFMPEG_INTERMEDIATE_CACHE_PATH,
+            self.context.config.FFMPEG_INTERMEDIATE_CACHE_MAX_SIZE)
+
+    def intermediate_size(self):
+        """
+        The smallest of FFMPEG_INTERMEDIATE_SIZES (along the shorter side)
+        that is smaller than the source, but at least as large as the output
+        at the scale of the cropped region; or ``None`` if this transcode
+        should start from the original.
+        """
+        size = self.video_operations().size
+        if size is None or not self.source.is_video:
+            return None
+        short_side = min(self.original_size)
+        crop_width, crop_height = self.crop_info[:2]
+        width, height = size
+        min_scale = max(width / crop_width, height / crop_height)
+        for size in sorted(self.context.config.FFMPEG_INTERMEDIATE_SIZES or []):
+            if short_side * min_scale <= size < short_side:
+                return size
+        return None
+
+    def intermediate_dimensions(self, size):
+        """The width and height of the intermediate with ``size`` pixels
+        along its shorter side, rounded down to even numbers for libx264"""
+        scale = size / min(self.original_size)
+        return tuple(int(d * scale) // 2 * 2 for d in self.original_size)
+
+    def pending_intermediate(self, out_format):
+        """The size of the intermediate that a transcode to ``out_format``
+        would make first under FFMPEG_INTERMEDIATE_CACHE, or ``None`` if it
+        has none to make"""
+        cache = self.intermediate_cache
+        if cache is None or self.still_position is not None:
+            return None
+        if self.ladder_renditions(out_format):
+            return None
+        size = self.intermediate_size()
+        if size is None or cache.exists(self.source.digest, size):
+            return None
+        return size
+
+    def make_intermediate(self, cache, size, extension):
+        """Transcodes the source to its intermediate at ``size`` in
+        ``cache``, and returns the path; or ``None`` if ffmpeg fails, or if
+        another transcode is making it already, in which case this one
+        starts from the source rather than wait for it."""
+        width, height = self.intermediate_dimensions(size)
+        digest = self.source.digest
+        try:
+            with cache.lock(digest, size) as locked:
+                if not locked:
+                    logger.debug("[FFMPEG_INTERMEDIATE_CACHE] the %dp intermediate "
+                                 "is being made by another transcode" % size)
+                    metrics = getattr(self.context, 'metrics', None)
+                    if metrics:
+                        metrics.incr('video.intermediate.busy')
+                    return None
+                # made between the cache lookup and taking the lock
+                path = cache.get(digest, size)
+                if path is not None:
+                    return path
+                self._make_intermediate(cache, size, extension, width, height)
+        except FFmpegQueueTimeout:
+            raise
+        except FFmpegError as e:
+            logger.warning("[FFMPEG_INTERMEDIATE_CACHE] could not make a %dp "
+                           "intermediate: %s" % (size, e))
+            return None
+        except OSError as e:
+            logger.warning("[FFMPEG_INTERMEDIATE_CACHE] could not store a %dp "
+                           "intermediate: %s" % (size, e))
+            return None
+        return cache.get(digest, size)
+
+    def _make_intermediate(self, cache, size, extension, width, height):
+        with self.make_src_file(extension) as src_file, \
+                cache.store(self.source.digest, size) as out_file:
+            self.run_cmd([
+                self.ffmpeg_path, '-hide_banner',
+            ] + self._input_flags(src_file) + [
+                '-i', src_file,
+                '-an', '-vf', 'scale=%d:%d:flags=lanczos' % (width, height),
+                '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+                '-crf', '%s' % self.context.config.FFMPEG_INTERMEDIATE_CRF,
+                '-preset', self.context.config.FFMPEG_INTERMEDIATE_PRESET,
+            ] + self.thread_flags(self.ffmpeg_threads) + [
+                '-f', 'mp4', '-y', out_file])
+
+    @contextmanager
+    def transcode_src_file(self, extension):
+        """
+        Like :meth:`make_src_file`, but yields the intermediate to start from
+        under FFMPEG_INTERMEDIATE_CACHE, if any, making it if needed, or else
+        the source to be decoded at :meth:`lowres_factor` (see
+        :meth:`decoding_at`).
+        """
+        cache = self.intermediate_cache
+        size = self.intermediate_size() if cache is not None else None
+        path = None
+        if size is not None:
+            path = cache.get(self.source.digest, size)
+            metrics = getattr(self.context, 'metrics', None)
+            if metrics:
+                metrics.incr('video.intermediate.%s' % ('hit' if path else 'miss'))
+            if path is None:
+                path = self.make_intermediate(cache, size, extension)
+        if path is not None:
+            with self.decoding_at(self.intermediate_dimensions(size), intermediate=True):
+                yield path
+            return
+
+        lowres = self.lowres_factor()
+        if lowres:
+            metrics = getattr(self.context, 'metrics', None)
+            if metrics:
+                metrics.incr('video.decode.lowres')
+        # the decoder rounds odd sizes up
+        src_width, src_height = self.original_size
+        decoded_size = -(-src_width >> lowres), -(-src_height >> lowres)
+        with self.make_src_file(extension) as src_file, \
+                self.decoding_at(decoded_size, lowres):
+            yield src_file
+
+    @contextmanager
+    def decoding_at(self, size, lowres=0, intermediate=False):
+        """
+        Sets up a ``size`` version of the source, such as an intermediate or
+        the source decoded at ``-lowres``, to be decoded for the duration of
+        the block: the crop is rescaled from the source to it, and
+        :attr:`decode_flags` set to the ``-lowres``,
+        :meth:`fast_decode_flags` and :meth:`trim_flags` to decode it with.
+        """
+        crop_info = self.crop_info
+        src_width, src_height = self.original_size
+        width, height = size
+        out_width, out_height, left, top = crop_info
+        left, top = round(left * width / src_width), round(top * height / src_height)
+        self.crop_info = (
+            max(1, min(round(out_width * width / src_width), width - left)),
+            max(1, min(round(out_height * height / src_height), height - top)),
+            left, top)
+        self.decode_flags = ['-lowres', '%d' % lowres] if lowres else []
+        self.decode_flags += self.fast_decode_flags() + self.trim_flags()
+        self.decoding_intermediate = intermediate
+        try:
+            yield
+        finally:
+            self.crop_info = crop_info
+            self.decode_flags = []
+            self.decoding_intermediate = False
+
+    def fast_decode_flags(self):
+        """
+        The decoder flags of FFMPEG_FAST_DECODE_RATIO: ``-skip_loop_filter
+        all`` and ``-flags2 fast`` if the crop of what is decoded is scaled
+        down by at least that ratio along both sides, so that the blocking
+        they let through is too small to see in the output.
+        """
+        ratio = self.context.config.FFMPEG_FAST_DECODE_RATIO
+        if not ratio or not self.source.is_video:
+            return []
+        size = self.video_operations().size
+        if size is None:
+            return []
+        width, height = size
+        crop_width, crop_height = self.crop_info[:2]
+        if crop_width < width * ratio or crop_height < height * ratio:
+            return []
+        return ['-skip_loop_filter', 'all', '-flags2', 'fast']
+
+    @property
+    def can_seek_source(self):
+        """Whether ffmpeg can seek in the source (or its intermediate), as it
+        can in video containers but not in gifs or streamed frames"""
+        return self.source.is_video
+
+    def source_fps(self):
+        """
+        The frame rate of the source: that of its frames, or for gifs and
+        webps with varying delays their average rate; ``None`` if it is not
+        known.
+        """
+        info = self.gif_info if self.gif_info is not None else self.webp_info
+        if info is not None:
+            if info.uniform_fps:
+                return info.uniform_fps
+            duration = Fraction(info.duration)
+            return info.frame_count / duration if duration else None
+        if self.frame_durations:
+            total = sum(self.frame_durations)
+            return Fraction(1000 * len(self.frame_durations), total) if total else None
+        try:
+            return Fraction(self.source_frame_rate)
+        except (TypeError, ValueError, ZeroDivisionError):
+            return None
+
+    def requested_fps(self):
+        """
+        The frame rate of the fps() filter, if it is lower than
+        :meth:`source_fps`, or else ``None``: it never adds frames, so it is
+        also ignored for sources of unknown frame rate. Stills and sprites
+        ignore it.
+        """
+        request = self.context.request
+        fps = getattr(request, 'fps', None)
+        if not fps or self.still_position is not None or getattr(request, 'sprite', None):
+            return None
+        source_fps = self.source_fps()
+        if not source_fps or fps >= source_fps:
+            return None
+        return fps
+
+    def trim_window(self):
+        """
+        The ``(start, end)`` seconds of the source that the trim() and
+        duration() filters keep, with ``end`` ``None`` for the end of the
+        source; or ``None`` if they keep all of it. For gif sources the
+        window takes in whole frames (see :meth:`GifInfo.frame_span`). A
+        window that starts past the end of the source is ignored, as it is
+        for stills and sprites.
+        """
+        request = self.context.request
+        if self.still_position is not None or getattr(request, 'sprite', None):
+            return None
+        start, end = getattr(request, 'trim_range', None) or (0, None)
+        max_duration = getattr(request, 'max_duration', None)
+        if max_duration and (end is None or end > start + max_duration):
+            end = start + max_duration
+        if self.gif_info is not None:
+            span = self.gif_info.frame_span(start, end)
+            if span is None:
+                logger.warning("Ignoring trim from %s seconds, past the end of the gif" % start)
+                return None
+            start, end = span
+        duration = Fraction(self.duration or 0)
+        if duration and start >= duration:
+            logger.warning("Ignoring trim from %s seconds, past the end of the video" % start)
+            return None
+        if duration and end is not None and end >= duration:
+            end = None
+        if not start and end is None:
+            return None
+        return start, end
+
+    def trim_flags(self):
+        """
+        The input flags of :meth:`trim_window`: ``-ss`` and ``-t``, so that
+        ffmpeg seeks to the start and stops reading at the end. Sources that
+        cannot be seeked in are only stopped at the end, and their frames up
+        to the start dropped by the ``trim`` filter of :attr:`ffmpeg_vfilters`.
+        """
+        window = self.trim_window()
+        if window is None:
+            return []
+        start, end = window
+        if not self.can_seek_source:
+            return ['-t', '%.6f' % end] if end is not None else []
+        flags = ['-ss', '%.6f' % start] if start else []
+        if end is not None:
+            flags += ['-t', '%.6f' % (end - start)]
+        return flags
+
+    def keyframe_flags(self, fps):
+        """
+        ``-skip_frame nokey`` under FFMPEG_GIF_KEYFRAMES_ONLY, if the source
+        is being decoded into frames at ``fps`` and has a keyframe at least
+        every ``1 / fps`` seconds, so that every output frame can be taken
+        from a keyframe without decoding the frames between them.
+        """
+        if not self.context.config.FFMPEG_GIF_KEYFRAMES_ONLY or self.decoding_intermediate:
+            return []
+        if not self.can_seek_source:
+            return []
+        index = self.keyframes()
+        if index is None or not index.times:
+            return []
+        times = list(index.times) + [self.duration or index.times[-1]]
+        gaps = [Fraction(b) - Fraction(a) for a, b in zip(times, times[1:])]
+        if times[0] > 0 or max(gaps, default=Fraction(0)) > 1 / Fraction(fps):
+            return []
+        return ['-skip_frame', 'nokey']
+
+    def lowres_factor(self):
+        """
+        The ``-lowres`` to decode the source with under FFMPEG_LOWRES_DECODE:
+        the largest ``n`` up to :data:`MAX_LOWRES` for which the crop at
+        ``1/2**n`` of its size is still at least as large as the output, if
+        the source is in one of :data:`LOWRES_CODECS`; otherwise 0.
+        """
+        if not self.context.config.FFMPEG_LOWRES_DECODE:
+            return 0
+        if not self.source.is_video:
+            return 0
+        size = self.video_operations().size
+        if size is None:
+            return 0
+        probe_data = self.ffprobe()
+        if (probe_data.get('codec_name') not in LOWRES_CODECS
+                and probe_data.get('codec_tag_string') not in LOWRES_CODEC_TAGS):
+            return 0
+        width, height = size
+        crop_width, crop_height = self.crop_info[:2]
+        lowres = 0
+        while (lowres < MAX_LOWRES and crop_width >> (lowres + 1) >= width
+                and crop_height >> (lowres + 1) >= height):
+            lowres += 1
+        return lowres
+
+    def can_pipe_input(self):
+        """
+        Whether the source can be streamed to ffmpeg's stdin instead of being
+        written to a temp file. Only containers that ffmpeg can demux without
+        seeking qualify: mp4/mov files need their ``moov`` box ahead of the
+        media data, and gifs need a recent enough ffmpeg.
+        """
+        if not self.context.config.FFMPEG_PIPE_INPUT:
+            return False
+        mime = self.source.mimetype
+        if mime == 'video/webm':
+            return True
+        elif mime in ('video/mp4', 'video/quicktime'):
+            return self.source.is_streamable_mp4
+        elif mime == 'image/gif':
+            version = ffmpeg_version(self.ffmpeg_path)
+            return version is not None and version >= MIN_GIF_PIPE_FFMPEG_VERSION
+        return False
+
     @contextmanager
     def make_src_file(self, extension):
-        mime = self.get_mimetype(self.buffer)
-        is_webp = mime == 'image/webp'
-        if not is_webp:
+        is_webp = self.source.mimetype == 'image/webp'
+        if not is_webp and self.can_pipe_input():
+            yield PIPE_INPUT
+        elif not is_webp:
             with named_tmp_file(data=self.buffer, suffix=extension) as src_file:
                 yield src_file
         else:
-            with make_tmp_dir() as tmp_dir:
-                im = self.image
-                num_frames = im.n_frames
-                num_digits = len(str(num_frames))
-                format_str = "%(dir)s/%(idx)0{}d.tif".format(num_digits)
-                concat_buf = BytesIO()
-                concat_buf.write(b"ffconcat version 1.0\n")
-                concat_buf.write(b"# %dx%d\n" % im.size)
-                for i, frame in enumerate(ImageSequence.Iterator(im)):
+            # ffmpeg cannot decode animated webp, so the frames decoded by
+            # PIL are streamed to its stdin (see _stdin_data)
+            yield PIPE_INPUT
+
+    @property
+    def streams_frames(self):
+        """Whether the source is fed to ffmpeg as decoded frames, by
+        :meth:`iter_frames`, rather than as is"""
+        return self.source.mimetype == 'image/webp'
+
+    def iter_frames(self):
+        """
+        Decodes the source image with PIL one frame at a time, yielding a
+        Matroska stream of its RGBA frames with their durations, as read by
+        ffmpeg with ``-f matroska``.
+        """
+        im = self.image
+
+        def frames():
+            try:
+                for frame in ImageSequence.Iterator(im):
                     frame.load()
-                    duration_ms = im.info['duration']
-                    out_file = format_str % {'dir': tmp_dir, 'idx': i}
-                    frame.save(out_file, lossless=True)
-                    concat_buf.write(b"file '%s'\n" % out_file.encode('utf-8'))
-                    duration_str = "%s" % (Decimal(duration_ms) / Decimal(1000))
-                    concat_buf.write(b"duration %s\n" % duration_str.encode('utf-8'))
-                self.buffer = concat_buf.getvalue()
-                with named_tmp_file(data=self.buffer, suffix='.txt') as src_file:
-                    yield src_file
+                    yield frame.convert('RGBA').tobytes(), im.info.get('duration', 0)
+            finally:
+                im.seek(0)
+
+        return iter_rgba_mkv(im.size, frames())
 
     def get_config(self, prop, format):
         req_val = getattr(self.context.request, prop, None)
@@ -287,6 +1500,131 @@ class Engine(BaseEngine):
             config_key = ('ffmpeg_%s_%s' % (format, prop)).upper()
             return getattr(self.context.config, config_key)
 
+    def can_encode_still(self, out_format):
+        """Whether a still frame can be encoded to ``out_format`` by
+        :meth:`transcode_to_still`: one of :data:`STILL_CODECS`, or avif if
+        ffmpeg has an AV1 encoder and the avif muxer"""
+        if out_format == 'avif':
+            capabilities = self.capabilities
+            return capabilities.av1_encoder is not None and capabilities.has_muxer('avif')
+        return out_format in STILL_CODECS
+
+    def still_quality(self, out_format):
+        """The quality that thumbor would encode a still in ``out_format``
+        with: the requested one, or else WEBP_QUALITY, AVIF_QUALITY or
+        QUALITY"""
+        quality = self.context.request.quality
+        if quality is None and out_format == 'webp':
+            quality = self.context.config.WEBP_QUALITY
+        if quality is None and out_format == 'avif':
+            quality = self.context.config.AVIF_QUALITY
+        if quality is None:
+            quality = self.context.config.QUALITY
+        return quality
+
+    def still_codec_flags(self, out_format):
+        """The :data:`STILL_CODECS` flags of ``out_format``, with those for
+        its :meth:`still_quality`"""
+        if out_format == 'avif':
+            return self.avif_still_flags()
+        flags = list(STILL_CODECS[out_format])
+        quality = self.still_quality(out_format)
+        if out_format in ('jpg', 'jpeg'):
+            flags += ['-qmin', '1', '-q:v', '%d' % mjpeg_qscale(quality)]
+        elif out_format == 'webp':
+            flags += ['-quality', '%s' % quality]
+        return flags
+
+    def avif_still_flags(self):
+        """The encoder and muxer flags of an avif still, with the first of
+        :data:`~thumbor_video_engine.capabilities.AV1_ENCODERS` that ffmpeg
+        has, at the crf closest to its :meth:`still_quality`"""
+        encoder = self.capabilities.av1_encoder
+        crf = '%d' % avif_crf(self.still_quality('avif'))
+        flags = ['-c:v', encoder, '-pix_fmt', 'yuv420p']
+        if encoder == 'libaom-av1':
+            flags += ['-still-picture', '1', '-cpu-used', '6', '-crf', crf, '-b:v', '0']
+        else:
+            flags += ['-preset', '8', '-crf', crf]
+        return flags + ['-f', 'avif']
+
+    def transcode_to_still(self, out_format):
+        """
+        Encodes the frame at :attr:`still_position` to ``out_format`` (one of
+        :data:`STILL_CODECS`) in a single ffmpeg run, with the crop, resize,
+        flips and grayscale applied by :attr:`ffmpeg_vfilters`. This takes
+        the place of a png that the image engine would decode, transform and
+        encode again.
+        """
+        vf_flags = ['-vf', ','.join(self.ffmpeg_vfilters)] if self.ffmpeg_vfilters else []
+        flags = ['-frames:v', '1', '-an'] + vf_flags + self.still_codec_flags(out_format)
+        muxer = flags[flags.index('-f') + 1]
+        return self.extract_still(self.still_position, muxer, flags)
+
+    def sprite_interval(self, columns, rows, interval=0):
+        """The time in seconds between the frames of a sprite(): the
+        requested ``interval``, or else the duration spread evenly over the
+        tiles"""
+        if interval:
+            return Fraction(interval)
+        duration = Fraction(self.duration or 0)
+        if duration <= 0:
+            return Fraction(1)
+        return duration / (columns * rows)
+
+    def sprite_map(self, columns, rows, interval=0):
+        """
+        Where each frame of a sprite() is: the size of the sprite and its
+        tiles, and the time and top left corner of each tile that has a
+        frame. Tiles past the end of the video are left out (and are black
+        in the sprite).
+        """
+        interval = self.sprite_interval(columns, rows, interval)
+        tile_width, tile_height = self.image_size
+        count = columns * rows
+        duration = Fraction(self.duration or 0)
+        if duration > 0:
+            count = min(count, max(1, math.ceil(duration / interval)))
+        return {
+            'columns': columns,
+            'rows': rows,
+            'interval': float(interval),
+            'width': tile_width * columns,
+            'height': tile_height * rows,
+            'tile_width': tile_width,
+            'tile_height': tile_height,
+            'frames': [{
+                'time': float(i * interval),
+                'x': (i % columns) * tile_width,
+                'y': (i // columns) * tile_height,
+            } for i in range(count)],
+        }
+
+    def transcode_to_sprite(self, extension, out_format, columns, rows, interval=0):
+        """
+        Tiles frames of the source, ``interval`` seconds apart, into a sprite
+        of ``columns`` x ``rows`` tiles in ``out_format`` (one of
+        :data:`STILL_CODECS`), in a single ffmpeg run that decodes the source
+        once. Each tile has the crop and resize of the request. See
+        :meth:`sprite_map` for where each frame ends up.
+        """
+        interval = self.sprite_interval(columns, rows, interval)
+        # round=up makes each tile the frame shown at its time, rather than
+        # the last one up to half an interval later
+        vfilters = (
+            ['fps=%s:round=up' % (1 / interval)] + self.ffmpeg_vfilters
+            + ['tile=%dx%d' % (columns, rows)])
+        flags = ['-frames:v', '1', '-an', '-vf', ','.join(vfilters)]
+        flags += self.still_codec_flags(out_format)
+        input_flags = []
+        end = columns * rows * interval
+        if end < Fraction(self.duration or 0):
+            # stop decoding once the last tile is filled
+            input_flags += ['-t', '%.6f' % end]
+        muxer = flags[flags.index('-f') + 1]
+        with self.transcode_src_file(extension) as src_file:
+            return self.run_ffmpeg(src_file, muxer, flags, input_flags=input_flags)
+
     def transcode_to_webp(self, src_file):
         is_lossless = self.get_config('lossless', 'webp')
         if is_lossless or self.has_transparency():
@@ -310,6 +1648,7 @@ class Engine(BaseEngine):
                 "%s" % self.context.config.FFMPEG_WEBP_COMPRESSION_LEVEL]
         if self.context.config.FFMPEG_WEBP_QSCALE is not None:
             flags += ['-qscale', "%s" % self.context.config.FFMPEG_WEBP_QSCALE]
+        flags += self.thread_flags(self.ffmpeg_threads)
 
         return self.run_ffmpeg(src_file, 'webp', flags=flags, two_pass=False)
 
@@ -320,12 +1659,12 @@ class Engine(BaseEngine):
         return self._gif_route('legacy', self._gif_legacy, src_file)
 
     def _gifski_path(self):
-        configured = self.context.config.GIFSKI_PATH
-        return which(configured) if configured else which('gifski')
+        return self.capabilities.gifski_path
 
     def _input_flags(self, src_file):
-        # text files in concat-format require additional input flags
-        return ['-f', 'concat', '-safe', '0'] if src_file.endswith('.txt') else []
+        if src_file == PIPE_INPUT and self.streams_frames:
+            return ['-f', 'matroska'] + list(self.decode_flags)
+        return list(self.decode_flags)
 
     def _transcode_to_gif_gifski(self, src_file):
         # gifski's quantizer working set grows with output dimensions
@@ -354,18 +1693,20 @@ class Engine(BaseEngine):
             return self._gif_route('legacy', self._gif_legacy, src_file)
 
         repeat = "-1" if info.loop_count is None else str(info.loop_count)
+        fps = self.requested_fps() or info.uniform_fps
         if self._gif_visibly_transparent(info):
             return self._gif_route(
-                'png', self._gifski_png_frames, src_file, info.uniform_fps, repeat)
+                'png', self._gifski_png_frames, src_file, fps, repeat)
         return self._gif_route(
-            'y4m', self._gifski_y4m, src_file, info.uniform_fps, repeat)
+            'y4m', self._gifski_y4m, src_file, fps, repeat)
 
     def _gifski_oversized_target(self, src_file):
         """Chosen when the target output exceeds ``GIFSKI_MAX_TARGET_PIXELS``
         (gifski's quantizer memory grows with output size). Override to serve
         something faster (e.g. a quick low-quality pass with a background
         re-encode). Defaults to the bounded-memory legacy path."""
-        return self._gif_route('legacy_large', self._gif_legacy, src_file)
+        return self._gif_route(
+            'legacy_large', self._gif_legacy, src_file, False)
 
     def _gif_visibly_transparent(self, info):
         """GCE transparency flags over-approximate: optimized opaque GIFs
@@ -389,7 +1730,7 @@ class Engine(BaseEngine):
             fps = DEFAULT_VIDEO_GIF_FPS
         if fps <= 0:
             fps = DEFAULT_VIDEO_GIF_FPS
-        return min(fps, MAX_VIDEO_GIF_FPS)
+        return min(fps, self.requested_fps() or MAX_VIDEO_GIF_FPS, MAX_VIDEO_GIF_FPS)
 
     def _gifski_quality(self):
         """Quality (1-100) passed to gifski. Override to vary it per request
@@ -424,10 +1765,13 @@ class Engine(BaseEngine):
         ]
 
     def _gifski_y4m(self, src_file, fps, repeat):
-        vf = self.ffmpeg_vfilters + ["fps=%s" % fps]
+        vf = self.ffmpeg_vfilters
+        if fps != self.requested_fps():
+            vf += ["fps=%s" % fps]
         ffmpeg_cmd = (
             [self.ffmpeg_path, "-hide_banner", "-loglevel", "error"]
             + self._input_flags(src_file)
+            + self.keyframe_flags(fps)
             + [
                 "-i", src_file,
                 "-an",
@@ -446,7 +1790,9 @@ class Engine(BaseEngine):
                 return f.read()
 
     def _gifski_png_frames(self, src_file, fps, repeat):
-        vf = self.ffmpeg_vfilters + ["fps=%s" % fps]
+        vf = self.ffmpeg_vfilters
+        if fps != self.requested_fps():
+            vf += ["fps=%s" % fps]
         with make_tmp_dir() as tmp_dir:
             self.run_cmd(
                 [self.ffmpeg_path, "-hide_banner", "-loglevel", "error"]
@@ -483,87 +1829,111 @@ class Engine(BaseEngine):
         """Run ``src_cmd | sink_cmd``, streaming src's stdout into sink's
         stdin. Raises :class:`FFmpegError` if either process exits non-zero."""
         logger.debug("Running `%s | %s`", " ".join(src_cmd), " ".join(sink_cmd))
-        src_proc = Popen(src_cmd, stdout=PIPE, stderr=PIPE, stdin=DEVNULL)
-        try:
-            sink_proc = Popen(
-                sink_cmd, stdin=src_proc.stdout, stdout=DEVNULL, stderr=PIPE)
-        except Exception:
-            src_proc.kill()
-            src_proc.stdout.close()
-            src_proc.stderr.close()
-            src_proc.wait()
-            raise
-        # Drop our duplicate of the write end so that, if the sink dies, the
-        # source gets SIGPIPE instead of blocking forever
-        src_proc.stdout.close()
-
-        src_stderr = []
+        src_returncode, sink_returncode, src_stderr, sink_stderr = (
+            self.run_process(
+                process.run_pipeline, src_cmd, sink_cmd, self._stdin_data(src_cmd)))
 
-        def drain():
-            src_stderr.append(src_proc.stderr.read())
-            src_proc.stderr.close()
-
-        drain_thread = threading.Thread(target=drain)
-        drain_thread.start()
-        try:
-            _, sink_stderr = sink_proc.communicate()
-        finally:
-            src_proc.wait()
-            drain_thread.join()
-
-        if src_proc.returncode != 0 or sink_proc.returncode != 0:
+        if src_returncode != 0 or sink_returncode != 0:
             err_msg = "%s | %s => %s, %s" % (
                 " ".join(src_cmd), " ".join(sink_cmd),
-                src_proc.returncode, sink_proc.returncode)
+                src_returncode, sink_returncode)
             err_msg += "\n%s\n%s" % (
-                b"".join(src_stderr).decode("utf-8", "replace"),
-                (sink_stderr or b"").decode("utf-8", "replace"))
+                src_stderr.decode("utf-8", "replace"),
+                sink_stderr.decode("utf-8", "replace"))
             if self.context.request:
                 err_msg += "\n%s" % self.context.request.url
             raise FFmpegError(err_msg)
 
-    def _gif_legacy(self, src_file):
+    def _palette_filters(self):
+        """The ``palettegen`` and ``paletteuse`` filters, with the
+        FFMPEG_GIF_PALETTE_STATS_MODE and FFMPEG_GIF_DITHER options"""
+        stats_mode = self.context.config.FFMPEG_GIF_PALETTE_STATS_MODE
+        dither = self.context.config.FFMPEG_GIF_DITHER
+        gen_opts = ["stats_mode=%s" % stats_mode] if stats_mode else []
+        use_opts = []
+        if stats_mode == "single":
+            # a new palette for every frame
+            use_opts += ["new=1"]
+        if dither:
+            use_opts += ["dither=%s" % dither]
+        palettegen, paletteuse = "palettegen", "paletteuse"
+        if gen_opts:
+            palettegen += "=" + ":".join(gen_opts)
+        if use_opts:
+            paletteuse += "=" + ":".join(use_opts)
+        return palettegen, paletteuse
+
+    def _gif_legacy(self, src_file, single_pass=None):
         """The palettegen/paletteuse pipeline. Geometry is applied at the
         target size in ffmpeg (rather than re-encoding at original resolution
-        and letting gifsicle resize), and output goes through a temp file
-        rather than buffering the whole animation on stdout. Because ffmpeg
+        and letting gifsicle resize), so only the final target-size output is
+        read back, from ffmpeg's stdout or, when a gifsicle pass follows, a
+        temp file. Because ffmpeg
         performs all geometry, the gifsicle stage (when FFMPEG_USE_GIFSICLE_ENGINE
-        is on) is purely a geometry-free optimization pass."""
+        is on) is purely a geometry-free optimization pass.
+
+        With ``single_pass`` (FFMPEG_GIF_PALETTE_SINGLE_PASS by default) the
+        palette is generated and applied in one ffmpeg run, which decodes the
+        source once rather than twice, but holds the scaled frames in ffmpeg
+        until the palette is complete. Otherwise the palette is written to a
+        temp file by a first run and applied by a second."""
+        if single_pass is None:
+            single_pass = self.context.config.FFMPEG_GIF_PALETTE_SINGLE_PASS
         vf = ",".join(self.ffmpeg_vfilters) if self.ffmpeg_vfilters else "null"
         input_flags = self._input_flags(src_file)
-
-        with named_tmp_file(suffix=".png") as palette_file:
-            self.run_cmd(
-                [self.ffmpeg_path, "-hide_banner"]
-                + input_flags
-                + [
+        if self.requested_fps():
+            input_flags += self.keyframe_flags(self.requested_fps())
+        thread_flags = self.thread_flags(self.ffmpeg_threads)
+        palettegen, paletteuse = self._palette_filters()
+
+        with ExitStack() as stack:
+            if single_pass:
+                palette_flags = [
                     "-i", src_file,
-                    "-lavfi", "%s,palettegen" % vf,
-                    "-y", palette_file,
+                    "-lavfi", "%s,split[a][b];[a]%s[p];[b][p]%s" % (
+                        vf, palettegen, paletteuse),
                 ]
-            )
-            with named_tmp_file(suffix=".gif") as out_file:
+            else:
+                palette_file = stack.enter_context(named_tmp_file(suffix=".png"))
                 self.run_cmd(
                     [self.ffmpeg_path, "-hide_banner"]
                     + input_flags
                     + [
                         "-i", src_file,
-                        "-i", palette_file,
-                        "-lavfi", "%s[x];[x][1:v]paletteuse" % vf,
-                        "-f", "gif",
-                        "-y", out_file,
+                        "-lavfi", "%s,%s" % (vf, palettegen),
                     ]
+                    + thread_flags
+                    + ["-y", palette_file]
+                )
+                palette_flags = [
+                    "-i", src_file,
+                    "-i", palette_file,
+                    "-lavfi", "%s[x];[x][1:v]%s" % (vf, paletteuse),
+                ]
+            # the gifsicle pass works file-to-file, so only read ffmpeg's
+            # output from stdout when there is no such pass
+            if self.use_gif_engine:
+                out_ctx = named_tmp_file(suffix=".gif")
+            else:
+                out_ctx = self.make_out_file("gif")
+            with out_ctx as out_file:
+                stdout = self.run_cmd(
+                    [self.ffmpeg_path, "-hide_banner"]
+                    + input_flags
+                    + palette_flags
+                    + ["-f", "gif"]
+                    + thread_flags
+                    + ["-y", out_file]
                 )
                 if self.use_gif_engine:
                     return self._gifsicle_optimize_file(out_file)
-                with open(out_file, mode="rb") as f:
-                    return f.read()
+                return self.read_out_file(out_file, stdout)
 
     def _gifsicle_optimize_file(self, src_path):
         """Run a geometry-free ``gifsicle -O3`` (plus GIFSICLE_ARGS) over a
-        file on the scratch filesystem. Working file-to-file keeps the
-        whole-animation buffers out of the Python heap entirely: only the
-        final optimized bytes are ever read."""
+        file on the scratch filesystem, reading the result from gifsicle's
+        stdout. This keeps the whole-animation buffers out of the Python heap
+        entirely: only the final optimized bytes are ever read."""
         gifsicle_path = (
             getattr(self.context.server, "gifsicle_path", None)
             or self.context.config.GIFSICLE_PATH
@@ -575,11 +1945,8 @@ class Engine(BaseEngine):
                 "gifsicle binary cannot be found")
         extra_args = [
             str(arg) for arg in (self.context.config.GIFSICLE_ARGS or [])]
-        with named_tmp_file(suffix=".gif") as out_file:
-            self.run_cmd(
-                [gifsicle_path, "-O3"] + extra_args + [src_path, "-o", out_file])
-            with open(out_file, mode="rb") as f:
-                buf = f.read()
+        # gifsicle writes the optimized gif to stdout when no -o is given
+        buf = self.run_cmd([gifsicle_path, "-O3"] + extra_args + [src_path])
         # Mirror thumbor's gif engine: make sure gifsicle produced a valid
         # gif before returning it
         try:
@@ -591,27 +1958,80 @@ class Engine(BaseEngine):
                 % getattr(self.context.request, "url", None))
         return buf
 
+    def video_operations(self):
+        """
+        The :data:`VideoOperations` of this transcode: the crop and size from
+        the engine, and the grayscale and orientation collected from
+        :attr:`operations`. A crop of the whole frame, a scale to the size
+        that the crop already is and flips that cancel out are left out.
+        """
+        grayscale = False
+        orientation = IDENTITY
+        for name, args in self.operations:
+            if name == 'convert_to_grayscale':
+                grayscale = True
+            elif name == 'rotate':
+                degrees = args[0] % 360
+                if degrees:
+                    orientation = compose_orientations(ORIENTATIONS[degrees], orientation)
+            elif name in ORIENTATIONS:
+                orientation = compose_orientations(ORIENTATIONS[name], orientation)
+
+        crop = tuple(self.crop_info)
+        if crop == tuple(self.original_size) + (0, 0):
+            crop = None
+        # the size before the frame is oriented
+        size = tuple(self.image_size)
+        if orientation[0][0] == 0:
+            size = size[::-1]
+        if size == tuple(self.crop_info[:2]):
+            size = None
+        return VideoOperations(crop, size, grayscale, orientation)
+
     @property
     def ffmpeg_vfilters(self):
+        """
+        The ffmpeg filters that apply :meth:`video_operations`, after those
+        of :meth:`trim_window` and :meth:`requested_fps`, which drop frames
+        before anything is done to them. The crop comes first of the rest,
+        so that nothing else is done to pixels that are cropped out;
+        the grayscale and orientation are done on whichever side of the scale
+        has fewer pixels.
+        """
+        operations = self.video_operations()
         vfilters = []
-        if self.grayscale:
-            vfilters.append('hue=s=0')
-        if self.flipped_vertically:
-            vfilters.append('vflip')
-        if self.flipped_horizontally:
-            vfilters.append('hflip')
-        if self.rotate_degrees != 0:
-            vfilters.append('rotate={0}'.format(self.rotate_degrees))
-        if self.cropped:
-            vfilters.append('crop={0}'.format(':'.join([str(i) for i in self.crop_info])))
-        # scale must be the last one
-        if self.resized:
-            vfilters.append(
-                'scale={0}:flags=lanczos'.format(':'.join([str(s) for s in self.image_size])))
-        return vfilters
+        window = self.trim_window()
+        if window and window[0] and not self.can_seek_source:
+            vfilters += ['trim=start=%.6f' % window[0], 'setpts=PTS-STARTPTS']
+        fps = self.requested_fps()
+        if fps:
+            # keep the last frame for its whole interval, as it may be the
+            # last keyframe of a keyframes-only decode (see keyframe_flags)
+            vfilters.append('fps=%s:eof_action=pass' % fps)
+        if operations.crop:
+            vfilters.append('crop={0}'.format(':'.join([str(i) for i in operations.crop])))
+        pixel_filters = ['hue=s=0'] if operations.grayscale else []
+        pixel_filters += ORIENTATION_FILTERS[operations.orientation]
+        if operations.size is None:
+            return vfilters + pixel_filters
+        width, height = operations.size
+        crop_width, crop_height = self.crop_info[:2]
+        if width * height <= crop_width * crop_height:
+            return vfilters + [
+                'scale={0}:{1}:flags=lanczos'.format(width, height)] + pixel_filters
+        # scaled up: orient the frame first, and scale it to the oriented size
+        return vfilters + pixel_filters + [
+            'scale={0}:flags=lanczos'.format(':'.join([str(s) for s in self.image_size]))]
 
     def transcode_to_vp9(self, src_file):
         vf_flags = ['-vf', ','.join(self.ffmpeg_vfilters)] if self.ffmpeg_vfilters else []
+        two_pass = self.context.config.FFMPEG_VP9_TWO_PASS
+        return self.run_ffmpeg(
+            src_file, 'webm', flags=self.vp9_flags(vf_flags), two_pass=two_pass)
+
+    def vp9_flags(self, vf_flags):
+        """The output flags of a vp9 transcode, with ``vf_flags`` to filter
+        its video"""
         flags = [
             '-c:v', 'libvpx-vp9', '-loop', '0', '-an', '-pix_fmt', 'yuv420p',
             '-movflags', 'faststart',
@@ -633,20 +2053,31 @@ class Engine(BaseEngine):
             flags += ['-maxrate', "%s" % self.context.config.FFMPEG_VP9_MAXRATE]
         if self.context.config.FFMPEG_VP9_MINRATE:
             flags += ['-minrate', "%s" % self.context.config.FFMPEG_VP9_MINRATE]
-
-        two_pass = self.context.config.FFMPEG_VP9_TWO_PASS
-        return self.run_ffmpeg(src_file, 'webm', flags=flags, two_pass=two_pass)
-
-    def transcode_to_h264(self, src_file):
+        threads = self.ffmpeg_threads
+        flags += self.thread_flags(threads)
+        if threads is not None:
+            flags += ['-tile-columns', '%d' % self.vp9_tile_columns(threads)]
+        return flags
+
+    def make_even(self):
+        """Rounds the output size down to even dimensions, which libx264 and
+        libx265 require"""
         width, height = self.image_size
-        # libx264 width and height must be divisible by 2
         if width % 2 or height % 2:
             width = (width // 2) * 2
             height = (height // 2) * 2
             self.resize(width, height)
 
+    def transcode_to_h264(self, src_file):
+        self.make_even()
         vf_flags = ['-vf', ','.join(self.ffmpeg_vfilters)] if self.ffmpeg_vfilters else []
+        two_pass = self.context.config.FFMPEG_H264_TWO_PASS
+        return self.run_ffmpeg(
+            src_file, 'mp4', flags=self.h264_flags(vf_flags), two_pass=two_pass)
 
+    def h264_flags(self, vf_flags):
+        """The output flags of an h264 transcode, with ``vf_flags`` to filter
+        its video"""
         flags = [
             '-c:v', 'libx264', '-an', '-pix_fmt', 'yuv420p', '-movflags', 'faststart',
         ] + vf_flags + ['-f', 'mp4']
@@ -671,20 +2102,19 @@ class Engine(BaseEngine):
             flags += ['-qmin', "%s" % self.context.config.FFMPEG_H264_QMIN]
         if self.context.config.FFMPEG_H264_QMAX:
             flags += ['-qmax', "%s" % self.context.config.FFMPEG_H264_QMAX]
-
-        two_pass = self.context.config.FFMPEG_H264_TWO_PASS
-        return self.run_ffmpeg(src_file, 'mp4', flags=flags, two_pass=two_pass)
+        flags += self.thread_flags(self.ffmpeg_threads)
+        return flags
 
     def transcode_to_h265(self, src_file):
-        width, height = self.image_size
-        # libx265 width and height must be divisible by 2
-        if width % 2 or height % 2:
-            width = (width // 2) * 2
-            height = (height // 2) * 2
-            self.resize(width, height)
-
+        self.make_even()
         vf_flags = ['-vf', ','.join(self.ffmpeg_vfilters)] if self.ffmpeg_vfilters else []
+        two_pass = self.context.config.FFMPEG_H265_TWO_PASS
+        return self.run_ffmpeg(
+            src_file, 'mp4', flags=self.h265_flags(vf_flags), two_pass=two_pass)
 
+    def h265_flags(self, vf_flags):
+        """The output flags of an h265 transcode, with ``vf_flags`` to filter
+        its video"""
         flags = [
             '-c:v', 'hevc', '-tag:v', 'hvc1', '-an', '-pix_fmt', 'yuv420p',
             '-movflags', 'faststart',
@@ -710,37 +2140,144 @@ class Engine(BaseEngine):
             x265_params += ["crf-min=%s" % self.context.config.FFMPEG_H265_CRF_MIN]
         if self.context.config.FFMPEG_H265_CRF_MAX:
             x265_params += ["crf-max=%s" % self.context.config.FFMPEG_H265_CRF_MAX]
+        threads = self.ffmpeg_threads
+        flags += self.thread_flags(threads)
+        if threads is not None:
+            x265_params += ["pools=%d" % threads]
 
         flags += ["-x265-params", ":".join(x265_params)]
+        return flags
 
-        two_pass = self.context.config.FFMPEG_H265_TWO_PASS
-        return self.run_ffmpeg(src_file, 'mp4', flags=flags, two_pass=two_pass)
+    def ladder_renditions(self, out_format):
+        """
+        The FFMPEG_RENDITIONS to transcode along with this request, if it is
+        for one of them, or else ``None``. Only plain transcodes of video
+        sources qualify, and only when the other renditions would be written
+        to result storage. Renditions in a codec set to two-pass are left
+        out, since they cannot share a single ffmpeg run.
+        """
+        request = self.context.request
+        ladder = self.context.config.FFMPEG_RENDITIONS
+        if not ladder or out_format not in RENDITION_CODECS:
+            return None
+        if not self.source.is_video:
+            return None
+        if self.still_position is not None or getattr(request, 'sprite', None):
+            return None
+        if request.smart or request.trim or request.meta or request.debug:
+            return None
+        if self.requested_fps() or self.trim_window():
+            return None
+        if not self.context.modules.result_storage or request.prevent_result_storage:
+            return None
+        if request.unsafe and not self.context.config.RESULT_STORAGE_STORES_UNSAFE:
+            return None
+        renditions = [
+            (width, height, rendition_format) for width, height, rendition_format in ladder
+            if RENDITION_CODECS.get(rendition_format) and not getattr(
+                self.context.config,
+                'FFMPEG_%s_TWO_PASS' % RENDITION_CODECS[rendition_format].upper())]
+        requested = (request.width, request.height, RENDITION_CODECS[out_format])
+        if requested not in [(w, h, RENDITION_CODECS[f]) for w, h, f in renditions]:
+            return None
+        return renditions if len(renditions) > 1 else None
+
+    def rendition_engine(self, width, height, out_format):
+        """
+        A copy of this engine with the crop, resize and flips that thumbor
+        would give the request at ``width`` x ``height`` in ``out_format``,
+        worked out by thumbor's own :class:`~thumbor.transformer.Transformer`
+        """
+        engine = copy.copy(self)
+        engine.operations = []
+        engine.resized = engine.cropped = False
+        engine.flipped_horizontally = engine.flipped_vertically = False
+        engine.original_size = self.original_size
+        context = copy.copy(self.context)
+        context.request = request = copy.copy(self.context.request)
+        request.width, request.height = width, height
+        request.crop = dict(request.crop)
+        request.format = out_format
+        request.engine = engine
+        engine.context = context
+        Transformer(context).img_operation_worker()
+        # and the rotation and grayscale of this request's filters
+        for name, args in self.operations:
+            if name in ('rotate', 'convert_to_grayscale'):
+                getattr(engine, name)(*args)
+        return engine
+
+    def transcode_renditions(self, renditions):
+        """
+        Transcodes the source to each ``(width, height, format)`` of
+        ``renditions`` (in the formats of :data:`RENDITION_CODECS`), with the
+        crop and filters of this request, in a single ffmpeg run. The source
+        is decoded once and ``split`` between the outputs, each of which is
+        cropped, scaled and encoded on its own. Returns the results in the
+        order of ``renditions``.
+        """
+        graph = ['[0:v]split=%d%s' % (
+            len(renditions), ''.join('[s%d]' % i for i in range(len(renditions))))]
+        outputs = []
+        for i, (width, height, out_format) in enumerate(renditions):
+            engine = self.rendition_engine(width, height, out_format)
+            codec = RENDITION_CODECS[out_format]
+            if codec != 'vp9':
+                engine.make_even()
+            graph.append('[s%d]%s[v%d]' % (i, ','.join(engine.ffmpeg_vfilters) or 'null', i))
+            flags = getattr(engine, '%s_flags' % codec)(['-map', '[v%d]' % i])
+            outputs.append((flags, RENDITION_MUXERS[codec]))
+
+        with ExitStack() as stack:
+            src_file = stack.enter_context(self.make_src_file(self.extension))
+            out_files = [
+                stack.enter_context(named_tmp_file(suffix='.%s' % muxer))
+                for _, muxer in outputs]
+            command = [self.ffmpeg_path, '-hide_banner'] + self._input_flags(src_file) + [
+                '-i', src_file, '-filter_complex', ';'.join(graph)]
+            for (flags, _), out_file in zip(outputs, out_files):
+                command += flags + ['-y', out_file]
+            self.run_cmd(command)
+            return [self.read_out_file(out_file, None) for out_file in out_files]
+
+    def transcode_ladder(self, out_format, renditions):
+        """Transcodes all of ``renditions`` at once, returning the result of
+        the requested one and keeping the others in :attr:`renditions`"""
+        request = self.context.request
+        results = self.transcode_renditions(renditions)
+        requested = (request.width, request.height, RENDITION_CODECS[out_format])
+        result = None
+        self.renditions = []
+        for (width, height, rendition_format), buf in zip(renditions, results):
+            if result is None and requested == (
+                    width, height, RENDITION_CODECS[rendition_format]):
+                result = buf
+            else:
+                self.renditions.append(((width, height, rendition_format), buf))
+        return result
 
-    def run_ffmpeg(self, input_file, out_format, flags=None, two_pass=False):
+    def run_ffmpeg(self, input_file, out_format, flags=None, two_pass=False,
+                   input_flags=None):
         flags = flags or []
 
-        input_flags = []
-        # text files in concat-format require additional input flags
-        if input_file.endswith('.txt'):
-            input_flags += ['-f', 'concat', '-safe', '0']
-            txt_src = self.buffer.decode('utf-8')
-            # If all frames have the same duration, set the -r flag to ensure
-            # that no frames get dropped
-            durations = set(re.findall(r'duration ([\d\.]+)', txt_src))
-            if len(durations) == 1:
-                duration = list(durations)[0]
-                input_flags += ['-r', '1/%s' % duration]
-                flags += ['-r', '1/%s' % duration]
-
-        with named_tmp_file(suffix='.%s' % out_format) as out_file:
+        input_flags = (input_flags or []) + self._input_flags(input_file)
+        streams_frames = input_file == PIPE_INPUT and self.streams_frames
+        if streams_frames and self.frame_durations and not self.requested_fps():
+            # If all frames have the same (non-zero) duration, set the -r
+            # flag to ensure that no frames get dropped
+            durations = set(self.frame_durations)
+            if len(durations) == 1 and 0 not in durations:
+                duration = Decimal(durations.pop()) / Decimal(1000)
+                flags = flags + ['-r', '1/%s' % duration]
+
+        with self.make_out_file(out_format, flags) as out_file:
             if not two_pass:
-                self.run_cmd([
+                stdout = self.run_cmd([
                     self.ffmpeg_path, '-hide_banner',
                 ] + input_flags + [
                     '-i', input_file,
                 ] + flags + ['-y', out_file])
-                with open(out_file, mode='rb') as f:
-                    return f.read()
+                return self.read_out_file(out_file, stdout)
 
             with named_tmp_file(suffix='.log') as passlogfile:
                 if '-x265-params' in flags:
@@ -767,25 +2304,69 @@ class Engine(BaseEngine):
                     '-i', input_file,
                 ] + pass_one_flags + ['-y', '/dev/null'])
 
-                self.run_cmd([
+                stdout = self.run_cmd([
                     self.ffmpeg_path, '-hide_banner',
                 ] + input_flags + [
                     '-i', input_file,
                 ] + pass_two_flags + ['-y', out_file])
 
-                with open(out_file, mode='rb') as f:
-                    return f.read()
+                return self.read_out_file(out_file, stdout)
+
+    def can_pipe_output(self, out_format, flags):
+        """
+        Whether ffmpeg's output for ``out_format`` can be read from its stdout
+        instead of a temp file: true for formats whose muxer never seeks back,
+        and for fragmented mp4. Faststart mp4 needs a seekable output, since
+        the moov box is moved to the front after all media data is written.
+        """
+        if not self.context.config.FFMPEG_PIPE_OUTPUT:
+            return False
+        if out_format in PIPE_OUTPUT_FORMATS:
+            return True
+        if out_format == 'mp4' and '-movflags' in flags:
+            movflags = flags[flags.index('-movflags') + 1]
+            return 'faststart' not in movflags and (
+                'frag_keyframe' in movflags or 'empty_moov' in movflags)
+        return False
+
+    def make_out_file(self, out_format, flags=None):
+        """
+        Returns a context manager yielding the output filename to pass to
+        ffmpeg: :data:`PIPE_OUTPUT` when :meth:`can_pipe_output`, otherwise a
+        temp file path. Read the result back with :meth:`read_out_file`.
+        """
+        if self.can_pipe_output(out_format, flags or []):
+            return nullcontext(PIPE_OUTPUT)
+        return named_tmp_file(suffix='.%s' % out_format)
+
+    def read_out_file(self, out_file, stdout):
+        if out_file == PIPE_OUTPUT:
+            return stdout
+        with open(out_file, mode='rb') as f:
+            return f.read()
+
+    def _stdin_data(self, command):
+        """The bytes to write to a command's stdin: the source buffer (or
+        its decoded frames) if the command reads its input from
+        :data:`PIPE_INPUT`, otherwise nothing."""
+        if PIPE_INPUT not in command:
+            return None
+        if self.streams_frames:
+            return self.iter_frames()
+        if self.input_ranges is not None:
+            mv = memoryview(self.buffer)
+            return [mv[start:end] for start, end in self.input_ranges]
+        return self.buffer
 
     def run_cmd(self, command):
         logger.debug("Running `%s`" % " ".join(command))
-        proc = Popen(command, stdout=PIPE, stdin=PIPE, stderr=PIPE)
-        proc.command = command
-        stdout, stderr = proc.communicate()
+        returncode, stdout, stderr = self.run_process(
+            process.run_process, command, self._stdin_data(command))
         logger.debug(stderr)
-        if proc.returncode == 0:
+        if returncode == 0:
             return stdout
         else:
-            err_msg = "%s => %s" % (" ".join(command), proc.returncode)
+            err_msg = "%s => %s" % (" ".join(command), returncode)
             err_msg += "\n%s" % stderr
             if self.context.request:
                 err_msg += "\n%s" % self.context.request.url
@@ -1,8 +1,20 @@
+import asyncio
+import re
+
 from thumbor.engines import BaseEngine
 from thumbor.utils import logger
 
-from thumbor_video_engine.utils import (
-    named_tmp_file, is_mp4, is_qt, is_animated, is_animated_gif)
+from thumbor_video_engine.exceptions import FFmpegQueueTimeout
+from thumbor_video_engine.source_info import SourceInfo
+from thumbor_video_engine.utils import is_mp4, is_qt
+
+
+# The filters whose effect the ffmpeg engine applies itself when it encodes a
+# still frame (see FFMPEG_STILL_DIRECT)
+STILL_FILTERS = (
+    'still', 'format', 'quality', 'grayscale', 'no_upscale', 'strip_exif',
+    'strip_icc',
+)
 
 
 def patch_baseengine_get_mimetype():
@@ -35,6 +47,9 @@ class Engine(object):
         self.ffmpeg_handle_animated_gif = context.config.FFMPEG_HANDLE_ANIMATED_GIF
         self.ffmpeg_handle_animated_webp = True
         self.use_gif_engine = context.config.FFMPEG_USE_GIFSICLE_ENGINE
+        # The (buffer, extension, error) of a load_async() that the next
+        # load() call picks up
+        self.preloaded = None
 
     @property
     def image_engine(self):
@@ -51,18 +66,25 @@ class Engine(object):
                 self.context.modules.importer.ffmpeg_engine(self.context))
         return self.context.modules.ffmpeg_engine
 
-    def get_engine(self, buffer, extension):
-        mime = BaseEngine.get_mimetype(buffer)
+    def get_engine(self, buffer, extension, source_info=None):
+        if source_info is None:
+            source_info = SourceInfo(buffer)
+        mime = source_info.mimetype
 
         is_gif = extension == '.gif'
         is_webp = extension == '.webp'
         accepts_video = getattr(self.context.request, "accepts_video", False)
         accepts_webp = self.context.request.accepts_webp
 
-        if is_webp and self.ffmpeg_handle_animated_webp and is_animated(buffer):
+        if is_webp and self.ffmpeg_handle_animated_webp and source_info.is_animated:
             return self.ffmpeg_engine
-        elif is_gif and self.ffmpeg_handle_animated_gif and is_animated_gif(buffer):
-            if self.context.config.FFMPEG_GIF_AUTO_H265:
+        elif (is_gif and self.ffmpeg_handle_animated_gif
+                and mime == 'image/gif' and source_info.is_animated):
+            # h265 needs libx265, which many ffmpeg builds leave out
+            auto_h265 = (
+                self.context.config.FFMPEG_GIF_AUTO_H265
+                and self.ffmpeg_engine.capabilities.has_encoder('libx265'))
+            if auto_h265:
                 self.context.request.should_vary = True
                 if accepts_video:
                     logger.debug("FFMPEG_GIF_AUTO_H265 setting format to h264")
@@ -85,8 +107,68 @@ class Engine(object):
         else:
             return self.image_engine
 
+    def can_encode_still(self, source_info):
+        """
+        Whether the still frame of a video source can be encoded in the
+        requested format by the ffmpeg engine, with the crop and resize of
+        the request: it can unless FFMPEG_STILL_DIRECT is off, or the request
+        has a filter other than :data:`STILL_FILTERS`, or smart cropping,
+        trimming, a max_bytes or meta, which need the decoded image.
+        """
+        request = self.context.request
+        if not self.context.config.FFMPEG_STILL_DIRECT:
+            return False
+        if not source_info.is_video:
+            return False
+        if not self.ffmpeg_engine.can_encode_still(request.format or 'jpg'):
+            return False
+        if request.smart or request.trim or request.meta or request.debug:
+            return False
+        if request.max_bytes:
+            return False
+        filters = re.findall(r'(\w+)\(', request.filters or '')
+        return all(name in STILL_FILTERS for name in filters)
+
+    async def load_async(self, buffer, extension):
+        """
+        Loads ``buffer`` as :meth:`load` does, without blocking the event
+        loop: it runs in the loop's default executor, and the ffprobe and
+        ffmpeg processes the ffmpeg engine starts for it (e.g. for a still
+        frame) run on the loop, where they are killed if this coroutine is
+        cancelled. Waiting for one of the FFMPEG_HOST_SLOTS happens in the
+        executor thread, and a timeout raises
+        :class:`~thumbor_video_engine.exceptions.FFmpegQueueTimeout` from
+        here.
+
+        Any other error is kept and re-raised by the next :meth:`load` call,
+        which thumbor's handler makes for the same buffer afterwards, so that
+        its own error handling applies; that call otherwise returns at once.
+        """
+        loop = asyncio.get_running_loop()
+        ffmpeg_engine = self.ffmpeg_engine
+        ffmpeg_engine.event_loop = loop
+        error = None
+        try:
+            await loop.run_in_executor(None, self.load, buffer, extension)
+        except asyncio.CancelledError:
+            ffmpeg_engine.cancel()
+            raise
+        except FFmpegQueueTimeout:
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            ffmpeg_engine.event_loop = None
+        self.preloaded = buffer, extension, error
+
     def load(self, buffer, extension):
-        self.engine = self.get_engine(buffer, extension)
+        preloaded, self.preloaded = self.preloaded, None
+        if preloaded is not None and preloaded[0] is buffer and preloaded[1] == extension:
+            if preloaded[2] is not None:
+                raise preloaded[2]
+            return
+        source_info = SourceInfo(buffer)
+        self.engine = self.get_engine(buffer, extension, source_info)
         if self.context.request.format and not self.context.request.filters:
             # RequestParameters.filters is an empty list when none are in the url,
             # and ImagingHandler._write_results_to_client assumes that if
@@ -97,22 +179,31 @@ class Engine(object):
         logger.debug("Set engine to %s (extension %s)" % (
             type(self.engine).__module__, extension))
         still_frame_pos = getattr(self.context.request, 'still_position', None)
+        encode_still = False
         # Are we requesting a still frame?
         if self.engine is self.ffmpeg_engine and still_frame_pos:
-            with named_tmp_file(data=buffer, suffix=extension) as src_file:
-                buffer = self.ffmpeg_engine.run_ffmpeg(
-                    src_file, 'png', ['-ss', still_frame_pos, '-frames:v', '1'])
+            # Either ffmpeg encodes the frame in the output format itself, or
+            # it is handed to the image engine as a png
+            encode_still = self.can_encode_still(source_info)
+            if not encode_still:
+                self.ffmpeg_engine.source_info = source_info
+                buffer = self.ffmpeg_engine.still_frame(buffer, extension, still_frame_pos)
                 self.engine = self.image_engine
                 extension = '.png'
-                if not self.context.request.format:
-                    self.context.request.format = 'jpg'
+            if not self.context.request.format:
+                self.context.request.format = 'jpg'
 
         # Change the default extension if we're transcoding video
         if self.engine is self.ffmpeg_engine and extension == ".jpg":
             extension = ".mp4"
 
         self.extension = extension
+        if self.engine is self.ffmpeg_engine:
+            # so that the source is not sniffed again
+            self.engine.source_info = source_info
         self.engine.load(buffer, extension)
+        if encode_still:
+            self.engine.still_position = still_frame_pos
 
     def is_multiple(self):
         return False
@@ -133,7 +224,7 @@ class Engine(object):
         return getattr(self.engine, attr)
 
     def __setattr__(self, attr, value):
-        if attr in ('engine', 'ffmpeg_handle_animated_gif', 'use_gif_engine'):
+        if attr in ('engine', 'ffmpeg_handle_animated_gif', 'use_gif_engine', 'preloaded'):
             self.__dict__[attr] = value
         elif attr in ('context', 'extension'):
             self.__dict__[attr] = value
@@ -1,2 +1,7 @@
 class FFmpegError(RuntimeError):
     pass
+
+
+class FFmpegQueueTimeout(FFmpegError):
+    """Raised when a transcode waits longer than FFMPEG_QUEUE_TIMEOUT for
+    capacity under FFMPEG_MAX_CONCURRENT_JOBS."""
@@ -0,0 +1,16 @@
+from thumbor.filters import BaseFilter, filter_method, PHASE_PRE_LOAD
+from thumbor.utils import logger
+
+from thumbor_video_engine.filters.trim import POSITION
+
+
+class Filter(BaseFilter):
+    phase = PHASE_PRE_LOAD
+
+    @filter_method(POSITION)
+    async def duration(self, seconds):
+        if not seconds:
+            logger.debug('Ignoring duration(0)')
+            return
+        logger.debug('Limiting duration to %s seconds' % seconds)
+        self.context.request.max_duration = seconds
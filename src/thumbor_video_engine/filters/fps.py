@@ -0,0 +1,16 @@
+from fractions import Fraction
+
+from thumbor.filters import BaseFilter, filter_method, PHASE_PRE_LOAD
+from thumbor.utils import logger
+
+
+class Filter(BaseFilter):
+    phase = PHASE_PRE_LOAD
+
+    @filter_method({'regex': r'\d+(?:\.\d+)?', 'parse': Fraction})
+    async def fps(self, value):
+        if not value:
+            logger.debug('Ignoring fps(0)')
+            return
+        logger.debug('Setting frame rate to %s' % value)
+        self.context.request.fps = value
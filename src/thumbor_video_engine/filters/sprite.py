@@ -0,0 +1,34 @@
+from fractions import Fraction
+
+from thumbor.engines.json_engine import JSONEngine
+from thumbor.filters import BaseFilter, filter_method, PHASE_POST_TRANSFORM
+from thumbor.utils import logger
+
+
+class Filter(BaseFilter):
+    # After the transform, so that the engine knows the size of each tile
+    phase = PHASE_POST_TRANSFORM
+
+    @filter_method(
+        BaseFilter.PositiveNonZeroNumber,
+        BaseFilter.PositiveNonZeroNumber,
+        {'regex': r'\d+(?:\.\d+)?', 'parse': Fraction})
+    async def sprite(self, columns, rows, interval=0):
+        sprite_map = getattr(self.engine, 'sprite_map', None)
+        if sprite_map is None:
+            logger.debug('Ignoring sprite() for an image')
+            return
+        request = self.context.request
+        ffmpeg_engine = getattr(self.engine, 'ffmpeg_engine', self.engine)
+        if request.format and not ffmpeg_engine.can_encode_still(request.format):
+            logger.warning("Format not allowed for sprite(): %s" % request.format)
+            return
+        logger.debug('Setting sprite of %dx%d tiles %s seconds apart' % (
+            columns, rows, interval or 'evenly'))
+        request.sprite = columns, rows, interval
+        if not request.format:
+            request.format = 'jpg'
+        # /meta requests get the sprite map with the operations
+        if isinstance(request.engine, JSONEngine):
+            request.engine.operations.append(
+                dict(type='sprite', **sprite_map(columns, rows, interval)))
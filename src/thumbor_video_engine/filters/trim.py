@@ -0,0 +1,23 @@
+from thumbor.filters import BaseFilter, filter_method, PHASE_PRE_LOAD
+from thumbor.utils import logger
+
+from thumbor_video_engine.engines.ffmpeg import still_position_seconds
+
+
+POSITION = {
+    'regex': r'(?:(?:\d\d:)?\d\d:\d\d(?:\.\d+)?|\d+(?:\.\d+)?)',
+    'parse': still_position_seconds,
+}
+
+
+class Filter(BaseFilter):
+    phase = PHASE_PRE_LOAD
+
+    @filter_method(POSITION, POSITION)
+    async def trim(self, start, end=0):
+        end = end or None
+        if end is not None and end <= start:
+            logger.warning('Ignoring trim(%s,%s) that ends before it starts' % (start, end))
+            return
+        logger.debug('Trimming to %s-%s seconds' % (start, end or 'end'))
+        self.context.request.trim_range = start, end
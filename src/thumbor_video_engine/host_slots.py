@@ -0,0 +1,78 @@
+"""
+Job slots shared by every thumbor process on a host.
+
+Each slot is a lock file in a shared directory, and a slot is held for as long
+as an exclusive :func:`fcntl.flock` is held on its file. The kernel drops the
+lock when the holding process exits, so a crashed worker cannot leak slots.
+"""
+import fcntl
+import os
+import random
+import time
+
+
+POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.25
+
+
+class HostSlot(object):
+    def __init__(self, fd, index):
+        self.fd = fd
+        self.index = index
+
+    def release(self):
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self.fd)
+
+
+class HostSlots(object):
+    def __init__(self, path, num_slots):
+        self.path = path
+        self.num_slots = num_slots
+
+    def slot_path(self, index):
+        return os.path.join(self.path, 'slot-%d.lock' % index)
+
+    def try_acquire(self):
+        """Returns a free :class:`HostSlot`, or ``None`` if all are held."""
+        os.makedirs(self.path, exist_ok=True)
+        # Start at a random slot, so that processes do not all contend for
+        # the first few files
+        offset = random.randrange(self.num_slots)
+        for i in range(self.num_slots):
+            index = (offset + i) % self.num_slots
+            fd = os.open(self.slot_path(index), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            except BaseException:
+                os.close(fd)
+                raise
+            return HostSlot(fd, index)
+        return None
+
+    def acquire(self, timeout=None, cancelled=None):
+        """
+        Waits for a free slot, polling with exponential backoff. Returns
+        ``None`` if none frees up within ``timeout`` seconds (``None`` waits
+        indefinitely), or as soon as the ``cancelled`` callable returns True.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = POLL_INTERVAL
+        while True:
+            slot = self.try_acquire()
+            if slot is not None:
+                return slot
+            if cancelled is not None and cancelled():
+                return None
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return None
+            if deadline is not None:
+                interval = min(interval, deadline - now)
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
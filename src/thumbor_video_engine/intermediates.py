@@ -0,0 +1,166 @@
+"""
+Downscaled intermediates of video sources, shared by every thumbor process on
+a host.
+
+An intermediate is a high-quality h264 rendition of a source at one of the
+FFMPEG_INTERMEDIATE_SIZES, stored under the digest of the source. Derivatives
+that are smaller than an intermediate are transcoded from it instead of the
+original, so a large original is only decoded at full resolution once per
+rung rather than once per derivative.
+"""
+from contextlib import contextmanager
+import fcntl
+import os
+from tempfile import NamedTemporaryFile
+
+from thumbor.utils import logger
+
+
+class IntermediateCache(object):
+    """
+    The intermediates under ``path``, at ``<path>/<xx>/<digest>/<size>.mp4``.
+    Files are written atomically, and recency is tracked by file mtime: reads
+    touch the file, and writes evict the least recently used intermediates
+    once the cache is larger than ``max_size`` bytes (see
+    :func:`record_write`). Each intermediate is made under a lock (see
+    :meth:`lock`), so that concurrent misses do not all make it.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path.rstrip('/')
+        self.max_size = max_size
+
+    def path_for(self, key, size):
+        return "%s/%s/%s/%d.mp4" % (self.path, key[:2], key[2:], size)
+
+    def get(self, key, size):
+        """Returns the path of the intermediate of ``key`` at ``size``, or
+        ``None`` if there is none."""
+        path = self.path_for(key, size)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def exists(self, key, size):
+        """Whether there is an intermediate of ``key`` at ``size``, without
+        counting it as used."""
+        return os.path.exists(self.path_for(key, size))
+
+    @contextmanager
+    def lock(self, key, size):
+        """
+        Holds the lock on making the intermediate of ``key`` at ``size``: an
+        exclusive :func:`fcntl.flock` on a lock file next to it, which every
+        thread and process on the host contends for. Yields ``False`` at once,
+        without waiting, if it is already held.
+        """
+        path = self.path_for(key, size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(os.path.splitext(path)[0] + '.lock', os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def store(self, key, size):
+        """
+        Yields a temp path to write the intermediate of ``key`` at ``size``
+        to. It is moved into place if the block exits normally, and removed
+        if it raises.
+        """
+        path = self.path_for(key, size)
+        entry_dir = os.path.dirname(path)
+        os.makedirs(entry_dir, exist_ok=True)
+        with NamedTemporaryFile(dir=entry_dir, suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+        try:
+            yield tmp_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        record_write(
+            self.path, self.max_size, os.path.getsize(path), '.mp4',
+            'FFMPEG_INTERMEDIATE_CACHE')
+
+
+# A cache is swept for files to evict when the size that the process has
+# written to it puts it over its max size, and also after this many writes,
+# to take in what other processes have written to it
+SWEEP_INTERVAL = 100
+
+# A sweep evicts down to this fraction of the max size, so that a full cache
+# is not swept again on the next write
+SWEEP_LOW_WATER = 0.9
+
+# The estimated size of each cache path, and the writes since it was swept
+_cache_sizes = {}
+
+
+def record_write(path, max_size, written, suffix, setting):
+    """
+    Counts ``written`` bytes towards the estimated size of the cache at
+    ``path``, and evicts from it with :func:`evict_least_recently_used`
+    when the estimate is over ``max_size`` (if set), every
+    :data:`SWEEP_INTERVAL` writes, or on the first write of the process.
+    This keeps writes from walking the whole cache each time.
+    """
+    if not max_size:
+        return
+    state = _cache_sizes.get(path)
+    if state is not None:
+        state[0] += written
+        state[1] += 1
+        if state[0] <= max_size and state[1] < SWEEP_INTERVAL:
+            return
+    total_size = evict_least_recently_used(
+        path, max_size, suffix, setting, target_size=int(max_size * SWEEP_LOW_WATER))
+    _cache_sizes[path] = [total_size, 0]
+
+
+def evict_least_recently_used(path, max_size, suffix, setting, target_size=None):
+    """Once the files ending in ``suffix`` under ``path`` take up more than
+    ``max_size`` bytes (if set), removes the least recently modified of them
+    until they take up at most ``target_size`` (by default ``max_size``).
+    Returns the size that is left. The ``setting`` of the cache prefixes
+    what is logged."""
+    if not max_size:
+        return 0
+    if target_size is None:
+        target_size = max_size
+    entries = []
+    for dir_path, _, file_names in os.walk(path):
+        for name in file_names:
+            if not name.endswith(suffix):
+                continue
+            file_path = os.path.join(dir_path, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+    total_size = sum(size for _, size, _ in entries)
+    if total_size <= max_size:
+        return total_size
+    for _, size, file_path in sorted(entries):
+        if total_size <= target_size:
+            break
+        try:
+            os.unlink(file_path)
+        except OSError:
+            continue
+        logger.debug("[%s] evicted %s" % (setting, file_path))
+        total_size -= size
+    return total_size
@@ -0,0 +1,29 @@
+import hashlib
+
+
+def source_digest(buffer):
+    """The cache key for a source buffer: a digest of its contents, so every
+    derivative of the same original shares one entry."""
+    return hashlib.sha1(buffer).hexdigest()
+
+
+class BaseCache(object):
+    """
+    A cache for the flat metadata dict returned by
+    :func:`thumbor_video_engine.ffprobe.ffprobe`, keyed by
+    :func:`source_digest`. Subclasses implement :meth:`get` and :meth:`put`.
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    @property
+    def max_entries(self):
+        return self.context.config.FFPROBE_CACHE_MAX_ENTRIES
+
+    def get(self, key):
+        """Returns the cached probe data for ``key``, or ``None``."""
+        raise NotImplementedError()
+
+    def put(self, key, probe_data):
+        raise NotImplementedError()
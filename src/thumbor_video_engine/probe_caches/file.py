@@ -0,0 +1,85 @@
+import json
+import os
+from tempfile import NamedTemporaryFile
+
+from thumbor.utils import logger
+
+from . import BaseCache
+
+
+# Entries are sharded into 256 directories by the first two hex digits of the
+# key, and each shard is held to its share of FFPROBE_CACHE_MAX_ENTRIES
+NUM_SHARDS = 256
+
+
+class Cache(BaseCache):
+    """
+    A file-backed cache of probe data under
+    ``FFPROBE_CACHE_FILE_STORAGE_ROOT_PATH``, shared by every thumbor process
+    on a host. Entries are written atomically, and recency is tracked by file
+    mtime: reads touch the entry, and writes evict the least recently used
+    entries of their shard once it is over its share of
+    ``FFPROBE_CACHE_MAX_ENTRIES``.
+    """
+
+    @property
+    def root_path(self):
+        return self.context.config.FFPROBE_CACHE_FILE_STORAGE_ROOT_PATH.rstrip('/')
+
+    @property
+    def max_shard_entries(self):
+        return max(-(-self.max_entries // NUM_SHARDS), 1)
+
+    def path_for(self, key):
+        return "%s/%s/%s.json" % (self.root_path, key[:2], key[2:])
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            with open(path, mode='r') as f:
+                probe_data = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return probe_data if isinstance(probe_data, dict) else None
+
+    def put(self, key, probe_data):
+        path = self.path_for(key)
+        shard_dir = os.path.dirname(path)
+        tmp_path = None
+        try:
+            os.makedirs(shard_dir, exist_ok=True)
+            with NamedTemporaryFile(
+                    mode='w', dir=shard_dir, suffix='.tmp', delete=False) as f:
+                tmp_path = f.name
+                json.dump(probe_data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("[FFPROBE_CACHE] could not store %s: %s" % (path, e))
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        self.evict(shard_dir)
+
+    def evict(self, shard_dir):
+        entries = []
+        try:
+            dir_entries = list(os.scandir(shard_dir))
+        except OSError:
+            return
+        for entry in dir_entries:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                # removed by another process
+                continue
+        excess = len(entries) - self.max_shard_entries
+        if excess <= 0:
+            return
+        for _, path in sorted(entries)[:excess]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
@@ -0,0 +1,32 @@
+from collections import OrderedDict
+import threading
+
+from . import BaseCache
+
+
+class Cache(BaseCache):
+    """An in-process LRU cache of probe data, shared by every request that a
+    thumbor process serves."""
+
+    _entries = OrderedDict()
+    _lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            probe_data = self._entries.get(key)
+            if probe_data is None:
+                return None
+            self._entries.move_to_end(key)
+        return dict(probe_data)
+
+    def put(self, key, probe_data):
+        with self._lock:
+            self._entries[key] = dict(probe_data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max(self.max_entries, 1):
+                self._entries.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
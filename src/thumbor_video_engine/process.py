@@ -0,0 +1,157 @@
+"""
+Subprocess execution for the ffmpeg engine, built on
+:func:`asyncio.create_subprocess_exec`.
+
+The coroutines here run on thumbor's IOLoop: child processes are reaped, and
+their output read, without blocking it. Cancelling one of them (e.g. because
+the client disconnected) kills the child processes it started.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+from subprocess import DEVNULL, PIPE
+
+
+# Only the tail of a process's stderr is kept for error messages; ffmpeg's
+# progress output over a long encode would otherwise accumulate without bound
+MAX_STDERR_BYTES = 64 * 1024
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+async def _read_all(stream):
+    chunks = []
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+async def _read_tail(stream):
+    """Reads ``stream`` to EOF as it is written, keeping only its last
+    :data:`MAX_STDERR_BYTES` bytes."""
+    max_bytes = MAX_STDERR_BYTES
+    chunks = deque()
+    size = 0
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return b"".join(chunks)[-max_bytes:]
+        chunks.append(chunk)
+        size += len(chunk)
+        while size - len(chunks[0]) >= max_bytes:
+            size -= len(chunks.popleft())
+
+
+async def _write_all(stream, data):
+    """Writes ``data`` to ``stream`` and closes it. ``data`` is either bytes,
+    or an iterable of bytes that is consumed in a worker thread, so that
+    producing each chunk (e.g. decoding a frame) does not block the loop."""
+    chunks = None
+    try:
+        if isinstance(data, bytes):
+            stream.write(data)
+            await stream.drain()
+            return
+        # A private thread rather than the loop's default executor, which
+        # may be fully occupied by transcodes waiting on this process
+        loop = asyncio.get_running_loop()
+        chunks = iter(data)
+        with ThreadPoolExecutor(1) as executor:
+            while True:
+                chunk = await loop.run_in_executor(executor, next, chunks, None)
+                if chunk is None:
+                    break
+                stream.write(chunk)
+                await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # the process exited without reading all of its input
+        pass
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        stream.close()
+
+
+async def _kill(procs):
+    for proc in procs:
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+    for proc in procs:
+        await proc.wait()
+
+
+async def run_process(command, stdin_data=None):
+    """
+    Runs ``command``, writing ``stdin_data`` (if any; bytes or an iterable of
+    bytes) to its stdin. Returns a
+    ``(returncode, stdout, stderr)`` tuple, where ``stderr`` holds at most the
+    last :data:`MAX_STDERR_BYTES` of output.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *command, stdout=PIPE, stderr=PIPE,
+        stdin=DEVNULL if stdin_data is None else PIPE)
+    io_tasks = [_read_all(proc.stdout), _read_tail(proc.stderr)]
+    if stdin_data is not None:
+        io_tasks.append(_write_all(proc.stdin, stdin_data))
+    try:
+        stdout, stderr = (await asyncio.gather(*io_tasks))[:2]
+        await proc.wait()
+    except BaseException:
+        await _kill([proc])
+        raise
+    return proc.returncode, stdout, stderr
+
+
+async def run_pipeline(src_command, sink_command, stdin_data=None):
+    """
+    Runs ``src_command | sink_command``, connecting the two through an OS pipe
+    so the data between them never passes through Python. Returns a
+    ``(src_returncode, sink_returncode, src_stderr, sink_stderr)`` tuple.
+    """
+    read_fd, write_fd = os.pipe()
+    procs = []
+    try:
+        try:
+            procs.append(await asyncio.create_subprocess_exec(
+                *src_command, stdout=write_fd, stderr=PIPE,
+                stdin=DEVNULL if stdin_data is None else PIPE))
+            procs.append(await asyncio.create_subprocess_exec(
+                *sink_command, stdin=read_fd, stdout=DEVNULL, stderr=PIPE))
+        finally:
+            # Drop our copies of the pipe so that, if the sink dies, the
+            # source gets SIGPIPE instead of blocking forever
+            os.close(read_fd)
+            os.close(write_fd)
+        src_proc, sink_proc = procs
+        io_tasks = [_read_tail(src_proc.stderr), _read_tail(sink_proc.stderr)]
+        if stdin_data is not None:
+            io_tasks.append(_write_all(src_proc.stdin, stdin_data))
+        src_stderr, sink_stderr = (await asyncio.gather(*io_tasks))[:2]
+        await src_proc.wait()
+        await sink_proc.wait()
+    except BaseException:
+        await _kill(procs)
+        raise
+    return src_proc.returncode, sink_proc.returncode, src_stderr, sink_stderr
+
+
+def run_sync(coro):
+    """
+    Runs ``coro`` to completion from synchronous code that is not bound to an
+    event loop. If the calling thread is itself running an event loop (a
+    synchronous call made from a coroutine), the coroutine is run on a
+    private loop in another thread, since the calling loop cannot make
+    progress until this returns.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
@@ -0,0 +1,107 @@
+"""
+Facts about a source buffer, worked out once per request.
+"""
+from functools import cached_property
+
+from thumbor.engines import BaseEngine
+
+from thumbor_video_engine.probe_caches import source_digest
+from thumbor_video_engine.utils import (
+    is_animated, is_animated_gif, is_streamable_mp4, mp4_keyframes, parse_gif,
+    parse_webp, webm_keyframes, GifParseError, Mp4ParseError, WebmParseError,
+    WebpParseError)
+
+
+CONTAINERS = {
+    'image/avif': 'avif',
+    'image/gif': 'gif',
+    'image/jpeg': 'jpeg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+    'video/mp4': 'mp4',
+    'video/quicktime': 'mov',
+    'video/webm': 'webm',
+}
+
+
+class SourceInfo(object):
+    """
+    The mimetype, container, animation and frame table of a source buffer,
+    and its probe data once probed.
+
+    :class:`thumbor_video_engine.engines.video.Engine` builds one when a
+    source is loaded and hands it to the ffmpeg engine, so that each of these
+    is worked out once per request rather than by every step that needs it.
+    Everything but the mimetype is computed on first use.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.mimetype = BaseEngine.get_mimetype(buffer)
+        # Flat ffprobe-style data, set by the ffmpeg engine once probed
+        self.probe_data = None
+
+    @property
+    def container(self):
+        return CONTAINERS.get(self.mimetype)
+
+    @property
+    def is_video(self):
+        """Whether the source is in a video container, rather than an image
+        format"""
+        return (self.mimetype or '').startswith('video/')
+
+    @cached_property
+    def gif_info(self):
+        """The :class:`~thumbor_video_engine.utils.GifInfo` of a gif source,
+        or ``None``"""
+        if self.mimetype != 'image/gif':
+            return None
+        try:
+            return parse_gif(self.buffer)
+        except GifParseError:
+            return None
+
+    @cached_property
+    def webp_info(self):
+        """The :class:`~thumbor_video_engine.utils.WebpInfo` of a webp
+        source, or ``None``"""
+        if self.mimetype != 'image/webp':
+            return None
+        try:
+            return parse_webp(self.buffer)
+        except WebpParseError:
+            return None
+
+    @cached_property
+    def is_animated(self):
+        if self.mimetype == 'image/gif':
+            if self.gif_info is not None:
+                return self.gif_info.frame_count > 1
+            return is_animated_gif(self.buffer)
+        if self.webp_info is not None:
+            return self.webp_info.is_animated
+        return is_animated(self.buffer)
+
+    @cached_property
+    def keyframes(self):
+        """The :class:`~thumbor_video_engine.utils.KeyframeIndex` of an mp4,
+        mov or webm source, or ``None``"""
+        try:
+            if self.container in ('mp4', 'mov'):
+                return mp4_keyframes(self.buffer)
+            elif self.container == 'webm':
+                return webm_keyframes(self.buffer)
+        except (Mp4ParseError, WebmParseError):
+            pass
+        return None
+
+    @cached_property
+    def digest(self):
+        """The :func:`~thumbor_video_engine.probe_caches.source_digest` of
+        the source, which keys the caches of what is derived from it"""
+        return source_digest(self.buffer)
+
+    @cached_property
+    def is_streamable_mp4(self):
+        return self.container in ('mp4', 'mov') and is_streamable_mp4(self.buffer)
@@ -0,0 +1,65 @@
+"""
+Transcoded results keyed by what they are made of rather than by url, shared
+by every thumbor process on a host.
+
+Result storage keys a result on its request url, so urls that differ only in
+their signature, in the order of their filters or in a no-op crop each pay
+for a full encode. The key of a :class:`TranscodeCache` entry is instead a
+digest of the source, the ffmpeg filters, the output format and the settings
+that the encoders are run with (see
+:meth:`thumbor_video_engine.engines.ffmpeg.Engine.transcode_cache_key`), so
+every such url is served by one encode.
+"""
+import os
+from tempfile import NamedTemporaryFile
+
+from thumbor.utils import logger
+
+from thumbor_video_engine.intermediates import record_write
+
+
+class TranscodeCache(object):
+    """
+    The results under ``path``, at ``<path>/<xx>/<key>.out``. Like
+    :class:`~thumbor_video_engine.intermediates.IntermediateCache`, files are
+    written atomically, reads touch them, and writes evict the least
+    recently used results once the cache is larger than ``max_size`` bytes
+    (see :func:`~thumbor_video_engine.intermediates.record_write`).
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path.rstrip('/')
+        self.max_size = max_size
+
+    def path_for(self, key):
+        return "%s/%s/%s.out" % (self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Returns the result stored under ``key``, or ``None``"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            with open(path, mode='rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, result):
+        """Stores ``result`` under ``key``. A failure to write it is logged
+        rather than raised, as the transcode itself has succeeded."""
+        path = self.path_for(key)
+        tmp_path = None
+        try:
+            entry_dir = os.path.dirname(path)
+            os.makedirs(entry_dir, exist_ok=True)
+            with NamedTemporaryFile(dir=entry_dir, suffix='.tmp', delete=False) as f:
+                tmp_path = f.name
+                f.write(result)
+            os.replace(tmp_path, path)
+            record_write(
+                self.path, self.max_size, len(result), '.out', 'FFMPEG_TRANSCODE_CACHE')
+        except OSError as e:
+            logger.warning("[FFMPEG_TRANSCODE_CACHE] could not store %s: %s" % (path, e))
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
@@ -5,11 +5,9 @@ from fractions import Fraction
 from io import BytesIO
 import os
 import shutil
-from struct import error as StructError, unpack
+from struct import error as StructError, unpack, unpack_from
 from tempfile import NamedTemporaryFile, mkdtemp
 
-from PIL import Image
-
 
 @contextmanager
 def named_tmp_file(data=None, extension=None, **kwargs):
@@ -53,6 +51,31 @@ def is_qt(buf):
     return buf[4:12] == b'ftypqt  '
 
 
+def is_streamable_mp4(buf):
+    """True if the top-level ``moov`` box of an mp4/mov buffer comes before
+    the first ``mdat`` (a "faststart" or fragmented file), meaning it can be
+    demuxed from a non-seekable stream such as a pipe."""
+    i = 0
+    buf_len = len(buf)
+    while i + 8 <= buf_len:
+        (box_len, box_type) = unpack('>L4s', buf[i:i + 8])
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if box_len == 1:
+            if i + 16 > buf_len:
+                break
+            (box_len,) = unpack('>Q', buf[i + 8:i + 16])
+        elif box_len == 0:
+            # box extends to the end of the file
+            break
+        if box_len < 8:
+            break
+        i += box_len
+    return False
+
+
 def has_transparency(im):
     if 'A' in im.mode or 'transparency' in im.info:
         # If the image has alpha channel, we check for any pixels that are not opaque (255)
@@ -61,9 +84,57 @@ def has_transparency(im):
         return False
 
 
+# VP8X feature flags
+_WEBP_ANIMATION_FLAG = 0x02
+_WEBP_ALPHA_FLAG = 0x10
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# The ftyp brand of an AVIF image sequence
+_AVIF_SEQUENCE_BRAND = b'avis'
+
+
 def is_animated(buffer):
-    im = Image.open(BytesIO(buffer))
-    return getattr(im, 'is_animated', False)
+    """
+    Whether ``buffer`` is an animated GIF, WebP, PNG (APNG) or AVIF, judged
+    from its headers alone rather than by opening it with PIL: the blocks up
+    to a GIF's second frame, the WebP ``VP8X`` flags, the PNG chunks before
+    ``IDAT``, or the AVIF ``ftyp`` brands.
+    """
+    mv = memoryview(buffer)
+    header = bytes(mv[:16])
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return is_animated_gif(buffer)
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        # the VP8X chunk, if there is one, comes first
+        return (header[12:16] == b'VP8X' and len(mv) > 20
+                and bool(mv[20] & _WEBP_ANIMATION_FLAG))
+    if header[:8] == _PNG_SIGNATURE:
+        return _is_animated_png(mv)
+    if header[4:8] == b'ftyp':
+        return _is_avif_sequence(mv)
+    return False
+
+
+def _is_animated_png(mv):
+    """An APNG has an acTL chunk, with its frame count, before any IDAT"""
+    i = len(_PNG_SIGNATURE)
+    while i + 12 <= len(mv):
+        length, chunk_type = unpack_from('>I4s', mv, i)
+        if chunk_type == b'acTL':
+            return unpack_from('>I', mv, i + 8)[0] > 1
+        if chunk_type == b'IDAT':
+            return False
+        i += 12 + length
+    return False
+
+
+def _is_avif_sequence(mv):
+    size = unpack_from('>I', mv, 0)[0]
+    end = min(size, len(mv))
+    # the major brand, then (after the minor version) the compatible brands
+    brands = [bytes(mv[8:12])] + [bytes(mv[i:i + 4]) for i in range(16, end - 3, 4)]
+    return _AVIF_SEQUENCE_BRAND in brands
 
 
 def ord_compat(val):
@@ -181,6 +252,25 @@ class GifInfo(object):
         """Total duration of one loop of the animation, in seconds."""
         return Decimal(sum(self.effective_delays_cs())) / Decimal(100)
 
+    def frame_span(self, start, end=None):
+        """The ``(start, end)`` seconds of the frames shown between ``start``
+        and ``end`` (or the end of the loop) seconds into the animation:
+        ``start`` moved back to the start of the frame it falls in and
+        ``end`` on to the end of the frame it falls in, so that only whole
+        frames are kept. ``None`` if ``start`` is past the last frame."""
+        first = last = None
+        frame_start = 0
+        for delay_cs in self.effective_delays_cs():
+            frame_end = frame_start + delay_cs
+            if first is None and frame_end > start * 100:
+                first = frame_start
+            if first is not None and (end is None or frame_start < end * 100):
+                last = frame_end
+            frame_start = frame_end
+        if first is None:
+            return None
+        return Fraction(first, 100), Fraction(last, 100)
+
     @property
     def has_transparency_flags(self):
         return any(frame.transparency for frame in self.frames)
@@ -381,3 +471,886 @@ def parse_gif(buffer):
         loop_count=reader.loop_count,
         truncated=reader.truncated,
     )
+
+
+class WebpParseError(ValueError):
+    pass
+
+
+WebpFrame = namedtuple(
+    "WebpFrame", ["duration_ms", "x", "y", "width", "height", "blend", "dispose", "alpha"])
+
+
+class WebpInfo(object):
+    """Animation metadata extracted from a WebP buffer by :func:`parse_webp`,
+    without decoding any pixel data. Mirrors :class:`GifInfo`, but delays
+    are whole milliseconds (as in WebP's ``ANMF`` chunks)."""
+
+    def __init__(self, width, height, frames, loop_count=None,
+                 is_animated=False, has_alpha=False):
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.loop_count = loop_count
+        self.is_animated = is_animated
+        self.has_alpha = has_alpha
+
+    @property
+    def frame_count(self):
+        return len(self.frames)
+
+    @property
+    def total_pixels(self):
+        return self.width * self.height * self.frame_count
+
+    @property
+    def delays_ms(self):
+        """Per-frame delays in milliseconds, as PIL reports them in
+        ``im.info['duration']``."""
+        return [frame.duration_ms for frame in self.frames]
+
+    @property
+    def is_uniform_delay(self):
+        return len(set(self.delays_ms)) == 1
+
+    @property
+    def uniform_fps(self):
+        delays = set(self.delays_ms)
+        if len(delays) != 1 or not min(delays):
+            return None
+        return Fraction(1000, delays.pop())
+
+    @property
+    def duration(self):
+        """Total duration of one loop of the animation, in seconds."""
+        return Decimal(sum(self.delays_ms)) / Decimal(1000)
+
+
+def _u24(mv, offset):
+    return mv[offset] | (mv[offset + 1] << 8) | (mv[offset + 2] << 16)
+
+
+def _iter_riff_chunks(mv, start, end):
+    """Yields ``(fourcc, data_start, data_end)`` for each RIFF chunk in
+    ``mv[start:end]``. Chunks are padded to an even size."""
+    i = start
+    while i + 8 <= end:
+        fourcc = bytes(mv[i:i + 4])
+        size = unpack_from("<I", mv, i + 4)[0]
+        data_start = i + 8
+        data_end = data_start + size
+        if data_end > end:
+            raise WebpParseError("truncated %r chunk" % fourcc)
+        yield fourcc, data_start, data_end
+        i = data_end + (size & 1)
+
+
+def _webp_bitstream(mv, start, end):
+    """Returns the ``(width, height, alpha)`` of the VP8/VP8L image data in
+    the chunks at ``mv[start:end]`` (a simple file, or an ``ANMF`` frame)."""
+    alpha = False
+    for fourcc, data_start, data_end in _iter_riff_chunks(mv, start, end):
+        if fourcc == b"ALPH":
+            alpha = True
+        elif fourcc == b"VP8 ":
+            # a 3 byte frame tag, the 9d 01 2a start code, then 14 bit sizes
+            start_code = bytes(mv[data_start + 3:data_start + 6])
+            if data_end - data_start < 10 or start_code != b"\x9d\x01\x2a":
+                raise WebpParseError("invalid VP8 frame header")
+            width, height = unpack_from("<HH", mv, data_start + 6)
+            return width & 0x3FFF, height & 0x3FFF, alpha
+        elif fourcc == b"VP8L":
+            # a 0x2f signature byte, then 14 bit sizes (minus one) and an
+            # alpha_is_used bit
+            if data_end - data_start < 5 or mv[data_start] != 0x2F:
+                raise WebpParseError("invalid VP8L header")
+            bits = unpack_from("<I", mv, data_start + 1)[0]
+            return ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1,
+                    alpha or bool(bits >> 28 & 1))
+    raise WebpParseError("no VP8 or VP8L image data found")
+
+
+def parse_webp(buffer):
+    """Parse ``buffer`` and return a :class:`WebpInfo` describing its
+    canvas size, loop count and per-frame durations, offsets and
+    blend/dispose flags.
+
+    This walks the RIFF chunks (``VP8X``, ``ANIM`` and ``ANMF``, or the
+    ``VP8``/``VP8L`` image of a simple file) without decoding any pixel data,
+    unlike iterating frames with PIL, which decodes every full canvas just to
+    read their durations. A still image is returned as a single frame with a
+    duration of 0, as PIL reports it.
+
+    Raises :class:`WebpParseError` if the buffer is not a WebP or is
+    truncated.
+    """
+    mv = memoryview(buffer)
+    if len(mv) < 12 or bytes(mv[:4]) != b"RIFF" or bytes(mv[8:12]) != b"WEBP":
+        raise WebpParseError("not a WebP file")
+    end = min(len(mv), 8 + unpack_from("<I", mv, 4)[0])
+
+    chunks = _iter_riff_chunks(mv, 12, end)
+    fourcc, data_start, data_end = next(chunks, (None, 0, 0))
+    if fourcc != b"VP8X":
+        # a simple (still, lossy or lossless) file
+        width, height, alpha = _webp_bitstream(mv, 12, end)
+        return WebpInfo(
+            width, height, [WebpFrame(0, 0, 0, width, height, True, False, alpha)],
+            has_alpha=alpha)
+
+    if data_end - data_start < 10:
+        raise WebpParseError("invalid VP8X chunk")
+    flags = mv[data_start]
+    width = _u24(mv, data_start + 4) + 1
+    height = _u24(mv, data_start + 7) + 1
+    if not flags & _WEBP_ANIMATION_FLAG:
+        # the chunks after VP8X (and its padding) hold the image
+        _, _, alpha = _webp_bitstream(mv, data_end + (data_end - data_start) % 2, end)
+        alpha = alpha or bool(flags & _WEBP_ALPHA_FLAG)
+        return WebpInfo(
+            width, height, [WebpFrame(0, 0, 0, width, height, True, False, alpha)],
+            has_alpha=alpha)
+
+    loop_count = None
+    frames = []
+    for fourcc, data_start, data_end in chunks:
+        if fourcc == b"ANIM":
+            if data_end - data_start < 6:
+                raise WebpParseError("invalid ANIM chunk")
+            loop_count = unpack_from("<H", mv, data_start + 4)[0]
+        elif fourcc == b"ANMF":
+            if data_end - data_start < 16:
+                raise WebpParseError("invalid ANMF chunk")
+            frame_flags = mv[data_start + 15]
+            _, _, alpha = _webp_bitstream(mv, data_start + 16, data_end)
+            frames.append(WebpFrame(
+                duration_ms=_u24(mv, data_start + 12),
+                x=_u24(mv, data_start) * 2,
+                y=_u24(mv, data_start + 3) * 2,
+                width=_u24(mv, data_start + 6) + 1,
+                height=_u24(mv, data_start + 9) + 1,
+                # "do not blend" and "dispose to background" bits
+                blend=not frame_flags & 0x02,
+                dispose=bool(frame_flags & 0x01),
+                alpha=alpha,
+            ))
+    if not frames:
+        raise WebpParseError("no ANMF frames found in animated WebP")
+    return WebpInfo(
+        width, height, frames, loop_count=loop_count, is_animated=True,
+        has_alpha=bool(flags & _WEBP_ALPHA_FLAG))
+
+
+class Mp4ParseError(ValueError):
+    pass
+
+
+def _iter_boxes(mv, start, end):
+    """Yields ``(box_type, payload_start, box_end)`` for each box in
+    ``mv[start:end]``."""
+    i = start
+    while i + 8 <= end:
+        (box_len, box_type) = unpack_from('>L4s', mv, i)
+        header_len = 8
+        if box_len == 1:
+            if i + 16 > end:
+                raise Mp4ParseError("truncated %r box header" % box_type)
+            (box_len,) = unpack_from('>Q', mv, i + 8)
+            header_len = 16
+        elif box_len == 0:
+            # box extends to the end of its parent (or the file)
+            box_len = end - i
+        if box_len < header_len or i + box_len > end:
+            raise Mp4ParseError("invalid %r box size" % box_type)
+        yield box_type, i + header_len, i + box_len
+        i += box_len
+
+
+def _find_box(mv, start, end, path):
+    """Returns ``(payload_start, box_end)`` of the first box found by
+    descending through the box types in ``path``, or ``None``."""
+    for box_type, box_start, box_end in _iter_boxes(mv, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return box_start, box_end
+            return _find_box(mv, box_start, box_end, path[1:])
+    return None
+
+
+def _full_box_timing(mv, start):
+    """The ``(timescale, duration)`` fields of an ``mvhd`` or ``mdhd`` box,
+    whose layout depends on the version byte of the full box header."""
+    if mv[start] == 1:
+        (timescale, duration) = unpack_from('>LQ', mv, start + 20)
+    else:
+        (timescale, duration) = unpack_from('>LL', mv, start + 12)
+    return timescale, duration
+
+
+def _mp4_edit_list(mv, start, movie_timescale, timescale, track_duration):
+    """
+    Reads a track's ``elst`` box into ``(delay, media_start, duration)``, in
+    seconds: leading empty edits delay the start of the track, which begins
+    at the media time ``media_start`` of the first media edit, and the media
+    edits that follow (which, for instance, cut the encoder priming samples
+    of an aac track) make up its ``duration``. Edits are stored at the
+    coarser movie timescale, so each is clipped to the duration of the media.
+    ``duration`` is ``None`` for an edit list that carries none, as written by
+    fragmented files.
+    """
+    version = mv[start]
+    (num_entries,) = unpack_from('>L', mv, start + 4)
+    entry_format, entry_len = ('>Qq', 20) if version == 1 else ('>Ll', 12)
+    delay = duration = 0
+    media_start = None
+    for i in range(num_entries):
+        (segment_duration, media_time) = unpack_from(
+            entry_format, mv, start + 8 + entry_len * i)
+        segment_duration = Fraction(segment_duration, movie_timescale)
+        if media_time == -1:
+            if media_start is None:
+                delay += segment_duration
+            else:
+                duration += segment_duration
+        else:
+            if media_start is None:
+                media_start = Fraction(media_time, timescale)
+            duration += min(segment_duration,
+                            Fraction(track_duration, timescale))
+    return delay, media_start or 0, duration or None
+
+
+def _probe_mp4_track(mv, trak_start, trak_end):
+    """Returns ``(handler_type, timescale, duration, stbl, elst)`` for a
+    trak."""
+    hdlr = _find_box(mv, trak_start, trak_end, [b'mdia', b'hdlr'])
+    mdhd = _find_box(mv, trak_start, trak_end, [b'mdia', b'mdhd'])
+    stbl = _find_box(mv, trak_start, trak_end, [b'mdia', b'minf', b'stbl'])
+    elst = _find_box(mv, trak_start, trak_end, [b'edts', b'elst'])
+    if hdlr is None or mdhd is None:
+        return None, 0, 0, None, None
+    (handler_type,) = unpack_from('4s', mv, hdlr[0] + 8)
+    timescale, duration = _full_box_timing(mv, mdhd[0])
+    return handler_type, timescale, duration, stbl, elst
+
+
+def probe_mp4(buffer):
+    """
+    Reads the size, duration and frame rate of the first video track of an
+    mp4 or QuickTime buffer directly from its ``moov`` box (``mvhd``,
+    ``elst``, ``mdhd``, ``hdlr``, ``stsd`` and ``stts``), without decoding
+    anything or starting an ffprobe process.
+
+    Returns a subset of the flat dict returned by
+    :func:`thumbor_video_engine.ffprobe.ffprobe`: ``width``, ``height``,
+    ``duration``, ``avg_frame_rate``, ``nb_frames`` and ``codec_tag_string``,
+    formatted as ffprobe formats them.
+
+    Raises :class:`Mp4ParseError` for anything it cannot read with
+    confidence -- no ``moov`` box, no video track, a fragmented file (whose
+    samples live in ``moof`` boxes), or a malformed box -- so that the caller
+    can fall back to ffprobe.
+    """
+    mv = memoryview(buffer)
+    try:
+        moov = _find_box(mv, 0, len(mv), [b'moov'])
+        if moov is None:
+            raise Mp4ParseError("no moov box found")
+        mvhd = _find_box(mv, moov[0], moov[1], [b'mvhd'])
+        if mvhd is None:
+            raise Mp4ParseError("no mvhd box found")
+        movie_timescale, duration = _full_box_timing(mv, mvhd[0])
+        if not movie_timescale:
+            raise Mp4ParseError("invalid mvhd timescale")
+        movie_duration = Fraction(duration, movie_timescale)
+
+        spans = []
+        video = None
+        for box_type, box_start, box_end in _iter_boxes(mv, moov[0], moov[1]):
+            if box_type != b'trak':
+                continue
+            (handler_type, timescale, track_duration, stbl,
+             elst) = _probe_mp4_track(mv, box_start, box_end)
+            if not timescale:
+                continue
+            delay, duration = 0, None
+            if elst is not None:
+                delay, _, duration = _mp4_edit_list(
+                    mv, elst[0], movie_timescale, timescale, track_duration)
+            if duration is None:
+                delay, duration = 0, Fraction(track_duration, timescale)
+            spans.append((delay, delay + duration))
+            if handler_type == b'vide' and video is None and stbl is not None:
+                video = timescale, track_duration, stbl
+        if video is None:
+            raise Mp4ParseError("no video track found")
+        timescale, track_duration, (stbl_start, stbl_end) = video
+        # Like ffprobe, report the span from the earliest track start to the
+        # latest track end as the container duration, with edit lists
+        # applied; mvhd is stored at a coarser timescale and rounded up
+        duration = (max(end for _, end in spans)
+                    - min(start for start, _ in spans)) or movie_duration
+
+        stsd = _find_box(mv, stbl_start, stbl_end, [b'stsd'])
+        stts = _find_box(mv, stbl_start, stbl_end, [b'stts'])
+        if stsd is None or stts is None:
+            raise Mp4ParseError("no stsd or stts box found")
+        # stsd: full box header, entry count, then the first sample entry's
+        # box header and its VisualSampleEntry fields
+        (codec_tag, width, height) = unpack_from('>4s24xHH', mv, stsd[0] + 12)
+        (num_entries,) = unpack_from('>L', mv, stts[0] + 4)
+        num_frames = 0
+        for i in range(num_entries):
+            (count,) = unpack_from('>L', mv, stts[0] + 8 + 8 * i)
+            num_frames += count
+    except (IndexError, StructError):
+        raise Mp4ParseError("truncated mp4 box")
+
+    if not num_frames or not track_duration or not duration:
+        # Fragmented mp4: samples are described in moof boxes instead
+        raise Mp4ParseError("no samples found in moov box")
+    if not width or not height:
+        raise Mp4ParseError("invalid video dimensions")
+
+    avg_frame_rate = Fraction(num_frames * timescale, track_duration)
+    return {
+        'width': width,
+        'height': height,
+        'duration': '%.6f' % duration,
+        'avg_frame_rate': '%d/%d' % (
+            avg_frame_rate.numerator, avg_frame_rate.denominator),
+        'nb_frames': str(num_frames),
+        'codec_tag_string': codec_tag.decode('latin-1'),
+    }
+
+
+KeyframeIndex = namedtuple("KeyframeIndex", ["times", "offsets", "header_size"])
+KeyframeIndex.__doc__ = """
+The keyframes of the video track of a source: their presentation ``times``
+in seconds from the first frame, in ascending order, and, where the
+container allows a byte range of the source to be demuxed on its own, the
+``offsets`` of the data starting at each of them and the ``header_size``
+of the headers that must precede that data.
+"""
+
+
+def _sample_table_lookup(entries, samples):
+    """For each of the ascending 1-based ``samples``, yields the value of the
+    ``(sample_count, value)`` run of an ``stts`` or ``ctts`` table that it is
+    in, its position in that run, and the sum of ``sample_count * value`` of
+    the runs before it."""
+    entries = iter(entries)
+    first, count, value, total = 1, 0, 0, 0
+    for sample in samples:
+        while sample >= first + count:
+            first += count
+            total += count * value
+            entry = next(entries, None)
+            if entry is None:
+                raise Mp4ParseError("sample %d is not in the sample table" % sample)
+            count, value = entry
+        yield value, sample - first, total
+
+
+def _mp4_sample_table(mv, box, signed=False):
+    """The ``(sample_count, value)`` entries of an ``stts`` or ``ctts`` box;
+    version 1 ``ctts`` offsets are signed"""
+    fmt = '>Ll' if signed and mv[box[0]] == 1 else '>LL'
+    (num_entries,) = unpack_from('>L', mv, box[0] + 4)
+    return [unpack_from(fmt, mv, box[0] + 8 + 8 * i) for i in range(num_entries)]
+
+
+def mp4_keyframes(buffer):
+    """
+    Reads the presentation times of the keyframes of the first video track
+    of an mp4 or QuickTime buffer from its sample tables (``stss``, ``stts``
+    and ``ctts``) and edit list, without decoding anything.
+
+    Returns a :class:`KeyframeIndex` without byte offsets: the samples of an
+    mp4 cannot be demuxed without the ``moov`` box that indexes them, so
+    ffmpeg is left to seek to them in the file itself.
+
+    Raises :class:`Mp4ParseError` for anything it cannot read with
+    confidence, as :func:`probe_mp4` does.
+    """
+    mv = memoryview(buffer)
+    try:
+        moov = _find_box(mv, 0, len(mv), [b'moov'])
+        if moov is None:
+            raise Mp4ParseError("no moov box found")
+        mvhd = _find_box(mv, moov[0], moov[1], [b'mvhd'])
+        if mvhd is None:
+            raise Mp4ParseError("no mvhd box found")
+        movie_timescale, _ = _full_box_timing(mv, mvhd[0])
+
+        video = None
+        for box_type, box_start, box_end in _iter_boxes(mv, moov[0], moov[1]):
+            if box_type != b'trak':
+                continue
+            (handler_type, timescale, track_duration, stbl,
+             elst) = _probe_mp4_track(mv, box_start, box_end)
+            if handler_type == b'vide' and timescale and stbl is not None:
+                video = timescale, track_duration, stbl, elst
+                break
+        if video is None:
+            raise Mp4ParseError("no video track found")
+        timescale, track_duration, (stbl_start, stbl_end), elst = video
+
+        stts = _find_box(mv, stbl_start, stbl_end, [b'stts'])
+        if stts is None:
+            raise Mp4ParseError("no stts box found")
+        stts = _mp4_sample_table(mv, stts)
+        stss = _find_box(mv, stbl_start, stbl_end, [b'stss'])
+        if stss is not None:
+            (num_entries,) = unpack_from('>L', mv, stss[0] + 4)
+            samples = [unpack_from('>L', mv, stss[0] + 8 + 4 * i)[0]
+                       for i in range(num_entries)]
+        else:
+            # without an stss box every sample is a keyframe
+            samples = range(1, sum(count for count, _ in stts) + 1)
+        if not samples:
+            raise Mp4ParseError("no samples found in moov box")
+        ctts = _find_box(mv, stbl_start, stbl_end, [b'ctts'])
+        if ctts is not None:
+            offsets = [value for value, _, _ in _sample_table_lookup(
+                _mp4_sample_table(mv, ctts, signed=True), samples)]
+        else:
+            offsets = [0] * len(samples)
+        delay = media_start = 0
+        if elst is not None and movie_timescale:
+            delay, media_start, _ = _mp4_edit_list(
+                mv, elst[0], movie_timescale, timescale, track_duration)
+
+        times = []
+        for (delta, position, total), offset in zip(
+                _sample_table_lookup(stts, samples), offsets):
+            dts = total + position * delta
+            times.append(Fraction(dts + offset, timescale) - media_start + delay)
+    except (IndexError, StructError):
+        raise Mp4ParseError("truncated mp4 box")
+
+    start = min(times)
+    return KeyframeIndex(sorted(float(t - start) for t in times), None, None)
+
+
+class WebmParseError(ValueError):
+    pass
+
+
+_EBML_HEADER = 0x1A45DFA3
+_EBML_DOCTYPE = 0x4282
+_MKV_SEGMENT = 0x18538067
+_MKV_INFO = 0x1549A966
+_MKV_TIMECODE_SCALE = 0x2AD7B1
+_MKV_DURATION = 0x4489
+_MKV_TRACKS = 0x1654AE6B
+_MKV_TRACK_ENTRY = 0xAE
+_MKV_TRACK_TYPE = 0x83
+_MKV_CODEC_ID = 0x86
+_MKV_DEFAULT_DURATION = 0x23E383
+_MKV_VIDEO = 0xE0
+_MKV_PIXEL_WIDTH = 0xB0
+_MKV_PIXEL_HEIGHT = 0xBA
+_MKV_CLUSTER = 0x1F43B675
+_EBML_VERSION = 0x4286
+_EBML_READ_VERSION = 0x42F7
+_EBML_MAX_ID_LENGTH = 0x42F2
+_EBML_MAX_SIZE_LENGTH = 0x42F3
+_EBML_DOCTYPE_VERSION = 0x4287
+_EBML_DOCTYPE_READ_VERSION = 0x4285
+_MKV_TRACK_NUMBER = 0xD7
+_MKV_TRACK_UID = 0x73C5
+_MKV_COLOUR_SPACE = 0x2EB524
+_MKV_CLUSTER_TIMECODE = 0xE7
+_MKV_BLOCK_GROUP = 0xA0
+_MKV_BLOCK = 0xA1
+_MKV_BLOCK_DURATION = 0x9B
+_MKV_CUES = 0x1C53BB6B
+_MKV_CUE_POINT = 0xBB
+_MKV_CUE_TIME = 0xB3
+_MKV_CUE_TRACK_POSITIONS = 0xB7
+_MKV_CUE_TRACK = 0xF7
+_MKV_CUE_CLUSTER_POSITION = 0xF1
+
+_MKV_TRACK_TYPE_VIDEO = 1
+_MKV_DEFAULT_TIMECODE_SCALE = 1000000  # nanoseconds
+
+# Matroska CodecIDs, as reported by ffprobe's ``codec_name``
+_MKV_CODEC_NAMES = {
+    'V_VP8': 'vp8',
+    'V_VP9': 'vp9',
+    'V_AV1': 'av1',
+    'V_MPEG4/ISO/AVC': 'h264',
+    'V_MPEGH/ISO/HEVC': 'hevc',
+}
+
+
+def _read_vint(mv, i, keep_marker=False):
+    """Reads an EBML variable-length integer at ``mv[i]``. Returns the value
+    and the offset past it; the value is ``None`` for the reserved
+    "unknown size" encoding (all value bits set)."""
+    first = mv[i]
+    if not first:
+        raise WebmParseError("invalid EBML variable-length integer")
+    length = 8 - first.bit_length() + 1
+    if i + length > len(mv):
+        raise WebmParseError("truncated EBML variable-length integer")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in mv[i + 1:i + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = None
+    return value, i + length
+
+
+def _iter_ebml(mv, start, end, stop_ids=()):
+    """Yields ``(element_id, data_start, data_end)`` for each EBML element in
+    ``mv[start:end]``. Elements of unknown size (live-muxed Segments) extend
+    to ``end``. Iteration ends at the first element in ``stop_ids``."""
+    i = start
+    while i < end:
+        element_id, i = _read_vint(mv, i, keep_marker=True)
+        if element_id in stop_ids:
+            return
+        size, i = _read_vint(mv, i)
+        data_end = end if size is None else i + size
+        if data_end > end:
+            raise WebmParseError("EBML element 0x%X overruns its parent" % element_id)
+        yield element_id, i, data_end
+        i = data_end
+
+
+def _ebml_uint(mv, start, end):
+    value = 0
+    for byte in mv[start:end]:
+        value = (value << 8) | byte
+    return value
+
+
+def _ebml_float(mv, start, end):
+    if end - start == 4:
+        return unpack_from('>f', mv, start)[0]
+    elif end - start == 8:
+        return unpack_from('>d', mv, start)[0]
+    raise WebmParseError("invalid EBML float size")
+
+
+def _av_reduce(num, den, max_value):
+    """A port of libavutil's ``av_reduce()``: the closest fraction to
+    ``num/den`` whose numerator and denominator are both at most
+    ``max_value``. Unlike :meth:`Fraction.limit_denominator` this bounds the
+    numerator too, which is what ffprobe's reported frame rates depend on."""
+    frac = Fraction(num, den)
+    num, den = frac.numerator, frac.denominator
+    if num <= max_value and den <= max_value:
+        return frac
+    a0_num, a0_den, a1_num, a1_den = 0, 1, 1, 0
+    while den:
+        x = num // den
+        next_den = num - den * x
+        a2_num = x * a1_num + a0_num
+        a2_den = x * a1_den + a0_den
+        if a2_num > max_value or a2_den > max_value:
+            if a1_num:
+                x = (max_value - a0_num) // a1_num
+            if a1_den:
+                x = min(x, (max_value - a0_den) // a1_den)
+            if den * (2 * x * a1_den + a0_den) > num * a1_den:
+                a1_num, a1_den = x * a1_num + a0_num, x * a1_den + a0_den
+            break
+        a0_num, a0_den, a1_num, a1_den = a1_num, a1_den, a2_num, a2_den
+        num, den = den, next_den
+    return Fraction(a1_num, a1_den)
+
+
+def _probe_webm_track(mv, start, end):
+    track = {}
+    for element_id, data_start, data_end in _iter_ebml(mv, start, end):
+        if element_id == _MKV_TRACK_NUMBER:
+            track['number'] = _ebml_uint(mv, data_start, data_end)
+        elif element_id == _MKV_TRACK_TYPE:
+            track['type'] = _ebml_uint(mv, data_start, data_end)
+        elif element_id == _MKV_CODEC_ID:
+            track['codec_id'] = bytes(mv[data_start:data_end]).rstrip(b'\0')
+        elif element_id == _MKV_DEFAULT_DURATION:
+            track['default_duration'] = _ebml_uint(mv, data_start, data_end)
+        elif element_id == _MKV_VIDEO:
+            for video_id, video_start, video_end in _iter_ebml(
+                    mv, data_start, data_end):
+                if video_id == _MKV_PIXEL_WIDTH:
+                    track['width'] = _ebml_uint(mv, video_start, video_end)
+                elif video_id == _MKV_PIXEL_HEIGHT:
+                    track['height'] = _ebml_uint(mv, video_start, video_end)
+    return track
+
+
+def probe_webm(buffer):
+    """
+    Reads the size, duration and frame rate of the first video track of a
+    WebM (or Matroska) buffer from the EBML ``Segment/Info`` and
+    ``Segment/Tracks`` elements, stopping at the first ``Cluster`` so that
+    none of the media data is read.
+
+    Returns a subset of the flat dict returned by
+    :func:`thumbor_video_engine.ffprobe.ffprobe`: ``width``, ``height``,
+    ``duration``, ``avg_frame_rate`` and, for known codecs, ``codec_name``,
+    formatted as ffprobe formats them.
+
+    Raises :class:`WebmParseError` when the header elements are malformed,
+    or when something ffprobe would work out by reading packets is missing
+    from them -- a ``Duration`` (live-muxed files), a video track's
+    ``DefaultDuration``, or ``Info``/``Tracks`` placed after the clusters --
+    so that the caller can fall back to ffprobe.
+    """
+    mv = memoryview(buffer)
+    info = {}
+    video = None
+    try:
+        elements = _iter_ebml(mv, 0, len(mv))
+        header_id, header_start, header_end = next(elements, (None, 0, 0))
+        if header_id != _EBML_HEADER:
+            raise WebmParseError("missing EBML header")
+        for element_id, data_start, data_end in _iter_ebml(
+                mv, header_start, header_end):
+            if element_id == _EBML_DOCTYPE:
+                doc_type = bytes(mv[data_start:data_end]).rstrip(b'\0')
+                if doc_type not in (b'webm', b'matroska'):
+                    raise WebmParseError("unsupported DocType %r" % doc_type)
+        segment_id, segment_start, segment_end = next(elements, (None, 0, 0))
+        if segment_id != _MKV_SEGMENT:
+            raise WebmParseError("missing Segment element")
+
+        for element_id, data_start, data_end in _iter_ebml(
+                mv, segment_start, segment_end, stop_ids=(_MKV_CLUSTER,)):
+            if element_id == _MKV_INFO:
+                for info_id, info_start, info_end in _iter_ebml(
+                        mv, data_start, data_end):
+                    if info_id == _MKV_TIMECODE_SCALE:
+                        info['timecode_scale'] = _ebml_uint(mv, info_start, info_end)
+                    elif info_id == _MKV_DURATION:
+                        info['duration'] = _ebml_float(mv, info_start, info_end)
+            elif element_id == _MKV_TRACKS:
+                for track_id, track_start, track_end in _iter_ebml(
+                        mv, data_start, data_end):
+                    if track_id != _MKV_TRACK_ENTRY:
+                        continue
+                    track = _probe_webm_track(mv, track_start, track_end)
+                    if track.get('type') == _MKV_TRACK_TYPE_VIDEO:
+                        video = track
+                        break
+            if info and video:
+                break
+    except (IndexError, StructError):
+        raise WebmParseError("truncated EBML element")
+
+    if video is None:
+        raise WebmParseError("no video track found before the first Cluster")
+    if not video.get('width') or not video.get('height'):
+        raise WebmParseError("invalid video dimensions")
+    if not info.get('duration'):
+        raise WebmParseError("no Segment duration found")
+    if not video.get('default_duration'):
+        raise WebmParseError("no DefaultDuration for the video track")
+
+    timecode_scale = info.get('timecode_scale') or _MKV_DEFAULT_TIMECODE_SCALE
+    duration = Decimal(repr(info['duration'])) * timecode_scale / Decimal(10 ** 9)
+    # ffmpeg's matroska demuxer reduces 1s / DefaultDuration to a fraction
+    # with terms of at most 30000
+    frame_rate = _av_reduce(10 ** 9, video['default_duration'], 30000)
+    probe_data = {
+        'width': video['width'],
+        'height': video['height'],
+        'duration': '%.6f' % duration,
+        'avg_frame_rate': '%d/%d' % (frame_rate.numerator, frame_rate.denominator),
+    }
+    codec_name = _MKV_CODEC_NAMES.get(video.get('codec_id', b'').decode('latin-1'))
+    if codec_name:
+        probe_data['codec_name'] = codec_name
+    return probe_data
+
+
+def _iter_webm_cues(mv, start, end):
+    """Yields ``(cue_time, track, cluster_position)`` for each track position
+    of each CuePoint in a Cues element"""
+    for point_id, point_start, point_end in _iter_ebml(mv, start, end):
+        if point_id != _MKV_CUE_POINT:
+            continue
+        cue_time = None
+        positions = []
+        for cue_id, cue_start, cue_end in _iter_ebml(mv, point_start, point_end):
+            if cue_id == _MKV_CUE_TIME:
+                cue_time = _ebml_uint(mv, cue_start, cue_end)
+            elif cue_id == _MKV_CUE_TRACK_POSITIONS:
+                position = {}
+                for pos_id, pos_start, pos_end in _iter_ebml(mv, cue_start, cue_end):
+                    if pos_id == _MKV_CUE_TRACK:
+                        position['track'] = _ebml_uint(mv, pos_start, pos_end)
+                    elif pos_id == _MKV_CUE_CLUSTER_POSITION:
+                        position['cluster'] = _ebml_uint(mv, pos_start, pos_end)
+                positions.append(position)
+        if cue_time is None:
+            continue
+        for position in positions:
+            if 'track' in position and 'cluster' in position:
+                yield cue_time, position['track'], position['cluster']
+
+
+def webm_keyframes(buffer):
+    """
+    Reads the keyframes of the first video track of a WebM (or Matroska)
+    buffer from its ``Cues``, which muxers write at the start or the end of
+    the segment. Only the element headers of the segment's children are
+    read, skipping over the clusters.
+
+    Returns a :class:`KeyframeIndex` with the offsets of the clusters that
+    start at each keyframe. The headers before the first cluster followed by
+    the clusters from one of those offsets can be demuxed on their own.
+
+    Raises :class:`WebmParseError` if the buffer has no ``Cues`` for its
+    video track, as is the case for live-muxed files.
+    """
+    mv = memoryview(buffer)
+    timecode_scale = _MKV_DEFAULT_TIMECODE_SCALE
+    track_number = None
+    cues = None
+    header_size = None
+    try:
+        elements = _iter_ebml(mv, 0, len(mv))
+        header_id, _, _ = next(elements, (None, 0, 0))
+        if header_id != _EBML_HEADER:
+            raise WebmParseError("missing EBML header")
+        segment_id, segment_start, segment_end = next(elements, (None, 0, 0))
+        if segment_id != _MKV_SEGMENT:
+            raise WebmParseError("missing Segment element")
+
+        # each element starts where the one before it ends
+        element_start = segment_start
+        for element_id, data_start, data_end in _iter_ebml(
+                mv, segment_start, segment_end):
+            if element_id == _MKV_CLUSTER and header_size is None:
+                header_size = element_start
+            elif element_id == _MKV_INFO:
+                for info_id, info_start, info_end in _iter_ebml(
+                        mv, data_start, data_end):
+                    if info_id == _MKV_TIMECODE_SCALE:
+                        timecode_scale = _ebml_uint(mv, info_start, info_end)
+            elif element_id == _MKV_TRACKS:
+                for track_id, track_start, track_end in _iter_ebml(
+                        mv, data_start, data_end):
+                    if track_id != _MKV_TRACK_ENTRY:
+                        continue
+                    track = _probe_webm_track(mv, track_start, track_end)
+                    if track.get('type') == _MKV_TRACK_TYPE_VIDEO:
+                        track_number = track.get('number')
+                        break
+            elif element_id == _MKV_CUES:
+                cues = data_start, data_end
+            element_start = data_end
+
+        if header_size is None or track_number is None or cues is None:
+            raise WebmParseError("no clusters, video track or Cues found")
+        keyframes = sorted(
+            (cue_time, segment_start + cluster_position)
+            for cue_time, track, cluster_position in _iter_webm_cues(mv, *cues)
+            if track == track_number)
+    except (IndexError, StructError):
+        raise WebmParseError("truncated EBML element")
+
+    if not keyframes:
+        raise WebmParseError("no Cues found for the video track")
+    start = keyframes[0][0]
+    return KeyframeIndex(
+        [(cue_time - start) * timecode_scale / 10 ** 9 for cue_time, _ in keyframes],
+        [offset for _, offset in keyframes],
+        header_size)
+
+
+def _ebml_size(size):
+    length = 1
+    # all value bits set is reserved for "unknown size"
+    while size >= (1 << (7 * length)) - 1:
+        length += 1
+    return (size | (1 << (7 * length))).to_bytes(length, 'big')
+
+
+# the reserved "unknown size", as an 8 byte variable-length integer
+_EBML_UNKNOWN_SIZE = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+
+
+def _ebml_id(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+
+def _ebml_header(element_id, size):
+    return _ebml_id(element_id) + _ebml_size(size)
+
+
+def _ebml_element(element_id, *children):
+    payload = b"".join(children)
+    return _ebml_header(element_id, len(payload)) + payload
+
+
+def _ebml_uint_element(element_id, value):
+    return _ebml_element(
+        element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big'))
+
+
+def iter_rgba_mkv(size, frames):
+    """
+    Muxes raw RGBA frames into a Matroska stream that ffmpeg can read from a
+    pipe, yielding it in chunks as ``frames`` is consumed so that only one
+    frame is held at a time.
+
+    ``size`` is the ``(width, height)`` of every frame, and ``frames`` an
+    iterable of ``(rgba_bytes, duration_ms)`` tuples. Each frame is given its
+    own timestamp and duration, which rawvideo and y4m input cannot carry.
+    """
+    width, height = size
+    yield _ebml_element(
+        _EBML_HEADER,
+        _ebml_uint_element(_EBML_VERSION, 1),
+        _ebml_uint_element(_EBML_READ_VERSION, 1),
+        _ebml_uint_element(_EBML_MAX_ID_LENGTH, 4),
+        _ebml_uint_element(_EBML_MAX_SIZE_LENGTH, 8),
+        _ebml_element(_EBML_DOCTYPE, b'matroska'),
+        _ebml_uint_element(_EBML_DOCTYPE_VERSION, 4),
+        _ebml_uint_element(_EBML_DOCTYPE_READ_VERSION, 2))
+    # a Segment of unknown size, since the frames have not been decoded yet
+    yield _ebml_id(_MKV_SEGMENT) + _EBML_UNKNOWN_SIZE
+    yield _ebml_element(
+        _MKV_INFO,
+        _ebml_uint_element(_MKV_TIMECODE_SCALE, _MKV_DEFAULT_TIMECODE_SCALE))
+    yield _ebml_element(
+        _MKV_TRACKS,
+        _ebml_element(
+            _MKV_TRACK_ENTRY,
+            _ebml_uint_element(_MKV_TRACK_NUMBER, 1),
+            _ebml_uint_element(_MKV_TRACK_UID, 1),
+            _ebml_uint_element(_MKV_TRACK_TYPE, _MKV_TRACK_TYPE_VIDEO),
+            _ebml_element(_MKV_CODEC_ID, b'V_UNCOMPRESSED'),
+            _ebml_element(
+                _MKV_VIDEO,
+                _ebml_uint_element(_MKV_PIXEL_WIDTH, width),
+                _ebml_uint_element(_MKV_PIXEL_HEIGHT, height),
+                _ebml_element(_MKV_COLOUR_SPACE, b'RGBA'))))
+
+    # track 1, a relative timecode of 0 and no flags
+    block_header = b'\x81\x00\x00\x00'
+    timecode = 0
+    for data, duration_ms in frames:
+        # one Cluster per frame: Cluster(Timecode, BlockGroup(Block, BlockDuration)),
+        # with the frame data yielded as is rather than copied into it
+        block = (
+            _ebml_header(_MKV_BLOCK, len(block_header) + len(data))
+            + block_header)
+        block_duration = _ebml_uint_element(_MKV_BLOCK_DURATION, duration_ms)
+        block_group = _ebml_header(
+            _MKV_BLOCK_GROUP, len(block) + len(data) + len(block_duration))
+        cluster_timecode = _ebml_uint_element(_MKV_CLUSTER_TIMECODE, timecode)
+        cluster_size = (
+            len(cluster_timecode) + len(block_group) + len(block) + len(data)
+            + len(block_duration))
+        yield _ebml_header(_MKV_CLUSTER, cluster_size) + cluster_timecode + block_group + block
+        yield data
+        yield block_duration
+        timecode += duration_ms
@@ -1,5 +1,6 @@
 import asyncio
 import os
+import subprocess
 
 import pytest
 import pytest_asyncio
@@ -13,6 +14,9 @@ from thumbor.context import Context, ServerParameters, RequestParameters
 from thumbor.importer import Importer
 from thumbor.server import configure_log, get_application
 
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.probe_caches import memory as memory_probe_cache
+
 try:
     from shutil import which
 except ImportError:
@@ -51,6 +55,15 @@ def reset_thumbor_threadpool():
         ThreadPool._instance = None
 
 
+@pytest.fixture(autouse=True)
+def reset_probe_cache():
+    """The in-process probe cache is shared by every Engine in the process;
+    keep one test's probe results from leaking into the next."""
+    memory_probe_cache.Cache.clear()
+    yield
+    memory_probe_cache.Cache.clear()
+
+
 @pytest.fixture
 def storage_path():
     return os.path.join(CURR_DIR, "data")
@@ -61,12 +74,61 @@ def ffmpeg_path():
     return os.getenv("FFMPEG_PATH") or which("ffmpeg")
 
 
+@pytest.fixture(scope="session")
+def keyframe_videos(tmp_path_factory):
+    """Six seconds of ffmpeg's testsrc at 24fps with a keyframe every second,
+    as an h264 mp4 (with b-frames) and a vp9 webm, keyed by extension"""
+    ffmpeg_path = os.getenv("FFMPEG_PATH") or which("ffmpeg")
+    tmp_path = tmp_path_factory.mktemp("keyframes")
+    codecs = {
+        "mp4": ["-c:v", "libx264", "-movflags", "faststart"],
+        "webm": ["-c:v", "libvpx-vp9", "-deadline", "realtime"],
+    }
+    videos = {}
+    for ext, flags in codecs.items():
+        path = str(tmp_path / ("keyframes.%s" % ext))
+        subprocess.run([
+            ffmpeg_path, "-v", "error", "-f", "lavfi",
+            "-i", "testsrc=size=160x120:rate=24:duration=6",
+        ] + flags + ["-g", "24", "-pix_fmt", "yuv420p", path], check=True)
+        with open(path, mode="rb") as f:
+            videos[ext] = f.read()
+    return videos
+
+
+@pytest.fixture(scope="session")
+def audio_videos(tmp_path_factory):
+    """Three seconds of h264 video with three and a half seconds of aac
+    audio, whose priming samples are cut by an edit list, as an mp4 and a
+    mov, keyed by extension"""
+    ffmpeg_path = os.getenv("FFMPEG_PATH") or which("ffmpeg")
+    tmp_path = tmp_path_factory.mktemp("audio")
+    videos = {}
+    for ext in ("mp4", "mov"):
+        path = str(tmp_path / ("audio.%s" % ext))
+        subprocess.run([
+            ffmpeg_path, "-v", "error",
+            "-f", "lavfi", "-i", "testsrc=size=160x120:rate=24:duration=3",
+            "-f", "lavfi", "-i", "sine=sample_rate=44100:duration=3.5",
+            "-c:v", "libx264", "-c:a", "aac", "-pix_fmt", "yuv420p", path,
+        ], check=True)
+        with open(path, mode="rb") as f:
+            videos[ext] = f.read()
+    return videos
+
+
 @pytest.fixture
 def mp4_buffer(storage_path):
     with open(os.path.join(storage_path, "hotdog.mp4"), mode="rb") as f:
         return f.read()
 
 
+@pytest.fixture
+def webm_buffer(storage_path):
+    with open(os.path.join(storage_path, "hotdog.webm"), mode="rb") as f:
+        return f.read()
+
+
 @pytest.fixture
 def config(storage_path, ffmpeg_path):
     Config.allow_environment_variables()
@@ -110,6 +172,23 @@ def context(config):
         yield context
 
 
+@pytest.fixture
+def load_engine(context):
+    """Loads a buffer into an ffmpeg engine for the request in ``context``,
+    requested in ``out_format`` and optionally cropped and resized"""
+    def load(buffer, extension='.mp4', out_format=None, crop=None, resize=None):
+        context.request.format = out_format
+        engine = FFmpegEngine(context)
+        engine.load(buffer, extension)
+        if crop:
+            engine.crop(*crop)
+        if resize:
+            engine.resize(*resize)
+        return engine
+
+    return load
+
+
 @pytest.fixture
 def app(context):
     return get_application(context)
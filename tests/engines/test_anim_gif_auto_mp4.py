@@ -2,6 +2,8 @@ from thumbor.engines import BaseEngine
 
 import pytest
 
+from thumbor_video_engine.capabilities import Capabilities
+
 
 VIDEO_HEADERS = {"Accept": 'video/*,*/*;q=0.8'}
 
@@ -35,3 +37,18 @@ async def test_auto_h26x_transcodes_anim_gif(http_client, base_url, accepts_vide
     if setting_val is True:
         vary_header = (response.headers.get('vary') or '').lower()
         assert 'accept' in vary_header
+
+
+@pytest.mark.asyncio
+async def test_auto_h265_without_libx265_falls_back_to_h264(
+        monkeypatch, http_client, base_url, config):
+    monkeypatch.setattr(Capabilities, 'has_encoder', lambda self, name: name != 'libx265')
+    config.FFMPEG_GIF_AUTO_H265 = True
+    config.FFMPEG_GIF_AUTO_H264 = True
+
+    response = await http_client.fetch(
+        "%s/unsafe/hotdog.gif" % base_url, headers=VIDEO_HEADERS)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'video/mp4'
+    assert b'avcC' in response.body[:800]
@@ -0,0 +1,99 @@
+from fractions import Fraction
+import os
+import subprocess
+
+import pytest
+
+from thumbor_video_engine.ffprobe import ffprobe
+
+try:
+    from shutil import which
+except ImportError:
+    from thumbor.utils import which
+
+
+@pytest.fixture(scope="module")
+def mjpeg_buffer(tmp_path_factory):
+    """A second of ffmpeg's testsrc at 640x360 as an mjpeg mov"""
+    ffmpeg_path = os.getenv("FFMPEG_PATH") or which("ffmpeg")
+    path = str(tmp_path_factory.mktemp("decode") / "mjpeg.mov")
+    subprocess.run([
+        ffmpeg_path, "-v", "error", "-f", "lavfi",
+        "-i", "testsrc=size=640x360:rate=10:duration=1",
+        "-c:v", "mjpeg", "-movflags", "faststart", path], check=True)
+    with open(path, mode="rb") as f:
+        return f.read()
+
+
+def test_lowres_factor(context, mjpeg_buffer, mp4_buffer, load_engine):
+    assert load_engine(mjpeg_buffer, '.mov', 'mp4').lowres_factor() == 0
+    assert load_engine(mjpeg_buffer, '.mov', 'mp4', resize=(320, 180)).lowres_factor() == 1
+    assert load_engine(mjpeg_buffer, '.mov', 'mp4', resize=(100, 56)).lowres_factor() == 2
+    assert load_engine(mjpeg_buffer, '.mov', 'mp4', resize=(40, 22)).lowres_factor() == 3
+    engine = load_engine(mjpeg_buffer, '.mov', 'mp4', crop=(0, 0, 320, 180), resize=(100, 56))
+    assert engine.lowres_factor() == 1
+
+    # h264 cannot be decoded at a lower resolution
+    assert load_engine(mp4_buffer, '.mp4', 'mp4', resize=(50, 38)).lowres_factor() == 0
+
+    context.config.FFMPEG_LOWRES_DECODE = False
+    assert load_engine(mjpeg_buffer, '.mov', 'mp4', resize=(100, 56)).lowres_factor() == 0
+
+
+def test_transcode_decodes_at_lowres(mocker, context, mjpeg_buffer, load_engine):
+    mocker.spy(context.metrics, 'incr')
+    engine = load_engine(mjpeg_buffer, '.mov', 'mp4', crop=(320, 180, 640, 360), resize=(80, 44))
+    run_spy = mocker.spy(engine, 'run_cmd')
+
+    result = engine.read('.mp4', quality=80)
+
+    cmd = run_spy.mock_calls[0][1][0]
+    assert cmd[cmd.index('-lowres') + 1] == '2'
+    assert cmd.index('-lowres') < cmd.index('-i')
+    assert cmd[cmd.index('-vf') + 1].startswith('crop=80:45:80:45,scale=80:44:')
+    assert engine.crop_info == (320, 180, 320, 180)
+    assert engine.decode_flags == []
+    context.metrics.incr.assert_any_call('video.decode.lowres')
+
+    file_info = ffprobe(result)
+    assert (file_info['width'], file_info['height']) == (80, 44)
+
+
+def test_fast_decode_flags(context, mp4_buffer, load_engine):
+    # hotdog.mp4 is 200x150
+    engine = load_engine(mp4_buffer, '.mp4', 'mp4', resize=(50, 38))
+    assert engine.fast_decode_flags() == ['-skip_loop_filter', 'all', '-flags2', 'fast']
+    engine = load_engine(mp4_buffer, '.mp4', 'mp4', crop=(0, 0, 100, 75), resize=(50, 38))
+    assert engine.fast_decode_flags() == []
+    assert load_engine(mp4_buffer, '.mp4', 'mp4').fast_decode_flags() == []
+
+    context.config.FFMPEG_FAST_DECODE_RATIO = 0
+    engine = load_engine(mp4_buffer, '.mp4', 'mp4', resize=(50, 38))
+    assert engine.fast_decode_flags() == []
+
+
+def test_transcode_decodes_fast(mocker, load_engine, mp4_buffer):
+    engine = load_engine(mp4_buffer, '.mp4', 'mp4', resize=(50, 38))
+    run_spy = mocker.spy(engine, 'run_cmd')
+
+    engine.read('.mp4', quality=80)
+
+    cmd = run_spy.mock_calls[0][1][0]
+    assert cmd.index('-skip_loop_filter') < cmd.index('-i')
+    assert cmd[cmd.index('-flags2') + 1] == 'fast'
+    assert engine.decode_flags == []
+
+
+def test_keyframe_flags(context, keyframe_videos, load_engine):
+    # a keyframe every second
+    engine = load_engine(keyframe_videos['mp4'], '.mp4', 'mp4', resize=(80, 60))
+    assert engine.keyframe_flags(1) == ['-skip_frame', 'nokey']
+    assert engine.keyframe_flags(Fraction(1, 2)) == ['-skip_frame', 'nokey']
+    assert engine.keyframe_flags(2) == []
+
+    engine.decoding_intermediate = True
+    assert engine.keyframe_flags(1) == []
+
+    context.config.FFMPEG_GIF_KEYFRAMES_ONLY = False
+    engine = load_engine(keyframe_videos['mp4'], '.mp4', 'mp4', resize=(80, 60))
+    assert engine.keyframe_flags(1) == []
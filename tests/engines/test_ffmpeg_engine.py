@@ -1,7 +1,12 @@
+import asyncio
+from io import BytesIO
+
+from PIL import Image
 import pytest
 
 from tornado.httpclient import HTTPClientError
 from thumbor_video_engine.exceptions import FFmpegError
+import thumbor_video_engine.engines.ffmpeg as ffmpeg_module
 from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
 
 
@@ -66,7 +71,6 @@ def test_invalid_output_format(context, mp4_buffer):
 
 
 def test_gifsicle_optimize_missing_binary_raises_clear_error(monkeypatch, context):
-    import thumbor_video_engine.engines.ffmpeg as ffmpeg_module
 
     monkeypatch.setattr(ffmpeg_module, 'which', lambda *a, **k: None)
     context.server.gifsicle_path = None
@@ -76,3 +80,254 @@ def test_gifsicle_optimize_missing_binary_raises_clear_error(monkeypatch, contex
     with pytest.raises(FFmpegError) as exc:
         engine._gifsicle_optimize_file('/nonexistent/input.gif')
     assert 'gifsicle' in str(exc.value)
+
+
+@pytest.mark.parametrize('filename,ext,expected', [
+    ('hotdog.mp4', '.mp4', True),
+    ('hotdog.webm', '.webm', True),
+    # moov box after mdat: ffmpeg needs to seek, so a temp file is used
+    ('hotdog.mov', '.mov', False),
+])
+def test_make_src_file_pipe_input(context, storage_path, filename, ext, expected):
+
+    with open("%s/%s" % (storage_path, filename), mode='rb') as f:
+        buf = f.read()
+    engine = FFmpegEngine(context)
+    engine.load(buf, ext)
+    with engine.make_src_file(ext) as src_file:
+        assert (src_file == ffmpeg_module.PIPE_INPUT) is expected
+
+
+def test_make_src_file_pipe_input_disabled(context, mp4_buffer):
+    context.config.FFMPEG_PIPE_INPUT = False
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    with engine.make_src_file('.mp4') as src_file:
+        assert src_file.endswith('.mp4')
+
+
+@pytest.mark.parametrize('version,expected', [
+    ((6, 0), False),
+    ((7, 0), True),
+    (None, False),
+])
+def test_make_src_file_pipe_input_gif_version(
+        monkeypatch, context, storage_path, version, expected):
+
+    monkeypatch.setattr(ffmpeg_module, 'ffmpeg_version', lambda path: version)
+    with open("%s/hotdog.gif" % storage_path, mode='rb') as f:
+        buf = f.read()
+    engine = FFmpegEngine(context)
+    engine.load(buf, '.gif')
+    with engine.make_src_file('.gif') as src_file:
+        assert (src_file == ffmpeg_module.PIPE_INPUT) is expected
+
+
+def test_run_cmd_feeds_pipe_input(context, mp4_buffer):
+    engine = FFmpegEngine(context)
+    engine.buffer = mp4_buffer
+    # sh -c takes 'pipe:0' as $0, so cat reads stdin
+    assert engine.run_cmd(['sh', '-c', 'cat', 'pipe:0']) == mp4_buffer
+    assert engine.run_cmd(['echo', 'hi']) == b'hi\n'
+
+
+@pytest.mark.parametrize('out_format,flags,expected', [
+    ('gif', [], True),
+    ('webp', ['-f', 'webp'], True),
+    ('webm', ['-f', 'webm'], False),
+    ('mp4', ['-movflags', 'faststart', '-f', 'mp4'], False),
+    ('mp4', ['-movflags', 'frag_keyframe+empty_moov', '-f', 'mp4'], True),
+    ('png', [], False),
+])
+def test_can_pipe_output(context, out_format, flags, expected):
+    engine = FFmpegEngine(context)
+    assert engine.can_pipe_output(out_format, flags) is expected
+
+
+@pytest.mark.parametrize('filename,ext', [
+    ('hotdog.mp4', '.mp4'),
+    ('hotdog.mov', '.mov'),
+])
+def test_load_mp4_without_ffprobe(mocker, context, storage_path, filename, ext):
+
+    mocker.spy(FFmpegEngine, 'run_ffprobe')
+    with open("%s/%s" % (storage_path, filename), mode='rb') as f:
+        buf = f.read()
+    engine = FFmpegEngine(context)
+    engine.load(buf, ext)
+    assert engine.original_size == (200, 150)
+    assert str(engine.duration) == '1.260001'
+    assert engine.source_frame_rate == '333333/10000'
+    assert FFmpegEngine.run_ffprobe.call_count == 0
+
+
+def test_load_webm_without_ffprobe(mocker, context, webm_buffer):
+
+    mocker.spy(FFmpegEngine, 'run_ffprobe')
+    engine = FFmpegEngine(context)
+    engine.load(webm_buffer, '.webm')
+    assert engine.original_size == (200, 150)
+    assert str(engine.duration) == '1.260000'
+    assert engine.source_frame_rate == '100/3'
+    assert FFmpegEngine.run_ffprobe.call_count == 0
+
+
+def test_load_mp4_falls_back_to_ffprobe(mocker, context, storage_path):
+
+    mocker.spy(FFmpegEngine, 'run_ffprobe')
+    with open("%s/tearing-me-apart.m4a" % storage_path, mode='rb') as f:
+        buf = f.read()
+    engine = FFmpegEngine(context)
+    with pytest.raises(FFmpegError):
+        engine.load(buf, '.mp4')
+    assert FFmpegEngine.run_ffprobe.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_read_async_result_is_read(mocker, context, mp4_buffer):
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    mocker.patch.object(engine, 'transcode', return_value=b'transcoded')
+    await engine.read_async('.mp4')
+    assert engine.read('.mp4', quality=80) == b'transcoded'
+    assert engine.read('.mp4') == mp4_buffer
+    assert engine.transcode.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_read_async_error_is_raised_by_read(context, storage_path):
+    with open("%s/corrupt.mp4" % storage_path, mode='rb') as f:
+        buf = f.read()
+    engine = FFmpegEngine(context)
+    engine.buffer = buf
+    engine.extension = '.mp4'
+    engine.original_size = (200, 150)
+    await engine.read_async('.mp4')
+    with pytest.raises(FFmpegError):
+        engine.read('.mp4', quality=80)
+
+
+@pytest.mark.asyncio
+async def test_read_async_runs_processes_on_loop(mocker, context):
+
+    engine = FFmpegEngine(context)
+    engine.buffer = b''
+    mocker.patch.object(
+        engine, 'transcode', side_effect=lambda ext: engine.run_cmd(['echo', 'hi']))
+    mocker.spy(ffmpeg_module.process, 'run_sync')
+    await engine.read_async('.mp4')
+    assert engine.read('.mp4', quality=80) == b'hi\n'
+    assert ffmpeg_module.process.run_sync.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_read_async_cancel_kills_processes(mocker, context):
+    engine = FFmpegEngine(context)
+    engine.buffer = b''
+    errors = []
+
+    def transcode(extension):
+        try:
+            engine.run_cmd(['sleep', '30'])
+        except BaseException as e:
+            errors.append(e)
+            raise
+
+    mocker.patch.object(engine, 'transcode', side_effect=transcode)
+    task = asyncio.ensure_future(engine.read_async('.mp4'))
+    await asyncio.sleep(0.3)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # the transcode thread is unblocked once its sleep process is killed
+    for _ in range(50):
+        if errors:
+            break
+        await asyncio.sleep(0.1)
+    assert len(errors) == 1
+    assert engine.pending_processes == set()
+    with pytest.raises(asyncio.CancelledError):
+        engine.run_cmd(['echo', 'hi'])
+
+
+@pytest.mark.asyncio
+async def test_transcode_does_not_block_ioloop(mocker, http_client, base_url):
+    orig_transcode = FFmpegEngine.transcode
+
+    def slow_transcode(self, extension):
+        self.run_cmd(['sleep', '1'])
+        return orig_transcode(self, extension)
+
+    mocker.patch.object(FFmpegEngine, 'transcode', slow_transcode)
+    mocker.spy(FFmpegEngine, 'read_async')
+    finished = []
+
+    async def fetch(path):
+        response = await http_client.fetch("%s/unsafe/%s" % (base_url, path))
+        finished.append(path)
+        return response
+
+    video, image = await asyncio.gather(
+        fetch('hotdog.mp4'), fetch('100x75/hotdog.png'))
+    assert video.headers.get('content-type') == 'video/mp4'
+    assert image.headers.get('content-type') == 'image/png'
+    assert finished == ['100x75/hotdog.png', 'hotdog.mp4']
+    assert FFmpegEngine.read_async.call_count == 1
+
+
+@pytest.mark.parametrize('src', ['hotdog.gif', 'hotdog.mp4'])
+def test_gif_single_pass_matches_two_pass(context, storage_path, src):
+    context.request.format = 'gif'
+    with open("%s/%s" % (storage_path, src), mode='rb') as f:
+        buf = f.read()
+
+    def transcode(single_pass):
+        context.config.FFMPEG_GIF_PALETTE_SINGLE_PASS = single_pass
+        engine = FFmpegEngine(context)
+        engine.load(buf, '.%s' % src.rpartition('.')[2])
+        engine.resize(100, 75)
+        return engine.read('.gif', quality=80)
+
+    assert transcode(True) == transcode(False)
+
+
+def test_webp_frames_streamed_to_stdin(mocker, context, storage_path):
+    context.request.format = 'gif'
+    with open("%s/hotdog-variable-frame-durations.webp" % storage_path, mode='rb') as f:
+        buf = f.read()
+    engine = FFmpegEngine(context)
+    engine.load(buf, '.webp')
+    assert engine.frame_durations[:2] == [120, 30]
+    tmp_file_spy = mocker.spy(ffmpeg_module, 'named_tmp_file')
+    tmp_dir_spy = mocker.spy(ffmpeg_module, 'make_tmp_dir')
+
+    with engine.make_src_file('.webp') as src_file:
+        assert src_file == 'pipe:0'
+    assert engine._input_flags(src_file) == ['-f', 'matroska']
+    gif = engine.read('.gif', quality=80)
+
+    assert tmp_file_spy.call_count == tmp_dir_spy.call_count == 0
+    im = Image.open(BytesIO(gif))
+    assert im.n_frames == len(engine.frame_durations)
+    assert im.info['duration'] == 120
+
+
+@pytest.mark.parametrize('durations,rate', [
+    ([40, 40], ['-r', '1/0.04']),
+    ([40, 30], []),
+    ([0, 0], []),
+])
+def test_streamed_frames_rate(mocker, context, storage_path, durations, rate):
+    with open("%s/hotdog-variable-frame-durations.webp" % storage_path, mode='rb') as f:
+        buf = f.read()
+    engine = FFmpegEngine(context)
+    engine.load(buf, '.webp')
+    engine.frame_durations = durations
+    run_spy = mocker.patch.object(engine, 'run_cmd', return_value=b'')
+    mocker.patch.object(engine, 'read_out_file')
+    flags = ['-an', '-f', 'webm']
+    engine.run_ffmpeg('pipe:0', 'webm', flags)
+
+    command = run_spy.call_args[0][0]
+    assert command[command.index('-i') + 2:-2] == flags + rate
+    assert flags == ['-an', '-f', 'webm']
@@ -117,10 +117,10 @@ async def test_filter_rotate(mocker, http_client, base_url):
     cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
 
     assert '-vf' in cmd
-    assert cmd[cmd.index('-vf') + 1] == 'rotate=90'
+    assert cmd[cmd.index('-vf') + 1] == 'transpose=cclock'
 
     file_info = ffprobe(response.body)
-    assert (file_info['width'], file_info['height']) == (200, 150)
+    assert (file_info['width'], file_info['height']) == (150, 200)
 
 
 @pytest.mark.asyncio
@@ -136,3 +136,60 @@ async def test_reorientate(mocker, config, http_client, base_url):
     assert response.headers.get('content-type') == 'video/mp4'
 
     FFmpegEngine.reorientate.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_crop_before_flip(mocker, http_client, base_url):
+    mocker.spy(FFmpegEngine, 'run_cmd')
+
+    response = await http_client.fetch("%s/unsafe/0x0:100x150/-100x150/hotdog.mp4" % base_url)
+
+    assert response.code == 200
+    cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
+    assert cmd[cmd.index('-vf') + 1] == 'crop=100:150:0:0,hflip'
+
+
+def test_orientations_are_composed(load_engine, mp4_buffer):
+    engine = load_engine(mp4_buffer)
+    engine.flip_horizontally()
+    engine.flip_vertically()
+    assert engine.ffmpeg_vfilters == ['hflip', 'vflip']
+
+    engine.rotate(180)
+    assert engine.ffmpeg_vfilters == []
+
+    engine.flip_horizontally()
+    engine.rotate(90)
+    assert engine.ffmpeg_vfilters == ['transpose=cclock_flip']
+    assert engine.size == (150, 200)
+
+
+def test_rotate_ignores_arbitrary_angles(load_engine, mp4_buffer):
+    engine = load_engine(mp4_buffer)
+    engine.rotate(45)
+    assert engine.ffmpeg_vfilters == []
+    assert engine.size == (200, 150)
+
+
+def test_noop_crop_and_scale_are_dropped(load_engine, mp4_buffer):
+    engine = load_engine(mp4_buffer)
+    engine.crop(0, 0, 200, 150)
+    engine.resize(200, 150)
+    assert engine.ffmpeg_vfilters == []
+
+
+def test_pixel_filters_on_smaller_side_of_scale(load_engine, mp4_buffer):
+    engine = load_engine(mp4_buffer)
+    engine.crop(0, 0, 100, 150)
+    engine.resize(50, 75)
+    engine.convert_to_grayscale()
+    engine.rotate(270)
+    assert engine.ffmpeg_vfilters == [
+        'crop=100:150:0:0', 'scale=50:75:flags=lanczos', 'hue=s=0', 'transpose=clock']
+
+    engine = load_engine(mp4_buffer)
+    engine.resize(400, 300)
+    engine.convert_to_grayscale()
+    engine.rotate(90)
+    assert engine.ffmpeg_vfilters == [
+        'hue=s=0', 'transpose=cclock', 'scale=300:400:flags=lanczos']
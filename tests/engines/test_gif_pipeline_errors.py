@@ -8,13 +8,13 @@ from fractions import Fraction
 
 import pytest
 
-import thumbor_video_engine.engines.ffmpeg as ffmpeg_module
 from thumbor_video_engine.engines.ffmpeg import (
     Engine as FFmpegEngine,
     DEFAULT_VIDEO_GIF_FPS,
     MAX_VIDEO_GIF_FPS,
 )
 from thumbor_video_engine.exceptions import FFmpegError
+import thumbor_video_engine.source_info as source_info_module
 from thumbor_video_engine.utils import GifParseError
 
 
@@ -89,10 +89,7 @@ def test_gifsicle_invalid_output_raises(context, mocker):
 
     def fake_run(command):
         # gifsicle "succeeds" but writes something that isn't a gif
-        out_file = command[command.index("-o") + 1]
-        with open(out_file, "wb") as f:
-            f.write(b"definitely not a gif")
-        return b""
+        return b"definitely not a gif"
 
     mocker.patch.object(engine, "run_cmd", side_effect=fake_run)
     with pytest.raises(FFmpegError, match="invalid output"):
@@ -127,7 +124,7 @@ def test_load_falls_back_to_pil_when_parse_gif_raises(context, mocker, storage_p
     # the GifParseError, leave gif_info None, and let probe() fall back to PIL's
     # frame iteration (which still yields size and duration)
     mocker.patch.object(
-        ffmpeg_module, "parse_gif", side_effect=GifParseError("unparseable")
+        source_info_module, "parse_gif", side_effect=GifParseError("unparseable")
     )
     with open(os.path.join(storage_path, "hotdog.gif"), mode="rb") as f:
         buf = f.read()
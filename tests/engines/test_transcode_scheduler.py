@@ -0,0 +1,186 @@
+import asyncio
+import threading
+
+import pytest
+from tornado.httpclient import HTTPClientError
+
+import thumbor_video_engine.engines.ffmpeg as ffmpeg_module
+from thumbor_video_engine.engines.ffmpeg import (
+    Engine as FFmpegEngine, TranscodeScheduler)
+from thumbor_video_engine.exceptions import FFmpegQueueTimeout
+
+
+@pytest.fixture
+def config(config):
+    config.FFMPEG_MAX_CONCURRENT_JOBS = 1
+    config.FFMPEG_QUEUE_TIMEOUT = 0.1
+    return config
+
+
+@pytest.fixture(autouse=True)
+def schedulers(monkeypatch):
+    monkeypatch.setattr(ffmpeg_module, '_schedulers', {})
+
+
+def test_weights_fill_capacity():
+    scheduler = TranscodeScheduler(4)
+    jobs = [scheduler.acquire(2), scheduler.acquire(1), scheduler.acquire(1)]
+    assert (scheduler.running_jobs, scheduler.running_weight) == (3, 4)
+    with pytest.raises(FFmpegQueueTimeout):
+        scheduler.acquire(1, timeout=0.01)
+    assert scheduler.queue_depth == 0
+    scheduler.release(jobs[1])
+    assert scheduler.acquire(1, timeout=0.01)
+
+
+def test_heavy_job_runs_alone():
+    scheduler = TranscodeScheduler(2)
+    job = scheduler.acquire(4, timeout=0.01)
+    with pytest.raises(FFmpegQueueTimeout):
+        scheduler.acquire(1, timeout=0.01)
+    scheduler.release(job)
+    assert (scheduler.running_jobs, scheduler.running_weight) == (0, 0)
+
+
+def test_waiters_admitted_in_order():
+    scheduler = TranscodeScheduler(2)
+    running = scheduler.acquire(2)
+    admitted = []
+    jobs = []
+
+    def wait(name, weight):
+        jobs.append(scheduler.acquire(weight, timeout=5))
+        admitted.append(name)
+
+    threads = []
+    for name, weight in [('heavy', 2), ('light', 1)]:
+        thread = threading.Thread(target=wait, args=(name, weight))
+        thread.start()
+        threads.append(thread)
+        while scheduler.queue_depth < len(threads):
+            pass
+    # the light job fits after the heavy one, but does not jump the queue
+    scheduler.release(running)
+    threads[0].join(5)
+    assert admitted == ['heavy']
+    assert scheduler.queue_depth == 1
+    scheduler.release(jobs[0])
+    threads[1].join(5)
+    assert admitted == ['heavy', 'light']
+
+
+@pytest.mark.asyncio
+async def test_acquire_async_woken_by_release():
+    scheduler = TranscodeScheduler(1)
+    running = scheduler.acquire(1)
+    task = asyncio.ensure_future(scheduler.acquire_async(1, timeout=5))
+    await asyncio.sleep(0.05)
+    assert scheduler.queue_depth == 1
+    threading.Thread(target=scheduler.release, args=(running,)).start()
+    job = await task
+    assert job.admitted
+    assert scheduler.running_jobs == 1
+
+
+@pytest.mark.asyncio
+async def test_acquire_async_timeout():
+    scheduler = TranscodeScheduler(1)
+    scheduler.acquire(1)
+    with pytest.raises(FFmpegQueueTimeout):
+        await scheduler.acquire_async(1, timeout=0.05)
+    assert scheduler.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_acquire_async_cancel():
+    scheduler = TranscodeScheduler(1)
+    running = scheduler.acquire(1)
+    task = asyncio.ensure_future(scheduler.acquire_async(1))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert scheduler.queue_depth == 0
+    scheduler.release(running)
+    assert scheduler.running_jobs == 0
+
+
+@pytest.mark.asyncio
+async def test_acquire_reports_depth():
+    scheduler = TranscodeScheduler(1)
+    depths = []
+    running = scheduler.acquire(1, report_depth=depths.append)
+    task = asyncio.ensure_future(scheduler.acquire_async(1, 5, depths.append))
+    await asyncio.sleep(0.01)
+    with pytest.raises(FFmpegQueueTimeout):
+        scheduler.acquire(1, timeout=0.01, report_depth=depths.append)
+    scheduler.release(running)
+    scheduler.release(await task)
+    assert depths == [0, 1, 2, 1, 0]
+
+
+def test_transcode_records_queue_depth(mocker, context, mp4_buffer):
+    mocker.spy(context.metrics, 'timing')
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.scheduler.acquire(1)
+    with pytest.raises(FFmpegQueueTimeout):
+        engine.transcode('.mp4')
+    depths = [c[0][1] for c in context.metrics.timing.call_args_list
+              if c[0][0] == 'video.transcode.queue.depth']
+    assert depths == [1, 0]
+
+
+@pytest.mark.parametrize('fmt,pipeline,weight', [
+    ('gif', 'legacy', 1),
+    ('gif', 'gifski', 2),
+    ('h264', 'legacy', 2),
+    ('mp4', 'legacy', 2),
+    ('hevc', 'legacy', 4),
+    ('webm', 'legacy', 4),
+    ('webp', 'legacy', 1),
+])
+def test_job_weight(context, fmt, pipeline, weight):
+    context.config.FFMPEG_GIF_PIPELINE = pipeline
+    context.request.format = fmt
+    assert FFmpegEngine(context).job_weight('.mp4') == weight
+
+
+def test_transcode_holds_slot(mocker, context, mp4_buffer):
+    context.config.FFMPEG_MAX_CONCURRENT_JOBS = 2
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    scheduler = engine.scheduler
+    running = []
+    mocker.patch.object(
+        engine, 'transcode_to_h264',
+        side_effect=lambda src: running.append(scheduler.running_weight))
+    engine.transcode('.mp4')
+    assert running == [2]
+    assert scheduler.running_jobs == 0
+
+
+def test_transcode_queue_timeout(context, mp4_buffer):
+    context.config.FFMPEG_MAX_CONCURRENT_JOBS = 1
+    context.config.FFMPEG_QUEUE_TIMEOUT = 0.01
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.scheduler.acquire(1)
+    with pytest.raises(FFmpegQueueTimeout):
+        engine.transcode('.mp4')
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_returns_503(mocker, config, http_client, base_url):
+    scheduler = ffmpeg_module.transcode_scheduler(1)
+    job = scheduler.acquire(1)
+    try:
+        with pytest.raises(HTTPClientError) as exc_info:
+            await http_client.fetch("%s/unsafe/hotdog.mp4" % base_url)
+    finally:
+        scheduler.release(job)
+    assert exc_info.value.code == 503
+
+    response = await http_client.fetch("%s/unsafe/hotdog.mp4" % base_url)
+    assert response.code == 200
+    assert scheduler.running_jobs == 0
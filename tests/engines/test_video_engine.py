@@ -1,4 +1,7 @@
+import asyncio
 from io import BytesIO
+import threading
+
 import pytest
 
 from thumbor.engines import BaseEngine
@@ -9,6 +12,7 @@ from PIL import Image
 
 from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
 from thumbor_video_engine.engines.video import Engine as VideoEngine
+from thumbor_video_engine.exceptions import FFmpegError
 
 from tests.utils import color_diff, repr_rgb
 
@@ -35,6 +39,59 @@ async def test_dispatch_to_video_engine(mocker, http_client, base_url):
     assert BaseEngine.get_mimetype(response.body) == 'video/mp4'
 
 
+@pytest.fixture
+def file_storage(config, tmp_path):
+    config.STORAGE = 'thumbor.storages.file_storage'
+    config.FILE_STORAGE_ROOT_PATH = str(tmp_path / 'storage')
+    return config
+
+
+@pytest.mark.asyncio
+async def test_source_loaded_off_the_loop(mocker, file_storage, http_client, base_url):
+    threads = []
+    orig_load = FFmpegEngine.load
+
+    def load(self, *args):
+        threads.append(threading.current_thread())
+        return orig_load(self, *args)
+
+    mocker.patch.object(FFmpegEngine, 'load', load)
+    # loaded by the loader, and then from storage
+    for i in range(2):
+        response = await http_client.fetch("%s/unsafe/hotdog.mp4" % base_url)
+        assert response.code == 200
+    assert len(threads) == 2
+    assert threading.current_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_load_async_runs_ffprobe_on_the_loop(mocker, context, mp4_buffer):
+    mocker.patch.object(FFmpegEngine, 'probe_headers', return_value=None)
+    threads = []
+    orig_exec = asyncio.create_subprocess_exec
+
+    async def create_subprocess_exec(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return await orig_exec(*args, **kwargs)
+
+    mocker.patch.object(asyncio, 'create_subprocess_exec', create_subprocess_exec)
+    video_engine = VideoEngine(context)
+    await video_engine.load_async(mp4_buffer, '.mp4')
+    video_engine.load(mp4_buffer, '.mp4')
+    assert video_engine.size == (200, 150)
+    assert threads == [threading.current_thread()]
+
+
+@pytest.mark.asyncio
+async def test_load_async_error_raised_by_load(context, mp4_buffer):
+    # an mp4 that ffprobe cannot read
+    buffer = mp4_buffer[:64]
+    video_engine = VideoEngine(context)
+    await video_engine.load_async(buffer, '.mp4')
+    with pytest.raises(FFmpegError):
+        video_engine.load(buffer, '.mp4')
+
+
 @pytest.mark.asyncio
 async def test_dispatch_to_image_engine(mocker, http_client, base_url):
     mocker.spy(PilEngine, 'load')
@@ -0,0 +1,119 @@
+from fractions import Fraction
+from io import BytesIO
+import os
+
+import pytest
+from PIL import Image
+
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.ffprobe import ffprobe
+from thumbor_video_engine.utils import parse_gif
+
+
+@pytest.fixture
+def config(config):
+    config.FILTERS = [
+        'thumbor_video_engine.filters.format',
+        'thumbor_video_engine.filters.fps',
+    ]
+    return config
+
+
+@pytest.mark.asyncio
+async def test_fps_filter(mocker, http_client, base_url):
+    mocker.spy(FFmpegEngine, 'run_cmd')
+
+    response = await http_client.fetch(
+        "%s/unsafe/100x75/filters:fps(10)/hotdog.mp4" % base_url)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'video/mp4'
+
+    cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
+    assert cmd[cmd.index('-vf') + 1] == 'fps=10:eof_action=pass,scale=100:74:flags=lanczos'
+
+    file_info = ffprobe(response.body)
+    assert Fraction(file_info['avg_frame_rate']) == 10
+
+
+@pytest.mark.asyncio
+async def test_fps_filter_does_not_raise_frame_rate(mocker, http_client, base_url):
+    mocker.spy(FFmpegEngine, 'run_cmd')
+
+    # hotdog.mp4 is 33.3fps
+    response = await http_client.fetch("%s/unsafe/filters:fps(60)/hotdog.mp4" % base_url)
+
+    assert response.code == 200
+    cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
+    assert '-vf' not in cmd
+
+
+@pytest.mark.asyncio
+async def test_fps_filter_gif(http_client, base_url):
+    response = await http_client.fetch(
+        "%s/unsafe/filters:fps(12.5):format(gif)/hotdog.gif" % base_url)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'image/gif'
+    assert set(parse_gif(response.body).effective_delays_cs()) == {8}
+
+
+@pytest.mark.asyncio
+async def test_fps_filter_does_not_raise_webp_frame_rate(mocker, http_client, base_url):
+    mocker.spy(FFmpegEngine, 'run_cmd')
+
+    # hotdog.webp is 33.3fps
+    response = await http_client.fetch(
+        "%s/unsafe/filters:fps(100):format(h264)/hotdog.webp" % base_url)
+
+    assert response.code == 200
+    cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
+    assert '-vf' not in cmd or 'fps=' not in cmd[cmd.index('-vf') + 1]
+    file_info = ffprobe(response.body)
+    assert int(file_info['nb_frames']) == 42
+
+
+@pytest.mark.parametrize('name,fps,expected', [
+    ('hotdog.webp', Fraction(100), None),
+    ('hotdog.webp', Fraction(10), Fraction(10)),
+    # 35 frames over 1.26 seconds
+    ('hotdog-variable-frame-durations.webp', Fraction(30), None),
+    ('hotdog-variable-frame-durations.webp', Fraction(25), Fraction(25)),
+])
+def test_requested_fps_webp(context, storage_path, name, fps, expected):
+    context.request.fps = fps
+    engine = FFmpegEngine(context)
+    with open(os.path.join(storage_path, name), mode='rb') as f:
+        engine.load(f.read(), '.webp')
+    assert engine.requested_fps() == expected
+
+
+def test_requested_fps_variable_delay_gif(context):
+    buf = BytesIO()
+    frames = [Image.new('RGB', (16, 16), color) for color in ('red', 'green', 'blue', 'white')]
+    frames[0].save(
+        buf, 'GIF', save_all=True, append_images=frames[1:], duration=[300, 100, 500, 100])
+    engine = FFmpegEngine(context)
+
+    # 4 frames in 1 second
+    context.request.fps = Fraction(5)
+    engine.load(buf.getvalue(), '.gif')
+    assert engine.requested_fps() is None
+    context.request.fps = Fraction(2)
+    assert engine.requested_fps() == 2
+
+
+def test_gif_made_from_keyframes(mocker, context, keyframe_videos):
+    # a keyframe every second
+    context.request.format = 'gif'
+    context.request.fps = Fraction(1)
+    engine = FFmpegEngine(context)
+    engine.load(keyframe_videos['mp4'], '.mp4')
+    run_spy = mocker.spy(engine, 'run_cmd')
+
+    result = engine.read('.gif', quality=80)
+
+    cmd = run_spy.mock_calls[0][1][0]
+    assert cmd[cmd.index('-skip_frame') + 1] == 'nokey'
+    assert cmd.index('-skip_frame') < cmd.index('-i')
+    assert parse_gif(result).frame_count == 6
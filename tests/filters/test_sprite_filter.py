@@ -0,0 +1,130 @@
+from io import BytesIO
+import json
+from subprocess import run
+
+import pytest
+
+from PIL import Image, ImageStat
+
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+
+
+@pytest.fixture
+def config(config):
+    config.FILTERS = [
+        'thumbor_video_engine.filters.format',
+        'thumbor_video_engine.filters.sprite',
+    ]
+    return config
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('format,mime_type', [
+    (None, 'image/jpeg'),
+    ('webp', 'image/webp'),
+    ('png', 'image/png'),
+])
+async def test_sprite_filter(mocker, http_client, base_url, format, mime_type):
+    run_spy = mocker.spy(FFmpegEngine, 'run_cmd')
+    filters = 'sprite(3,2)' + (':format(%s)' % format if format else '')
+    response = await http_client.fetch(
+        "%s/unsafe/40x30/filters:%s/hotdog.mp4" % (base_url, filters))
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == mime_type
+    assert Image.open(BytesIO(response.body)).size == (120, 60)
+    # one decode of the video for every tile
+    assert run_spy.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_sprite_filter_meta(http_client, base_url):
+    response = await http_client.fetch(
+        "%s/unsafe/meta/40x30/filters:sprite(3,2)/hotdog.mp4" % base_url)
+
+    assert response.code == 200
+    operations = json.loads(response.body)['thumbor']['operations']
+    sprite_map = next(op for op in operations if op['type'] == 'sprite')
+    assert sprite_map['width'] == 120
+    assert sprite_map['height'] == 60
+    assert sprite_map['interval'] == pytest.approx(0.21)
+    assert sprite_map['frames'][:2] == [
+        {'time': 0.0, 'x': 0, 'y': 0},
+        {'time': pytest.approx(0.21), 'x': 40, 'y': 0},
+    ]
+    assert sprite_map['frames'][-1] == {'time': pytest.approx(1.05), 'x': 80, 'y': 30}
+
+
+@pytest.mark.asyncio
+async def test_sprite_filter_ignored_for_images(http_client, base_url, storage_path):
+    response = await http_client.fetch(
+        "%s/unsafe/filters:sprite(3,2)/hotdog.png" % base_url)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'image/png'
+    with open('%s/hotdog.png' % storage_path, mode='rb') as f:
+        assert Image.open(BytesIO(response.body)).size == Image.open(f).size
+
+
+@pytest.mark.asyncio
+async def test_sprite_filter_ignored_for_video_formats(http_client, base_url):
+    response = await http_client.fetch(
+        "%s/unsafe/filters:sprite(3,2):format(webm)/hotdog.mp4" % base_url)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'video/webm'
+
+
+def test_sprite_map_leaves_out_tiles_past_the_end(context, mp4_buffer):
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.resize(40, 30)
+    sprite_map = engine.sprite_map(4, 4, 0.5)
+    assert [frame['time'] for frame in sprite_map['frames']] == [0, 0.5, 1.0]
+
+    context.request.format = 'png'
+    context.request.sprite = (4, 4, 0.5)
+    im = Image.open(BytesIO(engine.read('.png', quality=80))).convert('RGB')
+    assert im.size == (160, 120)
+    # three frames, then black tiles
+    assert all(im.crop((x, 0, x + 40, 30)).getbbox() for x in (0, 40, 80))
+    assert im.crop((120, 0, 160, 120)).getbbox() is None
+    assert im.crop((0, 30, 160, 120)).getbbox() is None
+
+
+@pytest.mark.parametrize('sprite,times,end', [
+    ((2, 1, 2), [0, 2], '4.000000'),
+    # spread over the whole video
+    ((3, 2, 0), [0, 1, 2, 3, 4, 5], None),
+])
+def test_sprite_tiles_match_map(mocker, context, ffmpeg_path, tmp_path, sprite, times, end):
+    # six seconds at 4fps, each frame 10 levels brighter than the last
+    path = str(tmp_path / 'ramp.mp4')
+    run([
+        ffmpeg_path, '-v', 'error', '-f', 'lavfi',
+        '-i', "color=s=160x120:r=4:d=6,format=gray,geq=lum='N*10'",
+        '-c:v', 'libx264', '-qp', '0', '-pix_fmt', 'yuv444p', '-movflags', 'faststart',
+        path], check=True)
+    with open(path, mode='rb') as f:
+        buf = f.read()
+    context.request.format = 'png'
+    context.request.sprite = sprite
+    engine = FFmpegEngine(context)
+    engine.load(buf, '.mp4')
+    engine.resize(80, 60)
+    run_spy = mocker.spy(engine, 'run_cmd')
+    im = Image.open(BytesIO(engine.read('.png', quality=80))).convert('L')
+
+    cmd = run_spy.call_args[0][0]
+    if end:
+        # the video is only decoded up to the last tile
+        assert cmd[cmd.index('-t') + 1] == end
+        assert cmd.index('-t') < cmd.index('-i')
+    else:
+        assert '-t' not in cmd
+
+    frames = engine.sprite_map(*sprite)['frames']
+    assert [frame['time'] for frame in frames] == times
+    for frame in frames:
+        tile = im.crop((frame['x'], frame['y'], frame['x'] + 80, frame['y'] + 60))
+        assert ImageStat.Stat(tile).mean[0] == pytest.approx(frame['time'] * 4 * 10, abs=3)
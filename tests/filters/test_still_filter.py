@@ -1,9 +1,16 @@
+from fractions import Fraction
 from io import BytesIO
+from subprocess import run
 
 import pytest
 
 from thumbor.engines import BaseEngine
-from PIL import Image
+from PIL import Image, ImageChops, ImageStat
+
+from thumbor_video_engine.capabilities import Capabilities
+from thumbor_video_engine.engines.ffmpeg import (
+    Engine as FFmpegEngine, avif_crf, mjpeg_qscale, still_position_seconds)
+import thumbor_video_engine.source_info as source_info_module
 
 
 @pytest.fixture
@@ -12,6 +19,7 @@ def config(config):
         'thumbor_video_engine.filters.format',
         'thumbor_video_engine.filters.still',
         'thumbor.filters.watermark',
+        'thumbor.filters.grayscale',
     ]
     config.QUALITY = 95
     return config
@@ -54,3 +62,131 @@ async def test_still_filter_with_watermark(http_client, base_url):
     im = Image.open(BytesIO(response.body))
     assert im.getpixel((85, 55))[:3] == (255, 255, 255)
     assert response.headers.get('content-type') == 'image/png'
+
+
+def reference_frame(buf, position):
+    # seeking on the output decodes every frame up to the position
+    result = run([
+        'ffmpeg', '-v', 'error', '-i', 'pipe:0', '-ss', position, '-frames:v', '1',
+        '-f', 'image2pipe', '-c:v', 'png', 'pipe:1',
+    ], input=buf, capture_output=True, check=True)
+    return Image.open(BytesIO(result.stdout)).convert('RGB')
+
+
+@pytest.mark.parametrize('position,seconds', [
+    ('0', 0),
+    ('2.5', Fraction(5, 2)),
+    ('01:05.25', Fraction(261, 4)),
+    ('01:00:01', 3601),
+    ('-3', -3),
+])
+def test_still_position_seconds(position, seconds):
+    assert still_position_seconds(position) == seconds
+
+
+@pytest.mark.parametrize('ext', ['mp4', 'webm'])
+@pytest.mark.parametrize('position', ['0', '2.5', '2.99', '00:00:03', '4.01', '5.9'])
+def test_still_frame_matches_full_decode(context, keyframe_videos, ext, position):
+    buf = keyframe_videos[ext]
+    engine = FFmpegEngine(context)
+    im = Image.open(BytesIO(engine.still_frame(buf, '.%s' % ext, position)))
+    assert ImageChops.difference(
+        im.convert('RGB'), reference_frame(buf, position)).getbbox() is None
+
+
+@pytest.mark.parametrize('position,exact', [('2.5', False), ('00:00:03', True)])
+def test_still_frame_seeks_on_input(mocker, context, keyframe_videos, position, exact):
+    engine = FFmpegEngine(context)
+    run_spy = mocker.spy(engine, 'run_cmd')
+    engine.still_frame(keyframe_videos['mp4'], '.mp4', position)
+
+    command = run_spy.call_args[0][0]
+    assert command.index('-ss') < command.index('-i')
+    assert ('-noaccurate_seek' in command) is exact
+
+
+def test_still_frame_streams_webm_range(mocker, context, keyframe_videos):
+    buf = keyframe_videos['webm']
+    engine = FFmpegEngine(context)
+    stdin_spy = mocker.spy(engine, '_stdin_data')
+    engine.still_frame(buf, '.webm', '2.5')
+
+    # the headers, and the clusters of the keyframes at 2s and 3s
+    stdin_size = sum(len(chunk) for chunk in stdin_spy.spy_return)
+    assert stdin_size < len(buf) / 2
+
+
+def test_keyframe_index_cached(mocker, context, keyframe_videos):
+    keyframes_spy = mocker.spy(source_info_module, 'mp4_keyframes')
+    for _ in range(2):
+        FFmpegEngine(context).still_frame(keyframe_videos['mp4'], '.mp4', '2.5')
+    assert keyframes_spy.call_count == 1
+
+
+@pytest.mark.parametrize('quality,qscale', [(95, 1), (85, 2), (75, 3), (50, 7), (10, 31)])
+def test_mjpeg_qscale(quality, qscale):
+    assert mjpeg_qscale(quality) == qscale
+
+
+@pytest.mark.parametrize('quality,crf', [(100, 0), (80, 13), (50, 32), (1, 62)])
+def test_avif_crf(quality, crf):
+    assert avif_crf(quality) == crf
+
+
+@pytest.mark.asyncio
+async def test_avif_still_needs_av1_encoder(monkeypatch, mocker, http_client, base_url):
+    monkeypatch.setattr(Capabilities, 'av1_encoder', None)
+    still_spy = mocker.spy(FFmpegEngine, 'transcode_to_still')
+    response = await http_client.fetch(
+        "%s/unsafe/80x60/filters:still(0.5):format(avif)/hotdog.mp4" % base_url)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'image/avif'
+    assert still_spy.call_count == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('format,mime_type', [
+    ('webp', 'image/webp'),
+    ('jpeg', 'image/jpeg'),
+    ('png', 'image/png'),
+    ('avif', 'image/avif'),
+])
+async def test_still_encoded_by_ffmpeg(mocker, http_client, base_url, format, mime_type):
+    still_spy = mocker.spy(FFmpegEngine, 'transcode_to_still')
+    response = await http_client.fetch(
+        "%s/unsafe/80x60/filters:still(0.5):format(%s)/hotdog.mp4" % (base_url, format))
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == mime_type
+    assert Image.open(BytesIO(response.body)).size == (80, 60)
+    assert still_spy.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_still_with_other_filters_uses_image_engine(mocker, http_client, base_url):
+    still_spy = mocker.spy(FFmpegEngine, 'transcode_to_still')
+    response = await http_client.fetch(
+        "%s/unsafe/filters:still():watermark(watermark.png,0,0,0)/hotdog.mp4" % base_url)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'image/jpeg'
+    assert still_spy.call_count == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('options', ['10x10:110x85/50x38', '-80x60', '60x0/filters:grayscale()'])
+async def test_still_encoded_by_ffmpeg_matches_image_engine(
+        config, http_client, base_url, options):
+    url = "%s/unsafe/%s:still(0.5):format(png)/hotdog.mp4" % (
+        base_url, options if 'filters:' in options else options + '/filters')
+    ims = []
+    for still_direct in (True, False):
+        config.FFMPEG_STILL_DIRECT = still_direct
+        response = await http_client.fetch(url)
+        ims.append(Image.open(BytesIO(response.body)).convert('RGB'))
+
+    assert ims[0].size == ims[1].size
+    # only the resampling differs, between ffmpeg's and PIL's lanczos
+    diff = ImageStat.Stat(ImageChops.difference(*ims)).mean
+    assert max(diff) < 6
@@ -0,0 +1,96 @@
+import pytest
+
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.ffprobe import ffprobe
+from thumbor_video_engine.utils import parse_gif
+
+
+@pytest.fixture
+def config(config):
+    config.FILTERS = [
+        'thumbor_video_engine.filters.format',
+        'thumbor_video_engine.filters.still',
+        'thumbor_video_engine.filters.trim',
+        'thumbor_video_engine.filters.duration',
+    ]
+    return config
+
+
+def input_flags(cmd):
+    return cmd[:cmd.index('-i')]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('filters,flags', [
+    ('trim(0.5,1)', ['-ss', '0.500000', '-t', '0.500000']),
+    ('trim(00:00.5)', ['-ss', '0.500000']),
+    ('duration(0.5)', ['-t', '0.500000']),
+    ('trim(0.25):duration(0.5)', ['-ss', '0.250000', '-t', '0.500000']),
+    ('trim(0.25,1):duration(2)', ['-ss', '0.250000', '-t', '0.750000']),
+])
+async def test_trim_filter(mocker, http_client, base_url, filters, flags):
+    mocker.spy(FFmpegEngine, 'run_cmd')
+
+    response = await http_client.fetch(
+        "%s/unsafe/filters:%s/hotdog.mp4" % (base_url, filters))
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'video/mp4'
+
+    cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
+    assert input_flags(cmd)[-len(flags):] == flags
+
+    # hotdog.mp4 is 1.26 seconds long
+    start = float(flags[flags.index('-ss') + 1]) if '-ss' in flags else 0
+    length = float(flags[flags.index('-t') + 1]) if '-t' in flags else 1.26 - start
+    file_info = ffprobe(response.body)
+    assert float(file_info['duration']) == pytest.approx(length, abs=0.07)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('filters', ['trim(0,5)', 'duration(5)', 'trim(5)', 'still:trim(0.5)'])
+async def test_trim_filter_keeps_whole_video(mocker, http_client, base_url, filters):
+    mocker.spy(FFmpegEngine, 'run_cmd')
+
+    response = await http_client.fetch(
+        "%s/unsafe/filters:%s/hotdog.mp4" % (base_url, filters))
+
+    assert response.code == 200
+    cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
+    assert '-ss' not in input_flags(cmd)
+    assert '-t' not in input_flags(cmd)
+
+
+@pytest.mark.asyncio
+async def test_trim_filter_gif(mocker, http_client, base_url):
+    mocker.spy(FFmpegEngine, 'run_cmd')
+
+    response = await http_client.fetch(
+        "%s/unsafe/filters:trim(0.5,1):format(gif)/hotdog.gif" % base_url)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'image/gif'
+
+    # hotdog.gif has a frame every 3cs: the frames shown from 0.5 to 1
+    # second run from 0.48 to 1.02 seconds
+    cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
+    assert input_flags(cmd)[-2:] == ['-t', '1.020000']
+    assert cmd[cmd.index('-lavfi') + 1].startswith(
+        'trim=start=0.480000,setpts=PTS-STARTPTS,')
+    assert parse_gif(response.body).frame_count == 18
+
+
+@pytest.mark.asyncio
+async def test_trim_filter_webp(mocker, http_client, base_url):
+    mocker.spy(FFmpegEngine, 'run_cmd')
+
+    response = await http_client.fetch(
+        "%s/unsafe/filters:trim(0,0.5):format(h264)/hotdog.webp" % base_url)
+
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'video/mp4'
+
+    cmd = FFmpegEngine.run_cmd.mock_calls[0][1][1]
+    assert input_flags(cmd)[-4:] == ['-f', 'matroska', '-t', '0.500000']
+    # hotdog.webp is 1.26 seconds long
+    assert float(ffprobe(response.body)['duration']) == pytest.approx(0.5, abs=0.07)
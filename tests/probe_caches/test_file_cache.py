@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.probe_caches import source_digest
+from thumbor_video_engine.probe_caches.file import Cache
+
+
+@pytest.fixture
+def config(config, tmp_path):
+    config.FFPROBE_CACHE = 'thumbor_video_engine.probe_caches.file'
+    config.FFPROBE_CACHE_FILE_STORAGE_ROOT_PATH = str(tmp_path)
+    return config
+
+
+def test_put_get(context, tmp_path):
+    cache = Cache(context)
+    cache.put('abcdef', {'width': 200, 'duration': '1.26'})
+    assert (tmp_path / 'ab' / 'cdef.json').exists()
+    assert Cache(context).get('abcdef') == {'width': 200, 'duration': '1.26'}
+
+
+def test_get_missing(context):
+    assert Cache(context).get('abcdef') is None
+
+
+def test_get_invalid_json(context, tmp_path):
+    (tmp_path / 'ab').mkdir()
+    (tmp_path / 'ab' / 'cdef.json').write_text('{not json')
+    assert Cache(context).get('abcdef') is None
+
+
+def test_put_unwritable_root(context, tmp_path):
+    root = tmp_path / 'file'
+    root.write_text('')
+    context.config.FFPROBE_CACHE_FILE_STORAGE_ROOT_PATH = str(root)
+    # a failed write is logged, not raised
+    Cache(context).put('abcdef', {'width': 200})
+    assert Cache(context).get('abcdef') is None
+
+
+def test_lru_eviction(context, tmp_path):
+    # 256 shards x 1 entry each
+    context.config.FFPROBE_CACHE_MAX_ENTRIES = 1
+    cache = Cache(context)
+    cache.put('aa01', {'width': 1})
+    cache.put('aa02', {'width': 2})
+    assert cache.get('aa01') is None
+    assert cache.get('aa02') == {'width': 2}
+    assert os.listdir(str(tmp_path / 'aa')) == ['02.json']
+
+
+def test_lru_eviction_keeps_recently_read(context, tmp_path):
+    context.config.FFPROBE_CACHE_MAX_ENTRIES = 512
+    cache = Cache(context)
+    cache.put('aa01', {'width': 1})
+    cache.put('aa02', {'width': 2})
+    os.utime(str(tmp_path / 'aa' / '01.json'), (1, 1))
+    os.utime(str(tmp_path / 'aa' / '02.json'), (2, 2))
+    # reading 01 makes 02 the least recently used
+    assert cache.get('aa01') == {'width': 1}
+    cache.put('aa03', {'width': 3})
+    assert sorted(os.listdir(str(tmp_path / 'aa'))) == ['01.json', '03.json']
+
+
+def test_engine_probes_source_once(context, mp4_buffer, mocker, tmp_path):
+    mocker.patch.object(FFmpegEngine, 'probe_headers', return_value=None)
+    mocker.spy(FFmpegEngine, 'run_ffprobe')
+
+    for _ in range(2):
+        engine = FFmpegEngine(context)
+        engine.load(mp4_buffer, '.mp4')
+        assert engine.original_size == (200, 150)
+
+    assert FFmpegEngine.run_ffprobe.call_count == 1
+    digest = source_digest(mp4_buffer)
+    assert (tmp_path / digest[:2] / ('%s.json' % digest[2:])).exists()
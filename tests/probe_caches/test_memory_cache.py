@@ -0,0 +1,57 @@
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.probe_caches import source_digest
+from thumbor_video_engine.probe_caches.memory import Cache
+
+
+def test_get_missing(context):
+    assert Cache(context).get('abc') is None
+
+
+def test_put_get(context):
+    Cache(context).put('abc', {'width': 200})
+    assert Cache(context).get('abc') == {'width': 200}
+
+
+def test_get_returns_copy(context):
+    cache = Cache(context)
+    cache.put('abc', {'width': 200})
+    cache.get('abc')['width'] = 1
+    assert cache.get('abc') == {'width': 200}
+
+
+def test_lru_eviction(context):
+    context.config.FFPROBE_CACHE_MAX_ENTRIES = 2
+    cache = Cache(context)
+    cache.put('a', {'width': 1})
+    cache.put('b', {'width': 2})
+    # reading 'a' makes 'b' the least recently used
+    assert cache.get('a') == {'width': 1}
+    cache.put('c', {'width': 3})
+    assert cache.get('b') is None
+    assert cache.get('a') == {'width': 1}
+    assert cache.get('c') == {'width': 3}
+
+
+def test_engine_probes_source_once(context, mp4_buffer, mocker):
+    mocker.patch.object(FFmpegEngine, 'probe_headers', return_value=None)
+    mocker.spy(FFmpegEngine, 'run_ffprobe')
+
+    for _ in range(3):
+        engine = FFmpegEngine(context)
+        engine.load(mp4_buffer, '.mp4')
+        assert engine.original_size == (200, 150)
+
+    assert FFmpegEngine.run_ffprobe.call_count == 1
+    assert Cache(context).get(source_digest(mp4_buffer))['width'] == 200
+
+
+def test_engine_cache_disabled(context, mp4_buffer, mocker):
+    context.config.FFPROBE_CACHE = None
+    mocker.patch.object(FFmpegEngine, 'probe_headers', return_value=None)
+    mocker.spy(FFmpegEngine, 'run_ffprobe')
+
+    for _ in range(2):
+        engine = FFmpegEngine(context)
+        engine.load(mp4_buffer, '.mp4')
+
+    assert FFmpegEngine.run_ffprobe.call_count == 2
@@ -0,0 +1,128 @@
+import pytest
+
+from thumbor.context import ServerParameters
+
+import thumbor_video_engine.app as app_module
+import thumbor_video_engine.capabilities as capabilities_module
+from thumbor_video_engine.capabilities import (
+    Capabilities, get_capabilities, parse_encoders, parse_filters, parse_muxers,
+    probe_ffmpeg)
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+
+
+ENCODERS = """Encoders:
+ V..... = Video
+ A..... = Audio
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ V....D libvpx-vp9           libvpx VP9 (codec vp9)
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+
+MUXERS = """File formats:
+ D. = Demuxing supported
+ .E = Muxing supported
+ --
+  E avif            AVIF
+  E mov,mp4         QuickTime / MOV
+"""
+
+FILTERS = """Filters:
+  T.. = Timeline support
+  | = Source or sink filter
+ ..C acompressor       A->A       Audio compressor.
+ TSC scale             V->V       Scale the input video size.
+ ... testsrc           |->V       Generate test pattern.
+"""
+
+
+@pytest.fixture(autouse=True)
+def reset_ffmpeg_builds(monkeypatch):
+    monkeypatch.setattr(capabilities_module, '_ffmpeg_builds', {})
+
+
+def test_parse_encoders():
+    assert parse_encoders(ENCODERS) == {'libx264', 'libvpx-vp9', 'aac'}
+    assert parse_encoders(None) == set()
+
+
+def test_parse_muxers():
+    assert parse_muxers(MUXERS) == {'avif', 'mov', 'mp4'}
+
+
+def test_parse_filters():
+    assert parse_filters(FILTERS) == {'acompressor', 'scale', 'testsrc'}
+
+
+def test_probe_ffmpeg(mocker, ffmpeg_path):
+    popen_spy = mocker.spy(capabilities_module, 'Popen')
+    build = probe_ffmpeg(ffmpeg_path)
+    assert build.version is not None
+    assert {'libx264', 'libvpx-vp9', 'gif'} <= build.encoders
+    assert {'mp4', 'webm', 'gif'} <= build.muxers
+    assert {'scale', 'crop', 'fps'} <= build.filters
+    assert probe_ffmpeg(ffmpeg_path) is build
+    assert popen_spy.call_count == 4
+
+
+def test_probe_ffmpeg_not_runnable():
+    build = probe_ffmpeg('/nonexistent/ffmpeg')
+    assert build.version is None
+    assert build.encoders == set()
+
+
+def test_capabilities_kept_on_server(mocker, context):
+    capabilities = get_capabilities(context)
+    assert context.server.capabilities is capabilities
+    assert capabilities.ffmpeg_path == context.config.FFMPEG_PATH
+    assert capabilities.ffprobe_path == context.config.FFPROBE_PATH
+    assert capabilities.has_encoder('libx264')
+    assert get_capabilities(context) is capabilities
+
+    # resolved again once the configured paths change
+    context.config.GIFSKI_PATH = '/nonexistent/gifski'
+    capabilities = get_capabilities(context)
+    assert context.server.capabilities is capabilities
+    assert capabilities.gifski_path is None
+
+
+def test_engine_reads_paths_from_capabilities(mocker, context, mp4_buffer):
+    which_spy = mocker.spy(capabilities_module, 'which')
+    get_capabilities(context)
+    call_count = which_spy.call_count
+
+    for _ in range(2):
+        engine = FFmpegEngine(context)
+        engine.load(mp4_buffer, '.mp4')
+        engine._gifski_path()
+    assert which_spy.call_count == call_count
+
+
+def test_server_startup_logs_capabilities(mocker, config):
+    mocker.patch.object(
+        Capabilities, 'has_encoder', lambda self, name: name not in ('libwebp', 'libx265'))
+    logger_spy = mocker.patch.object(capabilities_module, 'logger')
+    server = ServerParameters(None, 'localhost', 'thumbor.conf', None, 'info', None)
+    context = mocker.Mock(config=config, server=server)
+    mocker.patch.object(app_module.thumbor.app.ThumborServiceApp, '__init__')
+
+    app_module.ThumborServiceApp(context)
+
+    assert isinstance(server.capabilities, Capabilities)
+    logger_spy.info.assert_any_call("[FFMPEG] ffmpeg has no h265 encoder (libx265)")
+    logger_spy.warning.assert_called_once_with(
+        "[FFMPEG] ffmpeg has no webp encoder (libwebp)")
+    logger_spy.error.assert_not_called()
+
+
+def test_server_startup_logs_missing_ffmpeg(mocker, config):
+    config.FFMPEG_PATH = '/nonexistent/ffmpeg'
+    logger_spy = mocker.patch.object(capabilities_module, 'logger')
+    server = ServerParameters(None, 'localhost', 'thumbor.conf', None, 'info', None)
+    context = mocker.Mock(config=config, server=server)
+    mocker.patch.object(app_module.thumbor.app.ThumborServiceApp, '__init__')
+
+    app_module.ThumborServiceApp(context)
+
+    logger_spy.error.assert_called_once_with(
+        "[FFMPEG] ffmpeg at /nonexistent/ffmpeg cannot be run; video requests will fail")
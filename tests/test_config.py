@@ -28,7 +28,7 @@ def mock_engine(context, mp4_buffer, mocker):
         suffix = suffix or ''
         yield '/tmp/tempfile%s' % suffix
 
-    mocker.patch.object(thumbor_video_engine.engines.ffmpeg, 'ffprobe',
+    mocker.patch.object(engine, 'run_ffprobe',
         return_value={'width': 200, 'height': 150, 'duration': '1.261000'})
     mocker.patch.object(thumbor_video_engine.engines.ffmpeg, 'named_tmp_file',
         wraps=mock_named_tmp_file)
@@ -51,7 +51,7 @@ def std_flags():
 @pytest.fixture
 def std_h264_flags(ffmpeg_path, std_flags):
     return [
-        ffmpeg_path, '-hide_banner', '-i', '/tmp/tempfile.mp4',
+        ffmpeg_path, '-hide_banner', '-i', 'pipe:0',
         '-c:v', 'libx264'
     ] + std_flags + ['-f', 'mp4']
 
@@ -59,7 +59,7 @@ def std_h264_flags(ffmpeg_path, std_flags):
 @pytest.fixture
 def std_h265_flags(ffmpeg_path, std_flags):
     return [
-        ffmpeg_path, '-hide_banner', '-i', '/tmp/tempfile.mp4',
+        ffmpeg_path, '-hide_banner', '-i', 'pipe:0',
         '-c:v', 'hevc', '-tag:v', 'hvc1',
     ] + std_flags + ['-f', 'mp4']
 
@@ -67,7 +67,7 @@ def std_h265_flags(ffmpeg_path, std_flags):
 @pytest.fixture
 def std_vp9_flags(ffmpeg_path, std_flags):
     return [
-        ffmpeg_path, '-hide_banner', '-i', '/tmp/tempfile.mp4',
+        ffmpeg_path, '-hide_banner', '-i', 'pipe:0',
         '-c:v', 'libvpx-vp9', '-loop', '0',
     ] + std_flags + ['-f', 'webm']
 
@@ -75,7 +75,7 @@ def std_vp9_flags(ffmpeg_path, std_flags):
 @pytest.fixture
 def std_webp_flags(ffmpeg_path, std_flags):
     return [
-        ffmpeg_path, '-hide_banner', '-i', '/tmp/tempfile.mp4', '-loop', '0',
+        ffmpeg_path, '-hide_banner', '-i', 'pipe:0', '-loop', '0',
     ] + std_flags + ['-f', 'webp']
 
 
@@ -221,5 +221,125 @@ def test_webp_config(config_key, config_val, expected, mock_engine, std_webp_fla
     mock_engine.read('.mp4', quality=80)
 
     assert mock_engine.run_cmd.mock_calls == [
-        mocker.call(std_webp_flags + expected + ['-y', '/tmp/tempfile.webp']),
+        mocker.call(std_webp_flags + expected + ['-y', 'pipe:1']),
+    ]
+
+
+def test_webp_pipe_output_disabled(mock_engine, std_webp_flags, mocker):
+    mock_engine.context.request.format = 'webp'
+    mock_engine.context.config.FFMPEG_PIPE_OUTPUT = False
+
+    mock_engine.read('.mp4', quality=80)
+
+    assert mock_engine.run_cmd.mock_calls == [
+        mocker.call(std_webp_flags + ['-y', '/tmp/tempfile.webp']),
+    ]
+
+
+@pytest.mark.parametrize("size,cpus,running_jobs,expected", [
+    ((200, 150), 16, 0, 1),
+    ((640, 480), 16, 1, 2),
+    ((1280, 720), 16, 1, 4),
+    ((1920, 1080), 16, 1, 8),
+    ((1920, 1080), 16, 4, 4),
+    ((1920, 1080), 4, 8, 1),
+])
+def test_auto_threads(size, cpus, running_jobs, expected, mock_engine, mocker):
+    mock_engine.context.config.FFMPEG_THREADS = 'auto'
+    mocker.patch.object(thumbor_video_engine.engines.ffmpeg, 'cpu_count',
+        return_value=cpus)
+    scheduler = mock_engine.scheduler
+    mocker.patch.object(scheduler, 'running_jobs', running_jobs)
+    mock_engine.image_size = size
+
+    assert mock_engine.ffmpeg_threads == expected
+
+
+@pytest.mark.parametrize("width,threads,expected", [
+    (200, 8, 0),
+    (640, 1, 0),
+    (640, 8, 1),
+    (1920, 2, 1),
+    (1920, 8, 2),
+    (3840, 16, 3),
+])
+def test_vp9_tile_columns(width, threads, expected, mock_engine):
+    mock_engine.image_size = (width, width * 9 // 16)
+    assert mock_engine.vp9_tile_columns(threads) == expected
+
+
+def test_h264_threads(mock_engine, std_h264_flags, mocker):
+    mock_engine.context.request.format = 'h264'
+    mock_engine.context.config.FFMPEG_THREADS = 3
+
+    mock_engine.read('.mp4', quality=80)
+
+    assert mock_engine.run_cmd.mock_calls == [
+        mocker.call(std_h264_flags + [
+            '-threads', '3', '-filter_threads', '3', '-y', '/tmp/tempfile.mp4']),
+    ]
+
+
+def test_h265_threads(mock_engine, std_h265_flags, mocker):
+    mock_engine.context.request.format = 'h265'
+    mock_engine.context.config.FFMPEG_THREADS = 'auto'
+
+    mock_engine.read('.mp4', quality=80)
+
+    assert mock_engine.run_cmd.mock_calls == [
+        mocker.call(std_h265_flags + [
+            '-threads', '1', '-filter_threads', '1', '-x265-params', 'pools=1',
+            '-y', '/tmp/tempfile.mp4']),
+    ]
+
+
+def test_vp9_threads(mock_engine, std_vp9_flags, mocker):
+    mock_engine.context.request.format = 'vp9'
+    mock_engine.context.config.FFMPEG_THREADS = 2
+
+    mock_engine.read('.mp4', quality=80)
+
+    assert mock_engine.run_cmd.mock_calls == [
+        mocker.call(std_vp9_flags + [
+            '-threads', '2', '-filter_threads', '2', '-tile-columns', '0',
+            '-y', '/tmp/tempfile.webm']),
+    ]
+
+
+@pytest.mark.parametrize("stats_mode,dither,palettegen,paletteuse", [
+    (None, None, 'palettegen', 'paletteuse'),
+    ('diff', 'bayer', 'palettegen=stats_mode=diff', 'paletteuse=dither=bayer'),
+    ('single', None, 'palettegen=stats_mode=single', 'paletteuse=new=1'),
+])
+def test_gif_single_pass(stats_mode, dither, palettegen, paletteuse,
+                         mock_engine, ffmpeg_path, mocker):
+    mock_engine.context.request.format = 'gif'
+    mock_engine.context.config.FFMPEG_GIF_PALETTE_STATS_MODE = stats_mode
+    mock_engine.context.config.FFMPEG_GIF_DITHER = dither
+
+    mock_engine.read('.gif', quality=80)
+
+    assert mock_engine.run_cmd.mock_calls == [
+        mocker.call([
+            ffmpeg_path, '-hide_banner', '-i', 'pipe:0',
+            '-lavfi', 'null,split[a][b];[a]%s[p];[b][p]%s' % (palettegen, paletteuse),
+            '-f', 'gif', '-y', 'pipe:1']),
+    ]
+
+
+def test_gif_two_pass(mock_engine, ffmpeg_path, mocker):
+    mock_engine.context.request.format = 'gif'
+    mock_engine.context.config.FFMPEG_GIF_PALETTE_SINGLE_PASS = False
+    mock_engine.context.config.FFMPEG_GIF_DITHER = 'none'
+
+    mock_engine.read('.gif', quality=80)
+
+    assert mock_engine.run_cmd.mock_calls == [
+        mocker.call([
+            ffmpeg_path, '-hide_banner', '-i', 'pipe:0',
+            '-lavfi', 'null,palettegen', '-y', '/tmp/tempfile.png']),
+        mocker.call([
+            ffmpeg_path, '-hide_banner', '-i', 'pipe:0', '-i', '/tmp/tempfile.png',
+            '-lavfi', 'null[x];[x][1:v]paletteuse=dither=none',
+            '-f', 'gif', '-y', 'pipe:1']),
     ]
@@ -1,8 +1,10 @@
+import asyncio
+
 import pytest
 
 from thumbor_video_engine.exceptions import FFmpegError
 import thumbor_video_engine.ffprobe
-from thumbor_video_engine.ffprobe import ffprobe
+from thumbor_video_engine.ffprobe import ffprobe, ffprobe_async
 
 
 def test_ffprobe_path_which(mocker, monkeypatch, mp4_buffer):
@@ -10,7 +12,7 @@ def test_ffprobe_path_which(mocker, monkeypatch, mp4_buffer):
     mocker.patch.object(
         thumbor_video_engine.ffprobe, 'which', return_value='/opt/bin/ffprobe')
     mocker.patch.object(
-        thumbor_video_engine.ffprobe, 'Popen', side_effect=FFmpegError)
+        thumbor_video_engine.ffprobe, 'run_process', side_effect=FFmpegError)
     with pytest.raises(FFmpegError):
         ffprobe(mp4_buffer)
     assert thumbor_video_engine.ffprobe.which.mock_calls == [
@@ -38,14 +40,42 @@ def test_ffprobe_error_code(storage_path):
 
 @pytest.mark.parametrize("stdout", ['FOO', '[]', '{}'])
 def test_ffprobe_invalid_data(mocker, mp4_buffer, stdout):
-    mock_proc = mocker.Mock(**{'communicate.return_value': (stdout, '')})
     mocker.patch.object(
-        thumbor_video_engine.ffprobe, 'Popen', return_value=mock_proc)
+        thumbor_video_engine.ffprobe, 'run_process', return_value=(0, stdout, b''))
     with pytest.raises(FFmpegError) as exc:
         ffprobe(mp4_buffer)
     assert str(exc.value) == 'ffprobe returned invalid data'
 
 
+@pytest.mark.asyncio
+async def test_ffprobe_async(mp4_buffer):
+    data = await ffprobe_async(mp4_buffer, '.mp4')
+    assert (data['width'], data['height']) == (200, 150)
+
+
+@pytest.mark.asyncio
+async def test_ffprobe_async_cancelled_kills_process(mocker, mp4_buffer):
+    procs = []
+    orig_exec = asyncio.create_subprocess_exec
+
+    async def create_subprocess_exec(*args, **kwargs):
+        procs.append(await orig_exec(*args, **kwargs))
+        return procs[-1]
+
+    mocker.patch.object(asyncio, 'create_subprocess_exec', create_subprocess_exec)
+    # an ffprobe that never exits
+    mocker.patch.object(
+        thumbor_video_engine.ffprobe, 'ffprobe_command',
+        return_value=['sleep', '30'])
+    task = asyncio.ensure_future(ffprobe_async(mp4_buffer))
+    while not procs:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert procs[0].returncode is not None
+
+
 def test_ffprobe_flat(storage_path):
     with open("%s/hotdog.mp4" % storage_path, mode="rb") as f:
         aac_data = f.read()
@@ -76,6 +76,17 @@ def test_variable_delays():
     assert float(info.duration) == pytest.approx(1.1)
 
 
+def test_frame_span():
+    buf = pil_gif(solid_frames(4), duration=[300, 100, 500, 200], loop=0)
+    info = parse_gif(buf)
+    assert info.frame_span(0) == (0, Fraction(11, 10))
+    assert info.frame_span(Fraction(7, 20), Fraction(1, 2)) == (
+        Fraction(3, 10), Fraction(9, 10))
+    assert info.frame_span(Fraction(4, 10), Fraction(9, 10)) == (
+        Fraction(4, 10), Fraction(9, 10))
+    assert info.frame_span(Fraction(11, 10)) is None
+
+
 def test_missing_gce_defaults_zero():
     info = parse_gif(minimal_gif(image_blocks=2, gce=None))
     assert info.frames == [GifFrame(0, False, 0), GifFrame(0, False, 0)]
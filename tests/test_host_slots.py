@@ -0,0 +1,141 @@
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.exceptions import FFmpegQueueTimeout
+from thumbor_video_engine.host_slots import HostSlots
+
+
+@pytest.fixture
+def slots_path(tmp_path):
+    return str(tmp_path / 'slots')
+
+
+def test_acquire_release(slots_path):
+    slots = HostSlots(slots_path, 2)
+    held = [slots.try_acquire(), slots.try_acquire()]
+    assert sorted(slot.index for slot in held) == [0, 1]
+    assert slots.try_acquire() is None
+    held[0].release()
+    slot = slots.try_acquire()
+    assert slot.index == held[0].index
+
+
+def test_acquire_timeout(slots_path):
+    slots = HostSlots(slots_path, 1)
+    slots.try_acquire()
+    start = time.monotonic()
+    assert slots.acquire(timeout=0.1) is None
+    assert 0.1 <= time.monotonic() - start < 1
+
+
+def test_acquire_cancelled(slots_path):
+    slots = HostSlots(slots_path, 1)
+    slots.try_acquire()
+    assert slots.acquire(cancelled=lambda: True) is None
+
+
+def test_slot_held_by_other_process(slots_path):
+    slots = HostSlots(slots_path, 1)
+    holder = subprocess.Popen([
+        sys.executable, '-c',
+        'import fcntl, os, sys, time\n'
+        'os.makedirs(sys.argv[1], exist_ok=True)\n'
+        'fd = os.open(os.path.join(sys.argv[1], "slot-0.lock"), os.O_RDWR | os.O_CREAT)\n'
+        'fcntl.flock(fd, fcntl.LOCK_EX)\n'
+        'print("locked", flush=True)\n'
+        'time.sleep(30)\n',
+        slots_path,
+    ], stdout=subprocess.PIPE)
+    try:
+        assert holder.stdout.readline() == b'locked\n'
+        assert slots.try_acquire() is None
+    finally:
+        holder.kill()
+        holder.wait()
+        holder.stdout.close()
+    # the lock is dropped when the holding process dies
+    assert slots.acquire(timeout=5).index == 0
+
+
+def test_run_cmd_holds_slot(mocker, context, slots_path):
+    context.config.FFMPEG_HOST_SLOTS = 1
+    context.config.FFMPEG_HOST_SLOTS_PATH = slots_path
+    mocker.spy(context.metrics, 'timing')
+    engine = FFmpegEngine(context)
+    engine.buffer = b''
+    stdout = engine.run_cmd([
+        sys.executable, '-c',
+        'import fcntl, os, sys\n'
+        'fd = os.open(os.path.join(sys.argv[1], "slot-0.lock"), os.O_RDWR)\n'
+        'try:\n'
+        '    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)\n'
+        'except BlockingIOError:\n'
+        '    print("held")\n',
+        slots_path,
+    ])
+    assert stdout == b'held\n'
+    # and released once the command exits
+    assert HostSlots(slots_path, 1).try_acquire() is not None
+    context.metrics.timing.assert_any_call('video.host_slot.latency', mocker.ANY)
+
+
+def test_run_cmd_slot_timeout(context, slots_path):
+    context.config.FFMPEG_HOST_SLOTS = 1
+    context.config.FFMPEG_HOST_SLOTS_PATH = slots_path
+    context.config.FFMPEG_QUEUE_TIMEOUT = 0.05
+    engine = FFmpegEngine(context)
+    engine.buffer = b''
+    HostSlots(slots_path, 1).try_acquire()
+    with pytest.raises(FFmpegQueueTimeout):
+        engine.run_cmd(['echo', 'hi'])
+
+
+@pytest.fixture
+def still_config(config, slots_path):
+    config.FILTERS = ['thumbor_video_engine.filters.still']
+    config.FFMPEG_STILL_DIRECT = False
+    config.FFMPEG_HOST_SLOTS = 1
+    config.FFMPEG_HOST_SLOTS_PATH = slots_path
+    return config
+
+
+@pytest.mark.asyncio
+async def test_still_frame_waits_for_slot_off_the_loop(
+        mocker, still_config, slots_path, http_client, base_url):
+    still_config.FFMPEG_QUEUE_TIMEOUT = 5
+    loop_thread = threading.current_thread()
+    threads = []
+    orig_still_frame = FFmpegEngine.still_frame
+
+    def still_frame(self, *args):
+        threads.append(threading.current_thread())
+        return orig_still_frame(self, *args)
+
+    mocker.patch.object(FFmpegEngine, 'still_frame', still_frame)
+    held = HostSlots(slots_path, 1).try_acquire()
+    # the slot frees up while the request waits for it, which it could not
+    # if it were waiting on the loop
+    asyncio.get_running_loop().call_later(0.2, held.release)
+    response = await http_client.fetch(
+        "%s/unsafe/filters:still(0.5)/hotdog.mp4" % base_url)
+    assert response.code == 200
+    assert threads and threads[0] is not loop_thread
+
+
+@pytest.mark.asyncio
+async def test_still_frame_slot_timeout(mocker, still_config, slots_path, http_client,
+                                        base_url):
+    still_config.FFMPEG_QUEUE_TIMEOUT = 0.05
+    mocker.spy(FFmpegEngine, 'still_frame')
+    held = HostSlots(slots_path, 1).try_acquire()
+    response = await http_client.fetch(
+        "%s/unsafe/filters:still(0.5)/hotdog.mp4" % base_url, raise_error=False)
+    held.release()
+    assert response.code == 503
+    assert FFmpegEngine.still_frame.call_count == 1
@@ -0,0 +1,182 @@
+import os
+
+import pytest
+
+import thumbor_video_engine.intermediates as intermediates_module
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.ffprobe import ffprobe
+from thumbor_video_engine.intermediates import IntermediateCache
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'intermediates')
+
+
+@pytest.fixture
+def config(config, cache_path):
+    config.FFMPEG_INTERMEDIATE_CACHE = True
+    config.FFMPEG_INTERMEDIATE_CACHE_PATH = cache_path
+    # hotdog.mp4 is 200x150
+    config.FFMPEG_INTERMEDIATE_SIZES = [60, 100]
+    return config
+
+
+def store(cache, key, size, data):
+    with cache.store(key, size) as tmp_path:
+        with open(tmp_path, mode='wb') as f:
+            f.write(data)
+
+
+def test_store_and_get(cache_path):
+    cache = IntermediateCache(cache_path, 0)
+    assert cache.get('abcdef', 720) is None
+    store(cache, 'abcdef', 720, b'data')
+    path = cache.get('abcdef', 720)
+    assert path == '%s/ab/cdef/720.mp4' % cache_path
+    with open(path, mode='rb') as f:
+        assert f.read() == b'data'
+
+
+def test_store_failure_removes_temp_file(cache_path):
+    cache = IntermediateCache(cache_path, 0)
+    with pytest.raises(RuntimeError):
+        with cache.store('abcdef', 720):
+            raise RuntimeError()
+    assert cache.get('abcdef', 720) is None
+    assert os.listdir('%s/ab/cdef' % cache_path) == []
+
+
+def test_evicts_least_recently_used(cache_path):
+    cache = IntermediateCache(cache_path, 10)
+    store(cache, 'aa01', 480, b'x' * 4)
+    store(cache, 'bb02', 480, b'x' * 4)
+    os.utime(cache.path_for('aa01', 480), (1, 1))
+    os.utime(cache.path_for('bb02', 480), (2, 2))
+    store(cache, 'cc03', 480, b'x' * 4)
+    assert cache.get('aa01', 480) is None
+    assert cache.get('bb02', 480) is not None
+    assert cache.get('cc03', 480) is not None
+
+
+def test_eviction_sweeps_are_amortized(mocker, cache_path):
+    sweep_spy = mocker.spy(intermediates_module, 'evict_least_recently_used')
+    cache = IntermediateCache(cache_path, 100)
+    for i in range(10):
+        store(cache, '%04d' % i, 480, b'x' * 4)
+    # only on the first store, while the stores add up to less than 100 bytes
+    assert sweep_spy.call_count == 1
+
+
+def test_lock_is_exclusive(cache_path):
+    cache = IntermediateCache(cache_path, 0)
+    with cache.lock('abcdef', 720) as locked:
+        assert locked
+        with cache.lock('abcdef', 720) as locked_again:
+            assert not locked_again
+        with cache.lock('abcdef', 480) as other_size:
+            assert other_size
+    with cache.lock('abcdef', 720) as locked:
+        assert locked
+
+
+@pytest.mark.parametrize('resize,crop,expected', [
+    (None, None, None),
+    ((40, 30), None, 60),
+    ((100, 75), None, 100),
+    ((150, 112), None, None),
+    # a 100x75 crop scaled to 40x30 needs the source at 0.4x, and to 60x45 at 0.6x
+    ((40, 30), (50, 25, 150, 100), 60),
+    ((60, 45), (50, 25, 150, 100), 100),
+])
+def test_intermediate_size(context, mp4_buffer, resize, crop, expected):
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    if crop:
+        engine.crop(*crop)
+    if resize:
+        engine.resize(*resize)
+    assert engine.intermediate_size() == expected
+
+
+def test_intermediate_size_not_for_images(context, storage_path):
+    with open('%s/hotdog.gif' % storage_path, mode='rb') as f:
+        engine = FFmpegEngine(context)
+        engine.load(f.read(), '.gif')
+    engine.resize(40, 30)
+    assert engine.intermediate_size() is None
+
+
+def test_transcode_from_intermediate(mocker, context, mp4_buffer, cache_path):
+    mocker.spy(context.metrics, 'incr')
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.crop(50, 25, 150, 100)
+    engine.resize(60, 45)
+    make_spy = mocker.spy(engine, 'make_intermediate')
+
+    file_info = ffprobe(engine.read('.mp4', quality=80))
+    assert (file_info['width'], file_info['height']) == (60, 44)
+    intermediate = IntermediateCache(cache_path, 0).path_for(engine.source.digest, 100)
+    file_info = ffprobe(open(intermediate, mode='rb').read())
+    assert (file_info['width'], file_info['height']) == (132, 100)
+    # the crop is restored once the transcode is done
+    assert engine.crop_info == (100, 75, 50, 25)
+
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.resize(90, 68)
+    run_spy = mocker.spy(engine, 'run_cmd')
+    file_info = ffprobe(engine.read('.webm', quality=80))
+    assert (file_info['width'], file_info['height']) == (90, 68)
+    assert intermediate in run_spy.call_args[0][0]
+    assert make_spy.call_count == 1
+    context.metrics.incr.assert_any_call('video.intermediate.miss')
+    context.metrics.incr.assert_any_call('video.intermediate.hit')
+
+
+def test_intermediate_failure_falls_back(mocker, context, mp4_buffer):
+    context.config.FFMPEG_INTERMEDIATE_PRESET = 'not-a-preset'
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.resize(40, 30)
+
+    file_info = ffprobe(engine.read('.mp4', quality=80))
+    assert (file_info['width'], file_info['height']) == (40, 30)
+
+
+def test_unwritable_cache_falls_back(context, mp4_buffer, tmp_path):
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.write_bytes(b'')
+    context.config.FFMPEG_INTERMEDIATE_CACHE_PATH = str(not_a_dir)
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.resize(40, 30)
+
+    file_info = ffprobe(engine.read('.mp4', quality=80))
+    assert (file_info['width'], file_info['height']) == (40, 30)
+
+
+def test_intermediate_being_made_falls_back(mocker, context, mp4_buffer, cache_path):
+    mocker.spy(context.metrics, 'incr')
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.resize(40, 30)
+
+    cache = IntermediateCache(cache_path, 0)
+    with cache.lock(engine.source.digest, 60):
+        file_info = ffprobe(engine.read('.mp4', quality=80))
+    assert (file_info['width'], file_info['height']) == (40, 30)
+    assert cache.get(engine.source.digest, 60) is None
+    context.metrics.incr.assert_any_call('video.intermediate.busy')
+
+
+def test_job_weight_counts_intermediate(context, mp4_buffer, cache_path):
+    context.config.FFMPEG_JOB_WEIGHTS = {'h264': 2, 'vp9': 4}
+    engine = FFmpegEngine(context)
+    engine.load(mp4_buffer, '.mp4')
+    engine.resize(40, 30)
+    assert engine.job_weight('.webm') == 6
+
+    store(IntermediateCache(cache_path, 0), engine.source.digest, 60, b'data')
+    assert engine.job_weight('.webm') == 4
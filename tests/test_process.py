@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from thumbor_video_engine import process
+
+
+@pytest.mark.asyncio
+async def test_run_process():
+    returncode, stdout, stderr = await process.run_process(
+        ['sh', '-c', 'echo out; echo err >&2; exit 3'])
+    assert (returncode, stdout, stderr) == (3, b'out\n', b'err\n')
+
+
+@pytest.mark.asyncio
+async def test_run_process_stdin():
+    data = b'x' * (1024 * 1024)
+    returncode, stdout, _ = await process.run_process(['cat'], data)
+    assert returncode == 0
+    assert stdout == data
+
+
+@pytest.mark.asyncio
+async def test_run_process_stdin_not_read():
+    returncode, stdout, _ = await process.run_process(
+        ['true'], b'x' * (1024 * 1024))
+    assert (returncode, stdout) == (0, b'')
+
+
+@pytest.mark.asyncio
+async def test_run_process_stdin_iterable():
+    chunks = [b'x' * (256 * 1024) for _ in range(8)]
+    returncode, stdout, _ = await process.run_process(['cat'], iter(chunks))
+    assert returncode == 0
+    assert stdout == b''.join(chunks)
+
+
+@pytest.mark.asyncio
+async def test_run_process_stdin_iterable_not_read():
+    closed = []
+
+    def chunks():
+        try:
+            while True:
+                yield b'x' * (64 * 1024)
+        finally:
+            closed.append(True)
+
+    returncode, _, _ = await process.run_process(['true'], chunks())
+    assert returncode == 0
+    assert closed == [True]
+
+
+@pytest.mark.asyncio
+async def test_run_process_stderr_tail(monkeypatch):
+    monkeypatch.setattr(process, 'MAX_STDERR_BYTES', 1000)
+    monkeypatch.setattr(process, 'READ_CHUNK_SIZE', 100)
+    _, _, stderr = await process.run_process(
+        ['sh', '-c', 'head -c 100000 /dev/zero >&2; echo end >&2'])
+    assert len(stderr) == 1000
+    assert stderr.endswith(b'\x00end\n')
+
+
+@pytest.mark.asyncio
+async def test_run_process_cancel_kills_child():
+    task = asyncio.ensure_future(process.run_process(['sleep', '30']))
+    await asyncio.sleep(0.2)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(task, 5)
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline():
+    result = await process.run_pipeline(['cat'], ['wc', '-c'], b'abc')
+    assert result == (0, 0, b'', b'')
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_returncodes():
+    result = await process.run_pipeline(
+        ['sh', '-c', 'echo src >&2; exit 2'], ['sh', '-c', 'cat; exit 1'])
+    assert result == (2, 1, b'src\n', b'')
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_sink_start_failure_kills_source():
+    with pytest.raises(OSError):
+        await asyncio.wait_for(process.run_pipeline(
+            ['sleep', '30'], ['/nonexistent/sink-binary-xyz']), 5)
+
+
+@pytest.mark.asyncio
+async def test_run_pipeline_cancel_kills_children():
+    task = asyncio.ensure_future(
+        process.run_pipeline(['sleep', '30'], ['sleep', '30']))
+    await asyncio.sleep(0.2)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(task, 5)
+
+
+def test_run_sync():
+    assert process.run_sync(process.run_process(['echo', 'hi']))[1] == b'hi\n'
+
+
+@pytest.mark.asyncio
+async def test_run_sync_in_running_loop():
+    assert process.run_sync(process.run_process(['echo', 'hi']))[1] == b'hi\n'
@@ -0,0 +1,141 @@
+import pytest
+
+from thumbor_video_engine.app import rendition_url
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.ffprobe import ffprobe
+
+
+LADDER = [(100, 0, 'mp4'), (100, 0, 'webm'), (60, 0, 'mp4')]
+
+
+@pytest.fixture
+def config(config, tmp_path):
+    config.FILTERS = ['thumbor_video_engine.filters.format']
+    config.RESULT_STORAGE = 'thumbor_video_engine.result_storages.file_storage'
+    config.RESULT_STORAGE_FILE_STORAGE_ROOT_PATH = str(tmp_path / 'result_storage')
+    config.RESULT_STORAGE_STORES_UNSAFE = True
+    config.FFMPEG_RENDITIONS = LADDER
+    return config
+
+
+@pytest.mark.parametrize('url,expected', [
+    ('/unsafe/100x0/hotdog.mp4', '/unsafe/60x0/filters:format(webm)/hotdog.mp4'),
+    ('/unsafe/100x0/filters:format(mp4)/hotdog.mp4',
+     '/unsafe/60x0/filters:format(webm)/hotdog.mp4'),
+    ('/unsafe/10x10:190x140/-100x0/smart/filters:quality(50):format(mp4):tune(film)/a/1x1.mp4',
+     '/unsafe/10x10:190x140/-60x0/smart/filters:quality(50):tune(film):format(webm)/a/1x1.mp4'),
+])
+def test_rendition_url(mocker, context, url, expected):
+    context.request = context.request.__class__(
+        url=url, unsafe=True, horizontal_flip=url.count('/-') > 0)
+    context.request.engine = mocker.Mock(extension='.mp4')
+    assert rendition_url(context, 60, 0, 'webm') == expected
+
+
+@pytest.mark.parametrize('url,expected', [
+    ('/unsafe/100x0/hotdog.mp4', '/unsafe/60x0/hotdog.mp4'),
+    ('/unsafe/100x0/filters:quality(50)/hotdog.mp4',
+     '/unsafe/60x0/filters:quality(50)/hotdog.mp4'),
+    ('/unsafe/100x0/filters:format(webm)/hotdog.mp4',
+     '/unsafe/60x0/filters:format(mp4)/hotdog.mp4'),
+    ('/unsafe/100x0/filters:format(mp4)/hotdog.mp4',
+     '/unsafe/60x0/filters:format(mp4)/hotdog.mp4'),
+])
+def test_rendition_url_default_format(mocker, context, url, expected):
+    context.request = context.request.__class__(url=url, unsafe=True)
+    context.request.engine = mocker.Mock(extension='.mp4')
+    assert rendition_url(context, 60, 0, 'mp4') == expected
+
+
+def test_rendition_url_signed(mocker, context):
+    signer = context.modules.url_signer(context.server.security_key)
+    path = '100x0/filters:format(mp4)/hotdog.mp4'
+    signature = signer.signature(path).decode()
+    context.request = context.request.__class__(url='/%s/%s' % (signature, path), hash=signature)
+    context.request.engine = mocker.Mock(extension='.mp4')
+
+    expected_path = '60x0/filters:format(webm)/hotdog.mp4'
+    expected = '/%s/%s' % (signer.signature(expected_path).decode(), expected_path)
+    assert rendition_url(context, 60, 0, 'webm') == expected
+
+
+@pytest.mark.asyncio
+async def test_renditions_transcoded_together(mocker, config, http_client, base_url,
+                                              tmp_path):
+    run_spy = mocker.spy(FFmpegEngine, 'run_cmd')
+    response = await http_client.fetch(
+        "%s/unsafe/100x0/filters:format(webm)/hotdog.mp4" % base_url)
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'video/webm'
+    assert run_spy.call_count == 1
+    cmd = run_spy.call_args[0][1]
+    assert cmd.count('-i') == 1
+    assert '-filter_complex' in cmd
+
+    load_spy = mocker.spy(FFmpegEngine, 'load')
+    results = {}
+    for width, height, out_format in LADDER:
+        response = await http_client.fetch(
+            "%s/unsafe/%dx%d/filters:format(%s)/hotdog.mp4" % (
+                base_url, width, height, out_format))
+        assert response.code == 200
+        results[(width, out_format)] = response.body
+    # all served from result storage
+    assert load_spy.call_count == 0
+
+    # and the same as if transcoded on their own
+    config.FFMPEG_RENDITIONS = []
+    config.RESULT_STORAGE_FILE_STORAGE_ROOT_PATH = str(tmp_path / 'single')
+    for (width, out_format), body in results.items():
+        response = await http_client.fetch(
+            "%s/unsafe/%dx0/filters:format(%s)/hotdog.mp4" % (
+                base_url, width, out_format))
+        expected, actual = ffprobe(response.body), ffprobe(body)
+        for key in ('codec_name', 'width', 'height', 'nb_frames'):
+            assert actual.get(key) == expected.get(key)
+    assert load_spy.call_count == len(LADDER)
+
+
+@pytest.mark.asyncio
+async def test_renditions_stored_under_requested_urls(mocker, http_client, base_url):
+    response = await http_client.fetch("%s/unsafe/100x0/hotdog.mp4" % base_url)
+    assert response.code == 200
+    assert response.headers.get('content-type') == 'video/mp4'
+
+    load_spy = mocker.spy(FFmpegEngine, 'load')
+    for url in ('/unsafe/60x0/hotdog.mp4', '/unsafe/100x0/filters:format(webm)/hotdog.mp4'):
+        response = await http_client.fetch(base_url + url)
+        assert response.code == 200
+    assert load_spy.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_renditions_with_two_pass_codec_left_out(mocker, config, http_client, base_url):
+    config.FFMPEG_VP9_TWO_PASS = True
+    engine_spy = mocker.spy(FFmpegEngine, 'transcode_renditions')
+    response = await http_client.fetch("%s/unsafe/60x0/hotdog.mp4" % base_url)
+    assert response.code == 200
+    renditions = engine_spy.call_args[0][1]
+    assert renditions == [(100, 0, 'mp4'), (60, 0, 'mp4')]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('url', [
+    '/unsafe/80x0/hotdog.mp4',
+    '/unsafe/100x0/filters:format(gif)/hotdog.mp4',
+    '/unsafe/100x0/hotdog.gif',
+])
+async def test_renditions_only_for_ladder(mocker, http_client, base_url, url):
+    engine_spy = mocker.spy(FFmpegEngine, 'transcode_renditions')
+    response = await http_client.fetch(base_url + url)
+    assert response.code == 200
+    assert engine_spy.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_renditions_only_if_stored(mocker, config, http_client, base_url):
+    config.RESULT_STORAGE_STORES_UNSAFE = False
+    engine_spy = mocker.spy(FFmpegEngine, 'transcode_renditions')
+    response = await http_client.fetch("%s/unsafe/100x0/hotdog.mp4" % base_url)
+    assert response.code == 200
+    assert engine_spy.call_count == 0
@@ -0,0 +1,82 @@
+import pytest
+
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.engines.video import Engine as VideoEngine
+import thumbor_video_engine.source_info as source_info_module
+from thumbor_video_engine.source_info import SourceInfo
+
+
+def load_fixture(storage_path, name):
+    with open("%s/%s" % (storage_path, name), mode='rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('name,mimetype,container,animated', [
+    ('hotdog.gif', 'image/gif', 'gif', True),
+    ('hotdog-still.gif', 'image/gif', 'gif', False),
+    ('hotdog.webp', 'image/webp', 'webp', True),
+    ('hotdog.png', 'image/png', 'png', False),
+    ('hotdog.mp4', 'video/mp4', 'mp4', False),
+    ('hotdog.mov', 'video/quicktime', 'mov', False),
+    ('hotdog.webm', 'video/webm', 'webm', False),
+])
+def test_source_info(storage_path, name, mimetype, container, animated):
+    source_info = SourceInfo(load_fixture(storage_path, name))
+    assert source_info.mimetype == mimetype
+    assert source_info.container == container
+    assert source_info.is_animated is animated
+    assert source_info.is_video is mimetype.startswith('video/')
+    assert (source_info.gif_info is not None) is (container == 'gif')
+    assert (source_info.webp_info is not None) is (container == 'webp')
+
+
+def test_gif_parsed_once(mocker, storage_path):
+    parse_spy = mocker.spy(source_info_module, 'parse_gif')
+    source_info = SourceInfo(load_fixture(storage_path, 'hotdog.gif'))
+
+    assert source_info.is_animated
+    assert source_info.gif_info.frame_count == 42
+    assert parse_spy.call_count == 1
+
+
+def test_is_streamable_mp4(storage_path):
+    assert SourceInfo(load_fixture(storage_path, 'hotdog.mp4')).is_streamable_mp4
+    assert not SourceInfo(load_fixture(storage_path, 'hotdog.webm')).is_streamable_mp4
+
+
+@pytest.mark.parametrize('name,extension', [
+    ('hotdog.gif', '.gif'),
+    ('hotdog.webp', '.webp'),
+    ('hotdog.mp4', '.mp4'),
+])
+def test_video_engine_hands_source_info_to_ffmpeg(mocker, context, storage_path,
+                                                  name, extension):
+    init_spy = mocker.spy(SourceInfo, '__init__')
+    buf = load_fixture(storage_path, name)
+
+    video_engine = VideoEngine(context)
+    video_engine.load(buf, extension)
+
+    assert isinstance(video_engine.engine, FFmpegEngine)
+    assert init_spy.call_count == 1
+    assert video_engine.engine.source.buffer is buf
+
+
+def test_probe_data_kept_on_source_info(mocker, context, storage_path):
+    buf = load_fixture(storage_path, 'hotdog.mp4')
+    source_info = SourceInfo(buf)
+    engine = FFmpegEngine(context)
+    engine.source_info = source_info
+    probe_spy = mocker.spy(engine, 'probe_headers')
+
+    engine.load(buf, '.mp4')
+    assert source_info.probe_data['width'] == 200
+    engine.ffprobe()
+    assert probe_spy.call_count == 1
+
+
+def test_stale_source_info_replaced(context, storage_path, mp4_buffer):
+    engine = FFmpegEngine(context)
+    engine.source_info = SourceInfo(load_fixture(storage_path, 'hotdog.gif'))
+    engine.load(mp4_buffer, '.mp4')
+    assert engine.source.mimetype == 'video/mp4'
@@ -0,0 +1,180 @@
+from fractions import Fraction
+import os
+import threading
+
+import pytest
+
+import thumbor_video_engine.intermediates as intermediates_module
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.transcode_cache import TranscodeCache
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'transcodes')
+
+
+@pytest.fixture
+def config(config, cache_path):
+    config.FILTERS = [
+        'thumbor_video_engine.filters.format',
+        'thumbor_video_engine.filters.still',
+    ]
+    config.FFMPEG_TRANSCODE_CACHE = True
+    config.FFMPEG_TRANSCODE_CACHE_PATH = cache_path
+    return config
+
+
+def test_put_and_get(cache_path):
+    cache = TranscodeCache(cache_path, 0)
+    assert cache.get('abcdef') is None
+    cache.put('abcdef', b'data')
+    assert cache.path_for('abcdef') == '%s/ab/cdef.out' % cache_path
+    assert cache.get('abcdef') == b'data'
+    assert os.listdir('%s/ab' % cache_path) == ['cdef.out']
+
+
+def test_evicts_least_recently_used(cache_path):
+    cache = TranscodeCache(cache_path, 10)
+    cache.put('aa01', b'x' * 4)
+    cache.put('bb02', b'x' * 4)
+    os.utime(cache.path_for('aa01'), (1, 1))
+    os.utime(cache.path_for('bb02'), (2, 2))
+    cache.put('cc03', b'x' * 4)
+    assert cache.get('aa01') is None
+    assert cache.get('bb02') is not None
+    assert cache.get('cc03') is not None
+
+
+def test_eviction_sweeps_are_amortized(mocker, cache_path):
+    sweep_spy = mocker.spy(intermediates_module, 'evict_least_recently_used')
+    cache = TranscodeCache(cache_path, 100)
+    for i in range(26):
+        cache.put('%04d' % i, b'x' * 4)
+    # on the first put, and once the puts add up to more than 100 bytes
+    # (on the 26th)
+    assert sweep_spy.call_count == 2
+    assert sum(
+        os.path.getsize(cache.path_for('%04d' % i)) for i in range(26)
+        if cache.get('%04d' % i)) <= 100
+
+
+def test_put_failure_is_logged(mocker, tmp_path):
+    logger_spy = mocker.patch('thumbor_video_engine.transcode_cache.logger')
+    not_a_dir = tmp_path / 'file'
+    not_a_dir.write_bytes(b'')
+    cache = TranscodeCache(str(not_a_dir), 0)
+    cache.put('abcdef', b'data')
+    assert cache.get('abcdef') is None
+    logger_spy.warning.assert_called_once()
+
+
+def test_cache_key_gifsicle_engine(context, mp4_buffer, load_engine):
+    engine = load_engine(mp4_buffer, out_format='gif')
+    key = engine.transcode_cache_key('gif')
+    context.config.FFMPEG_USE_GIFSICLE_ENGINE = not context.config.FFMPEG_USE_GIFSICLE_ENGINE
+    assert engine.transcode_cache_key('gif') != key
+
+
+def test_cache_key(context, mp4_buffer, load_engine):
+    def key(out_format='mp4', **kwargs):
+        engine = load_engine(mp4_buffer, out_format=out_format, **kwargs)
+        return engine.transcode_cache_key(out_format)
+
+    assert key() == key(out_format='h264')
+    # hotdog.mp4 is 200x150
+    assert key() == key(crop=(0, 0, 200, 150), resize=(200, 150))
+    assert key() != key(out_format='webm')
+    assert key() != key(resize=(100, 75))
+    assert key(resize=(100, 75)) != key(crop=(10, 0, 210, 150), resize=(100, 75))
+
+    base_key = key()
+    context.config.FFMPEG_H264_CRF = 30
+    assert key() != base_key
+    context.config.FFMPEG_QUEUE_TIMEOUT = 30
+    context.config.FFMPEG_H264_CRF = None
+    assert key() == base_key
+
+
+def test_cache_key_trim_and_fps(context, mp4_buffer, load_engine):
+    base_key = load_engine(mp4_buffer, out_format='mp4').transcode_cache_key('mp4')
+    context.request.trim_range = (Fraction(1, 2), None)
+    trim_key = load_engine(mp4_buffer, out_format='mp4').transcode_cache_key('mp4')
+    assert trim_key != base_key
+    context.request.fps = Fraction(10)
+    engine = load_engine(mp4_buffer, out_format='mp4')
+    assert engine.transcode_cache_key('mp4') not in (base_key, trim_key)
+
+
+def test_cache_key_not_for_renditions(mocker, load_engine, mp4_buffer):
+    mocker.patch.object(
+        FFmpegEngine, 'ladder_renditions', return_value=[(100, 0, 'mp4'), (100, 0, 'webm')])
+    engine = load_engine(mp4_buffer, out_format='webm', resize=(100, 75))
+    assert engine.transcode_cache_key('webm') is None
+
+
+def test_transcode_served_from_cache(mocker, context, mp4_buffer, load_engine):
+    mocker.spy(context.metrics, 'incr')
+    engine = load_engine(mp4_buffer, out_format='h264', resize=(100, 75))
+    run_spy = mocker.spy(engine, 'run_cmd')
+    result = engine.read('.mp4', quality=80)
+    assert run_spy.call_count == 1
+    context.metrics.incr.assert_any_call('video.transcode_cache.miss')
+
+    engine = load_engine(mp4_buffer, out_format='h264', resize=(100, 75))
+    run_spy = mocker.spy(engine, 'run_cmd')
+    assert engine.read('.mp4', quality=80) == result
+    assert run_spy.call_count == 0
+    assert context.request.format == 'mp4'
+    context.metrics.incr.assert_any_call('video.transcode_cache.hit')
+
+
+@pytest.mark.asyncio
+async def test_read_async_served_from_cache(mocker, load_engine, mp4_buffer):
+    engine = load_engine(mp4_buffer, out_format='webm', resize=(100, 75))
+    await engine.read_async('.mp4')
+    result = engine.read('.mp4', quality=80)
+
+    engine = load_engine(mp4_buffer, out_format='webm', resize=(100, 75))
+    acquire_spy = mocker.spy(engine.scheduler, 'acquire_async')
+    transcode_spy = mocker.spy(engine, '_transcode')
+    await engine.read_async('.mp4')
+    assert engine.read('.mp4', quality=80) == result
+    assert acquire_spy.call_count == 0
+    assert transcode_spy.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_equivalent_urls_share_a_transcode(mocker, context, http_client, base_url):
+    run_spy = mocker.spy(FFmpegEngine, 'run_cmd')
+    signer = context.modules.url_signer(context.server.security_key)
+    path = '0x0:200x150/100x75/filters:format(webm)/hotdog.mp4'
+    urls = [
+        '/unsafe/100x75/filters:format(webm)/hotdog.mp4',
+        '/%s/%s' % (signer.signature(path).decode(), path),
+    ]
+    bodies = []
+    for url in urls:
+        response = await http_client.fetch(base_url + url)
+        assert response.code == 200
+        assert response.headers.get('content-type') == 'video/webm'
+        bodies.append(response.body)
+    assert bodies[0] == bodies[1]
+    assert run_spy.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_read_async_cache_lookup_off_the_loop(mocker, load_engine, mp4_buffer):
+    engine = load_engine(mp4_buffer, out_format='webm', resize=(100, 75))
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def get(key):
+        threads.append(threading.get_ident())
+        raise OSError("unreadable cache")
+
+    mocker.patch.object(TranscodeCache, 'get', side_effect=get)
+    await engine.read_async('.mp4')
+    assert threads and loop_thread not in threads
+    with pytest.raises(OSError):
+        engine.read('.mp4', quality=80)
@@ -1,7 +1,15 @@
-import pytest
+from io import BytesIO
+from struct import pack
+from subprocess import run
 
+from PIL import Image
+import pytest
 
-from thumbor_video_engine.utils import is_mp4, is_animated_gif
+from thumbor_video_engine.ffprobe import ffprobe
+from thumbor_video_engine.utils import (
+    is_mp4, is_animated, is_animated_gif, is_streamable_mp4, iter_rgba_mkv,
+    mp4_keyframes, probe_mp4, probe_webm, webm_keyframes, Mp4ParseError,
+    WebmParseError)
 
 
 @pytest.mark.parametrize('bool_val,buf', [
@@ -30,3 +38,266 @@ def test_is_animated_gif_true(storage_path):
     with open("%s/hotdog.gif" % storage_path, mode="rb") as f:
         im_bytes = f.read()
     assert is_animated_gif(im_bytes) is True
+
+
+@pytest.mark.parametrize('bool_val,buf', [
+    # ftyp, moov, mdat
+    (True, b'\x00\x00\x00\x08ftyp\x00\x00\x00\x08moov\x00\x00\x00\x08mdat'),
+    # ftyp, free, mdat, moov
+    (False, b'\x00\x00\x00\x08ftyp\x00\x00\x00\x08free\x00\x00\x00\x08mdat'
+            b'\x00\x00\x00\x08moov'),
+    # 64-bit box size on the box before moov
+    (True, b'\x00\x00\x00\x01free\x00\x00\x00\x00\x00\x00\x00\x10'
+           b'\x00\x00\x00\x08moov'),
+    # truncated before any moov or mdat
+    (False, b'\x00\x00\x00\x08ftyp\x00\x00'),
+    (False, b''),
+])
+def test_is_streamable_mp4(bool_val, buf):
+    assert is_streamable_mp4(buf) is bool_val
+
+
+@pytest.mark.parametrize('filename,bool_val', [
+    ('hotdog.mp4', True),
+    ('hotdog.h265.mp4', True),
+    ('hotdog.mov', False),
+])
+def test_is_streamable_mp4_files(storage_path, filename, bool_val):
+    with open("%s/%s" % (storage_path, filename), mode="rb") as f:
+        assert is_streamable_mp4(f.read()) is bool_val
+
+
+@pytest.mark.parametrize('filename', [
+    'hotdog.mp4',
+    'hotdog.h265.mp4',
+    'hotdog.mov',
+])
+def test_probe_mp4_matches_ffprobe(storage_path, filename):
+    with open("%s/%s" % (storage_path, filename), mode="rb") as f:
+        buf = f.read()
+    probe_data = probe_mp4(buf)
+    ffprobe_data = ffprobe(buf)
+    for key, value in probe_data.items():
+        assert ffprobe_data[key] == value, key
+
+
+@pytest.mark.parametrize('ext', ['mp4', 'mov'])
+def test_probe_mp4_with_audio_matches_ffprobe(audio_videos, ext):
+    buf = audio_videos[ext]
+    probe_data = probe_mp4(buf)
+    ffprobe_data = ffprobe(buf)
+    assert probe_data['duration'] == '3.500000'
+    for key, value in probe_data.items():
+        assert ffprobe_data[key] == value, key
+
+
+@pytest.mark.parametrize('filename', [
+    'tearing-me-apart.m4a',
+    'corrupt.mp4',
+    'corrupt2.mp4',
+])
+def test_probe_mp4_unsupported_files(storage_path, filename):
+    with open("%s/%s" % (storage_path, filename), mode="rb") as f:
+        buf = f.read()
+    with pytest.raises(Mp4ParseError):
+        probe_mp4(buf)
+
+
+@pytest.mark.parametrize('buf', [
+    # moov box larger than the buffer
+    b'\x00\x00\x00\x08ftyp\x00\x00\x01\x00moov',
+    # moov without an mvhd
+    b'\x00\x00\x00\x08ftyp\x00\x00\x00\x10moov\x00\x00\x00\x08free',
+    # box size smaller than its header
+    b'\x00\x00\x00\x04moov',
+])
+def test_probe_mp4_invalid_boxes(buf):
+    with pytest.raises(Mp4ParseError):
+        probe_mp4(buf)
+
+
+def test_probe_mp4_truncated(mp4_buffer):
+    moov_start = mp4_buffer.index(b'moov') - 4
+    with pytest.raises(Mp4ParseError):
+        probe_mp4(mp4_buffer[:moov_start + 200])
+
+
+def ebml(element_id, payload):
+    """Encodes an EBML element with an 8-byte size field"""
+    return element_id + b'\x01' + pack('>Q', len(payload))[1:] + payload
+
+
+def make_webm(default_duration=b'\x01\xc9\xc3\x9e', duration=True,
+              doc_type=b'webm', segment_size=None):
+    info = ebml(b'\x2a\xd7\xb1', b'\x0f\x42\x40')
+    if duration:
+        info += ebml(b'\x44\x89', pack('>d', 1260.0))
+    video = ebml(b'\xb0', b'\x00\xc8') + ebml(b'\xba', b'\x00\x96')
+    track = (
+        ebml(b'\x83', b'\x01') + ebml(b'\x86', b'V_VP8')
+        + ebml(b'\xe0', video))
+    if default_duration:
+        track += ebml(b'\x23\xe3\x83', default_duration)
+    segment = (
+        ebml(b'\x15\x49\xa9\x66', info)
+        + ebml(b'\x16\x54\xae\x6b', ebml(b'\xae', track))
+        + ebml(b'\x1f\x43\xb6\x75', b'\x00' * 16))
+    header = ebml(b'\x1a\x45\xdf\xa3', ebml(b'\x42\x82', doc_type))
+    if segment_size is None:
+        return header + ebml(b'\x18\x53\x80\x67', segment)
+    return header + b'\x18\x53\x80\x67' + segment_size + segment
+
+
+def test_probe_webm_matches_ffprobe(storage_path):
+    with open("%s/hotdog.webm" % storage_path, mode="rb") as f:
+        buf = f.read()
+    probe_data = probe_webm(buf)
+    ffprobe_data = ffprobe(buf)
+    for key, value in probe_data.items():
+        assert ffprobe_data[key] == value, key
+
+
+@pytest.mark.parametrize('default_duration,avg_frame_rate', [
+    (b'\x01\xc9\xc3\x9e', '100/3'),
+    (b'\x02\x7c\x6b\x2d', '24000/1001'),
+    (b'\x02\x62\x5a\x00', '25/1'),
+])
+def test_probe_webm_frame_rate(default_duration, avg_frame_rate):
+    probe_data = probe_webm(make_webm(default_duration=default_duration))
+    assert probe_data == {
+        'width': 200,
+        'height': 150,
+        'duration': '1.260000',
+        'avg_frame_rate': avg_frame_rate,
+        'codec_name': 'vp8',
+    }
+
+
+def test_probe_webm_unknown_segment_size():
+    buf = make_webm(segment_size=b'\x01\xff\xff\xff\xff\xff\xff\xff')
+    assert probe_webm(buf)['width'] == 200
+
+
+@pytest.mark.parametrize('buf', [
+    b'',
+    b'GIF89a\xc8\x00\x96\x00\x00\x00\x00\x00',
+    make_webm(doc_type=b'mkv3d'),
+    # live-muxed file without a Segment duration
+    make_webm(duration=False, segment_size=b'\x01\xff\xff\xff\xff\xff\xff\xff'),
+    make_webm(default_duration=None),
+    make_webm()[:60],
+])
+def test_probe_webm_unsupported(buf):
+    with pytest.raises(WebmParseError):
+        probe_webm(buf)
+
+
+def ffprobe_keyframes(buf):
+    result = run([
+        'ffprobe', '-v', 'error', '-select_streams', 'v',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', '-i', 'pipe:0',
+    ], input=buf, capture_output=True, check=True)
+    packets = [line.split(b',') for line in result.stdout.split()]
+    return sorted(float(pts_time) for pts_time, flags in packets if b'K' in flags)
+
+
+@pytest.mark.parametrize('ext', ['mp4', 'webm'])
+def test_keyframes_match_ffprobe(keyframe_videos, ext):
+    buf = keyframe_videos[ext]
+    index = (mp4_keyframes if ext == 'mp4' else webm_keyframes)(buf)
+    assert index.times == ffprobe_keyframes(buf) == [0, 1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize('ext', ['mp4', 'mov'])
+def test_mp4_keyframes_with_audio_match_ffprobe(audio_videos, ext):
+    buf = audio_videos[ext]
+    times = ffprobe_keyframes(buf)
+    assert mp4_keyframes(buf).times == [t - times[0] for t in times]
+
+
+@pytest.mark.parametrize('filename', ['hotdog.mp4', 'hotdog.mov', 'hotdog.h265.mp4'])
+def test_mp4_keyframes_fixtures(storage_path, filename):
+    with open('%s/%s' % (storage_path, filename), mode='rb') as f:
+        assert mp4_keyframes(f.read()).times == [0]
+
+
+def test_webm_keyframes_offsets(keyframe_videos):
+    buf = keyframe_videos['webm']
+    index = webm_keyframes(buf)
+    # the cues point at clusters, which follow the headers
+    assert index.header_size == index.offsets[0]
+    for offset in index.offsets:
+        assert buf[offset:offset + 4] == b'\x1f\x43\xb6\x75'
+
+
+def test_webm_keyframes_without_cues(webm_buffer):
+    # a live-muxed file: a Segment of unknown size, without Cues
+    buf = run([
+        'ffmpeg', '-v', 'error', '-i', 'pipe:0', '-c', 'copy', '-live', '1',
+        '-f', 'webm', 'pipe:1',
+    ], input=webm_buffer, capture_output=True, check=True).stdout
+    with pytest.raises(WebmParseError):
+        webm_keyframes(buf)
+
+
+def test_iter_rgba_mkv(ffmpeg_path):
+    frames = [(bytes([i]) * (3 * 2 * 4), duration)
+              for i, duration in enumerate([120, 30, 30])]
+    buf = b"".join(iter_rgba_mkv((3, 2), frames))
+
+    proc = run([
+        ffmpeg_path.replace('ffmpeg', 'ffprobe'), '-v', 'error', '-f', 'matroska',
+        '-show_entries', 'frame=pts,duration', '-of', 'csv=p=0', '-i', 'pipe:0',
+    ], input=buf, capture_output=True, check=True)
+    assert proc.stdout.split() == [b'0,120', b'120,30', b'150,30']
+
+    proc = run([
+        ffmpeg_path, '-v', 'error', '-f', 'matroska', '-i', 'pipe:0',
+        '-fps_mode', 'passthrough', '-f', 'rawvideo', '-pix_fmt', 'rgba', 'pipe:1',
+    ], input=buf, capture_output=True, check=True)
+    assert proc.stdout == b"".join(data for data, _ in frames)
+
+
+def pil_image(fmt, frames=1, **save_kwargs):
+    ims = [Image.new('RGB', (4, 4), color) for color in ['red', 'blue'][:frames]]
+    buf = BytesIO()
+    ims[0].save(buf, fmt, save_all=frames > 1, append_images=ims[1:], **save_kwargs)
+    return buf.getvalue()
+
+
+def ftyp(major_brand, *compatible_brands):
+    payload = major_brand + b'\x00\x00\x00\x00' + b''.join(compatible_brands)
+    return pack('>I', 8 + len(payload)) + b'ftyp' + payload
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('hotdog.gif', True),
+    ('hotdog-still.gif', False),
+    ('hotdog.webp', True),
+    ('hotdog.png', False),
+    ('hotdog.mp4', False),
+])
+def test_is_animated_fixtures(storage_path, name, expected):
+    with open('%s/%s' % (storage_path, name), mode='rb') as f:
+        buf = f.read()
+    assert is_animated(buf) is expected
+
+
+@pytest.mark.parametrize('buf,expected', [
+    (pil_image('WEBP'), False),
+    (pil_image('WEBP', exif=b'Exif\x00\x00'), False),
+    (pil_image('PNG', frames=2), True),
+    (pil_image('PNG', frames=2)[:80], True),
+    (ftyp(b'avis', b'avif', b'mif1'), True),
+    (ftyp(b'avif', b'mif1', b'avis'), True),
+    (ftyp(b'avif', b'mif1', b'miaf'), False),
+    (b'', False),
+    (b'not an image', False),
+])
+def test_is_animated(buf, expected):
+    assert is_animated(buf) is expected
+
+
+def test_is_animated_reads_webp_header_only(storage_path):
+    with open('%s/hotdog.webp' % storage_path, mode='rb') as f:
+        assert is_animated(f.read(32))
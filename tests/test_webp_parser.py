@@ -0,0 +1,143 @@
+import os
+from fractions import Fraction
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageSequence
+
+from thumbor_video_engine.engines.ffmpeg import Engine as FFmpegEngine
+from thumbor_video_engine.utils import WebpParseError, parse_webp
+
+
+def load_fixture(storage_path, name):
+    with open(os.path.join(storage_path, name), mode="rb") as f:
+        return f.read()
+
+
+def pil_webp(frames, **save_kwargs):
+    buf = BytesIO()
+    frames[0].save(buf, "WEBP", save_all=True, append_images=frames[1:], **save_kwargs)
+    return buf.getvalue()
+
+
+def solid_frames(count, size=(16, 16), mode="RGB"):
+    colors = ["red", "green", "blue", "yellow", "purple", "orange"]
+    return [Image.new(mode, size, colors[i % len(colors)]) for i in range(count)]
+
+
+def pil_metadata(buf):
+    im = Image.open(BytesIO(buf))
+    durations = []
+    for frame in ImageSequence.Iterator(im):
+        frame.load()
+        durations.append(im.info["duration"])
+    return im.size, durations, im.info.get("loop")
+
+
+@pytest.mark.parametrize("name", [
+    "hotdog.webp", "pbj-time.webp", "hotdog-variable-frame-durations.webp"])
+def test_matches_pillow_on_fixtures(storage_path, name):
+    buf = load_fixture(storage_path, name)
+    info = parse_webp(buf)
+    size, durations, loop = pil_metadata(buf)
+
+    assert info.is_animated
+    assert (info.width, info.height) == size
+    assert info.delays_ms == durations
+    assert info.loop_count == loop
+
+
+def test_parses_hotdog(storage_path):
+    info = parse_webp(load_fixture(storage_path, "hotdog.webp"))
+
+    assert info.frame_count == 42
+    assert info.total_pixels == 200 * 150 * 42
+    assert info.is_uniform_delay
+    assert info.uniform_fps == Fraction(100, 3)
+    assert info.duration == Fraction(126, 100)
+    assert info.has_alpha
+
+
+def test_variable_delays(storage_path):
+    info = parse_webp(load_fixture(storage_path, "hotdog-variable-frame-durations.webp"))
+
+    assert info.delays_ms[:2] == [120, 30]
+    assert not info.is_uniform_delay
+    assert info.uniform_fps is None
+    assert not info.has_alpha
+
+
+def test_frame_offsets_and_flags(storage_path):
+    # pbj-time.webp is made of sub-frames at offsets, without blending
+    frame = parse_webp(load_fixture(storage_path, "pbj-time.webp")).frames[1]
+
+    assert (frame.x, frame.y, frame.width, frame.height) == (34, 18, 155, 182)
+    assert (frame.blend, frame.dispose, frame.alpha) == (False, False, True)
+
+
+@pytest.mark.parametrize("n", [2, 5])
+@pytest.mark.parametrize("kwargs", [
+    {"duration": 40},
+    {"duration": [10, 20, 30, 40, 50], "loop": 3},
+    {"duration": 70, "lossless": True},
+])
+def test_matches_pillow_across_matrix(n, kwargs):
+    if isinstance(kwargs["duration"], list):
+        kwargs = dict(kwargs, duration=kwargs["duration"][:n])
+    buf = pil_webp(solid_frames(n, mode="RGBA"), **kwargs)
+    info = parse_webp(buf)
+    size, durations, loop = pil_metadata(buf)
+
+    assert (info.width, info.height) == size
+    assert info.delays_ms == durations
+    assert info.loop_count == loop
+
+
+@pytest.mark.parametrize("mode,kwargs,alpha", [
+    ("RGB", {}, False),
+    ("RGBA", {}, True),
+    ("RGB", {"lossless": True}, False),
+    ("RGBA", {"lossless": True}, True),
+    # a VP8X header, for the exif chunk
+    ("RGBA", {"exif": b"Exif\x00\x00"}, True),
+])
+def test_still_image(mode, kwargs, alpha):
+    buf = BytesIO()
+    Image.new(mode, (10, 7)).save(buf, "WEBP", **kwargs)
+    info = parse_webp(buf.getvalue())
+
+    assert not info.is_animated
+    assert (info.width, info.height, info.frame_count) == (10, 7, 1)
+    assert info.delays_ms == [0]
+    assert info.has_alpha is alpha
+
+
+@pytest.mark.parametrize("buf", [
+    b"",
+    b"GIF89a\x01\x00\x01\x00\x00\x00\x00",
+    b"RIFF\x04\x00\x00\x00WAVE",
+    # a VP8X header claiming an animation, without any frames
+    b"RIFF\x16\x00\x00\x00WEBPVP8X\x0a\x00\x00\x00\x02\x00\x00\x00\x09\x00\x00\x09\x00\x00",
+])
+def test_invalid_raises(buf):
+    with pytest.raises(WebpParseError):
+        parse_webp(buf)
+
+
+def test_truncated_raises(storage_path):
+    buf = load_fixture(storage_path, "hotdog.webp")
+    with pytest.raises(WebpParseError):
+        parse_webp(buf[:len(buf) // 2])
+
+
+def test_probe_does_not_decode_frames(mocker, context, storage_path):
+    buf = load_fixture(storage_path, "hotdog-variable-frame-durations.webp")
+    iterator_spy = mocker.spy(ImageSequence, "Iterator")
+
+    engine = FFmpegEngine(context)
+    engine.load(buf, ".webp")
+
+    assert iterator_spy.call_count == 0
+    assert engine.original_size == (200, 150)
+    assert engine.frame_durations[:2] == [120, 30]
+    assert engine.duration == parse_webp(buf).duration